@@ -0,0 +1,184 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Headless batch mode. Processes data files with the batch function of a plugin (see core.Plugin) without
+starting the GUI. Uses the same settings.ini, user profile and settings files as the GUI.
+
+Example (all ferrybox files from 2019 using four processes):
+    python gismo_gui_tkinter/batch.py ferrybox "D:/data/ferrybox/2019/*.txt" --workers 4
+"""
+import os
+import sys
+import glob
+import argparse
+import importlib
+import traceback
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import core
+from core.exceptions import *
+
+import plugins
+
+logger = logging.getLogger('gismo_main')
+
+# Plugins without manifest are not imported (they import the GUI). Batch mode needs a manifest with "BATCH".
+PLUGINS = core.get_plugins(os.path.dirname(os.path.abspath(plugins.__file__)), plugins.PLUGIN_LIST,
+                           manifest_only=True)
+
+
+def get_file_paths(file_patterns):
+    """
+    Returns a sorted list of the files matching any of the given file paths or glob patterns.
+    :param file_patterns:
+    :return:
+    """
+    file_paths = set()
+    for pattern in file_patterns:
+        file_paths.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(file_paths)
+
+
+def _process_file(module_name, function_name, file_path, kwargs):
+    """
+    Runs in a worker process. Returns (file_path, list of created files, error text).
+    """
+    try:
+        function = getattr(importlib.import_module(module_name), function_name)
+        return file_path, function(file_path, **kwargs) or [], None
+    except Exception:
+        return file_path, [], traceback.format_exc()
+
+
+class BatchRunner(object):
+    """
+    Loads settings, user profile and settings file for a plugin and processes files in a process pool.
+    """
+    def __init__(self, plugin_name, root_directory=None, user_name=None, settings_file=None,
+                 output_directory=None):
+        """
+        :param plugin_name:
+        :param root_directory: Defaults to the directory of this file
+        :param user_name: Defaults to "Startup user" in settings
+        :param settings_file: Name (or path) of the settings file. Defaults to "default_settings_file" in
+                              the plugin manifest.
+        :param output_directory: Defaults to "Export directory" in settings
+        """
+        self.root_directory = root_directory or os.path.dirname(os.path.abspath(__file__))
+        self.plugin = PLUGINS.get(plugin_name)
+        if not self.plugin:
+            raise GUIExceptionBatchError('Unknown plugin or plugin without manifest: {}'.format(plugin_name))
+        self.module_name, self.function_name = self.plugin.get_batch_function_name()
+
+        self.settings = core.Settings(default_settings_file_path=os.path.join(self.root_directory,
+                                                                              'system/settings.ini'),
+                                      root_directory=self.root_directory)
+        self.user_name = user_name or self.settings.get('user', {}).get('Startup user', 'default')
+        self.user_settings = self._load_user_settings()
+        self.settings_file_path = self._get_settings_file_path(settings_file)
+        self.output_directory = output_directory or self.settings['directory']['Export directory']
+
+    def _load_user_settings(self):
+        """
+        Returns a dict with the data of all user settings of the plugin for the user.
+        The users are opened read only: no user or settings file is created and the active user is not changed.
+        """
+        users_directory = self.plugin.INFO.get('users_directory', 'users')
+        if not users_directory:
+            return {}
+        users_directory = os.path.join(self.plugin.directory, users_directory)
+        user_manager = core.UserManager(users_directory, read_only=True)
+        user_manager.set_users_directory(users_directory)
+        for settings_type, settings_name, *options in self.plugin.USER_SETTINGS:
+            user_manager.add_user_settings(users_directory=users_directory,
+                                           settings_type=settings_type,
+                                           settings_name=settings_name,
+                                           **(options[0] if options else {}))
+        user = user_manager.users.get(self.user_name)
+        if not user:
+            raise GUIExceptionBatchError('Unknown user for plugin {}: {}'.format(self.plugin.name, self.user_name))
+        return {name: obj.get_settings() for name, obj in user.settings.items()}
+
+    def _get_settings_file_path(self, settings_file):
+        settings_file = settings_file or self.plugin.BATCH.get('default_settings_file')
+        if not settings_file:
+            return None
+        if os.path.isfile(settings_file):
+            return settings_file
+        settings_directory = os.path.join(self.plugin.directory,
+                                          self.plugin.BATCH.get('settings_directory', 'settings_files'))
+        file_path = core.SettingsFiles(settings_directory).get_path(settings_file)
+        if not file_path:
+            raise GUIExceptionBatchError('Could not find settings file: {}'.format(settings_file))
+        return file_path
+
+    def get_file_paths(self, file_patterns=None):
+        """
+        Returns the files to process. If no patterns are given the "file_patterns" of the plugin manifest
+        are used in the "Input directory" given in settings.
+        """
+        if not file_patterns:
+            input_directory = self.settings['directory']['Input directory']
+            file_patterns = [os.path.join(input_directory, pattern)
+                             for pattern in self.plugin.BATCH.get('file_patterns', ['*'])]
+        return get_file_paths(file_patterns)
+
+    def run(self, file_paths, max_workers=None):
+        """
+        Processes all files. Returns a dict with the created files per processed file and a dict with the
+        error text per failed file.
+        :param file_paths:
+        :param max_workers: Defaults to number of cpus
+        :return:
+        """
+        kwargs = dict(output_directory=self.output_directory,
+                      settings_file_path=self.settings_file_path,
+                      user_settings=self.user_settings)
+        if not os.path.exists(self.output_directory):
+            os.makedirs(self.output_directory)
+        created = {}
+        errors = {}
+        logger.info('Batch %s: processing %s files', self.plugin.name, len(file_paths))
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(_process_file, self.module_name, self.function_name, file_path, kwargs)
+                       for file_path in file_paths]
+            for nr, future in enumerate(futures):
+                file_path, created_files, error = future.result()
+                if error:
+                    errors[file_path] = error
+                    logger.error('Batch %s: could not process %s\n%s', self.plugin.name, file_path, error)
+                else:
+                    created[file_path] = created_files
+                    logger.info('Batch %s: %s/%s %s', self.plugin.name, nr + 1, len(file_paths), file_path)
+        return created, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Process data files without GUI')
+    parser.add_argument('plugin', help='Plugin with batch function, one of: {}'.format(', '.join(PLUGINS)))
+    parser.add_argument('files', nargs='*', help='Files or glob patterns. Defaults to the plugin file patterns '
+                                                 'in "Input directory"')
+    parser.add_argument('--user', help='Defaults to "Startup user" in settings')
+    parser.add_argument('--settings-file', help='Name or path of the settings file')
+    parser.add_argument('--output-directory', help='Defaults to "Export directory" in settings')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes, defaults to number of cpus')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    runner = BatchRunner(args.plugin,
+                         user_name=args.user,
+                         settings_file=args.settings_file,
+                         output_directory=args.output_directory)
+    file_paths = runner.get_file_paths(args.files)
+    if not file_paths:
+        logger.warning('No files to process')
+        return 1
+    created, errors = runner.run(file_paths, max_workers=args.workers)
+    print('Processed {} files, {} failed. Output in: {}'.format(len(created), len(errors), runner.output_directory))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,4 +11,24 @@ from .user import UserManager
 
 from .mappings import Colormaps
 
+from .parameters import ParameterCatalogue
+
+from .time_index import TimeIndex, get_time_index, clear_time_index
+
+from .data_cache import ParsedDataCache
+
+from .plugins import Plugin, get_plugins
+
+from .profiler import start_startup_profiler, get_startup_profiler, profile_phase
+
+from .tasks import TaskExecutor
+
+from .utils import get_sorted_list_changes
+
+from .html_export import HTMLExporter, HTMLExportJob
+
+from .log_handling import LogManager
+
+from .diagnostics import SessionDiagnostics, get_figure_counts
+
 from . import texts
\ No newline at end of file
@@ -0,0 +1,284 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Persistent cache of parsed data files. A parsed file (a pandas DataFrame) is stored with one .npy file per
+column and is memory-mapped (copy on write) when loaded again. The cache key is the hash of the file content
+together with the hash of the settings file and the name and version of the parser, so a moved file is still
+found and a changed file, settings file or parser gives a new entry.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from core.utils import atomic_write_json
+
+import logging
+
+gui_logger = logging.getLogger('gui_logger')
+
+
+def get_file_hash(file_path, block_size=2**20):
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as fid:
+        for block in iter(lambda: fid.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def get_parser_id(parse_function, parser_version=None):
+    """
+    Returns a string identifying the parser, e.g. "plugins.ferrybox.io:read_file:1.2".
+    :param parse_function:
+    :param parser_version: e.g. the plugin version. Should be changed when the parsing changes.
+    :return:
+    """
+    name = getattr(parse_function, '__qualname__', None) or getattr(parse_function, '__name__', '')
+    return '{}:{}:{}'.format(getattr(parse_function, '__module__', ''), name, parser_version or '')
+
+
+def _encode_column(values):
+    """
+    Returns (array, mask, kind) for a column. mask is a boolean array of missing values for string columns,
+    otherwise None. Raises ValueError if the column can not be stored without pickle.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        array, mask, kind = _encode_column(values.astype(object))
+        return array, mask, 'category'
+    if values.dtype.kind in 'biufcmM':
+        return np.ascontiguousarray(values.to_numpy()), None, 'numeric'
+    if values.dtype.kind == 'O' or str(values.dtype) == 'string':
+        values = values.astype(object)
+        mask = values.isna().to_numpy()
+        strings = values.where(~mask, '')
+        if not all(isinstance(value, str) for value in strings):
+            raise ValueError('Column {} has mixed types'.format(values.name))
+        return np.array(strings.tolist(), dtype=str), mask, 'string'
+    raise ValueError('Column {} has unsupported dtype {}'.format(values.name, values.dtype))
+
+
+def _decode_column(array, mask, kind):
+    if kind == 'numeric':
+        return array
+    values = pd.Series(np.asarray(array), dtype=object)
+    if mask is not None and mask.any():
+        values[np.asarray(mask)] = np.nan
+    if kind == 'category':
+        return values.astype('category')
+    return values.to_numpy()
+
+
+class ParsedDataCache(object):
+    """
+    Content addressed cache of parsed data files. Use get(file_path, parse_function, settings_file_path) to
+    load a file, parse_function is only called if the file (with the settings file) is not in the cache.
+    File hashes are kept in an index with modification time and size, so unchanged files are not read again.
+    If max_size_mb is given the least recently used entries are removed when the cache grows larger.
+    """
+    version = 1
+    index_file_name = 'index.json'
+
+    def __init__(self, cache_directory, max_size_mb=0):
+        """
+        :param cache_directory:
+        :param max_size_mb: 0 means no limit
+        """
+        self.directory = cache_directory
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.index_file_path = os.path.join(self.directory, self.index_file_name)
+        # file path -> dict(mtime, size, hash)
+        self.file_hashes = {}
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_file_path):
+            return
+        try:
+            with open(self.index_file_path, encoding='utf8') as fid:
+                data = json.load(fid)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == self.version:
+            self.file_hashes = data.get('files', {})
+
+    def _save_index(self):
+        atomic_write_json(self.index_file_path, dict(version=self.version, files=self.file_hashes))
+
+    def get_file_hash(self, file_path):
+        """
+        Returns the hash of the file content. The file is only read if it is new or changed since last time.
+        :param file_path:
+        :return:
+        """
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        item = self.file_hashes.get(file_path)
+        if item and item['mtime'] == stat.st_mtime and item['size'] == stat.st_size:
+            return item['hash']
+        file_hash = get_file_hash(file_path)
+        self.file_hashes[file_path] = dict(mtime=stat.st_mtime, size=stat.st_size, hash=file_hash)
+        self._save_index()
+        return file_hash
+
+    def get_key(self, file_path, settings_file_path=None, parser_id=''):
+        """
+        Returns the cache key for the file parsed with the given settings file and parser.
+        :param file_path:
+        :param settings_file_path:
+        :param parser_id: See get_parser_id
+        :return:
+        """
+        parts = [str(self.version), parser_id or '', self.get_file_hash(file_path)]
+        if settings_file_path:
+            parts.append(self.get_file_hash(settings_file_path))
+        return hashlib.sha1('_'.join(parts).encode('utf8')).hexdigest()
+
+    def _get_entry_directory(self, key):
+        return os.path.join(self.directory, key)
+
+    def load(self, file_path, settings_file_path=None, parser_id='', mmap=True):
+        """
+        Returns the cached DataFrame for the file, None if not in the cache.
+        :param file_path:
+        :param settings_file_path:
+        :param parser_id:
+        :param mmap: If True numeric columns are memory-mapped instead of read into memory. The mapping is
+                     copy on write, so the data can be changed as parsed data (changes are not written to the
+                     cache).
+        :return:
+        """
+        entry_directory = self._get_entry_directory(self.get_key(file_path, settings_file_path, parser_id))
+        meta_file_path = os.path.join(entry_directory, 'meta.json')
+        if not os.path.exists(meta_file_path):
+            return None
+        try:
+            with open(meta_file_path, encoding='utf8') as fid:
+                meta = json.load(fid)
+            mmap_mode = 'c' if mmap else None
+            columns = {}
+            for nr, column in enumerate(meta['columns']):
+                array = np.load(os.path.join(entry_directory, '{}.npy'.format(nr)), mmap_mode=mmap_mode)
+                mask = None
+                if column['has_mask']:
+                    mask = np.load(os.path.join(entry_directory, '{}_mask.npy'.format(nr)))
+                columns[nr] = _decode_column(array, mask, column['kind'])
+        except (OSError, ValueError, KeyError) as e:
+            gui_logger.warning('Could not load cached data for %s: %s', file_path, e)
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            return None
+        # Mark as recently used
+        os.utime(meta_file_path)
+
+        index = None
+        if meta['index'] is not None:
+            index = pd.Index(columns.pop(meta['index']), name=meta['index_name'])
+        df = pd.DataFrame(columns, index=index, copy=False)
+        df.columns = [column['name'] for column in meta['columns'] if column['nr'] != meta['index']]
+        gui_logger.debug('Loaded %s from parsed data cache', file_path)
+        return df
+
+    def save(self, file_path, df, settings_file_path=None, parser_id=''):
+        """
+        Stores the parsed data. Returns True if stored, False if the data can not be stored (e.g. columns
+        with mixed types).
+        :param file_path:
+        :param df: pandas DataFrame
+        :param settings_file_path:
+        :param parser_id:
+        :return:
+        """
+        key = self.get_key(file_path, settings_file_path, parser_id)
+        entry_directory = self._get_entry_directory(key)
+        if os.path.exists(entry_directory):
+            return True
+        columns = [(name, df.iloc[:, nr]) for nr, name in enumerate(df.columns)]
+        index_nr = None
+        if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+            index_nr = len(columns)
+            columns.append((df.index.name, df.index.to_series()))
+
+        temp_directory = tempfile.mkdtemp(prefix='.{}.'.format(key), dir=self.directory)
+        try:
+            meta_columns = []
+            for nr, (name, values) in enumerate(columns):
+                array, mask, kind = _encode_column(values)
+                np.save(os.path.join(temp_directory, '{}.npy'.format(nr)), array, allow_pickle=False)
+                if mask is not None:
+                    np.save(os.path.join(temp_directory, '{}_mask.npy'.format(nr)), mask, allow_pickle=False)
+                meta_columns.append(dict(nr=nr, name=name, kind=kind, has_mask=mask is not None))
+            atomic_write_json(os.path.join(temp_directory, 'meta.json'),
+                              dict(file_path=os.path.abspath(file_path),
+                                   settings_file_path=settings_file_path,
+                                   parser_id=parser_id,
+                                   created=time.strftime('%Y-%m-%d %H:%M:%S'),
+                                   columns=meta_columns,
+                                   index=index_nr,
+                                   index_name=df.index.name))
+            os.replace(temp_directory, entry_directory)
+        except (OSError, ValueError, TypeError) as e:
+            gui_logger.debug('Could not store %s in parsed data cache: %s', file_path, e)
+            shutil.rmtree(temp_directory, ignore_errors=True)
+            return False
+        self._remove_old_entries(keep=key)
+        return True
+
+    def get(self, file_path, parse_function, settings_file_path=None, parser_version=None, mmap=True):
+        """
+        Returns the data for the file from the cache or parsed with parse_function(file_path) (and then stored).
+        :param file_path:
+        :param parse_function: Returns a pandas DataFrame. Its module and name are part of the cache key.
+        :param settings_file_path: The settings file used when parsing, part of the cache key
+        :param parser_version: e.g. the plugin version, part of the cache key
+        :param mmap:
+        :return:
+        """
+        parser_id = get_parser_id(parse_function, parser_version)
+        df = self.load(file_path, settings_file_path=settings_file_path, parser_id=parser_id, mmap=mmap)
+        if df is not None:
+            return df
+        df = parse_function(file_path)
+        self.save(file_path, df, settings_file_path=settings_file_path, parser_id=parser_id)
+        return df
+
+    def _get_entries(self):
+        """
+        Returns a list of (last used time, size, directory) for all entries.
+        """
+        entries = []
+        with os.scandir(self.directory) as items:
+            for item in items:
+                if not item.is_dir() or item.name.startswith('.'):
+                    continue
+                meta_file_path = os.path.join(item.path, 'meta.json')
+                if not os.path.exists(meta_file_path):
+                    continue
+                size = sum(entry.stat().st_size for entry in os.scandir(item.path))
+                entries.append((os.path.getmtime(meta_file_path), size, item.path))
+        return entries
+
+    def _remove_old_entries(self, keep=None):
+        if not self.max_size:
+            return
+        entries = sorted(self._get_entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, directory in entries:
+            if total_size <= self.max_size:
+                break
+            if os.path.basename(directory) == keep:
+                continue
+            shutil.rmtree(directory, ignore_errors=True)
+            total_size -= size
+            gui_logger.debug('Removed %s from parsed data cache', directory)
+
+    def clear(self):
+        for _, _, directory in self._get_entries():
+            shutil.rmtree(directory, ignore_errors=True)
+        self.file_hashes = {}
+        self._save_index()
@@ -0,0 +1,173 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Session diagnostics. Records memory (tracemalloc snapshot diffs), widget counts and matplotlib figure counts
+at events like page navigation and user change, to find what grows during long sessions.
+"""
+import gc
+import sys
+import time
+import datetime
+import tracemalloc
+from collections import deque
+
+import logging
+
+logger = logging.getLogger('gismo_main')
+
+
+def get_figure_counts():
+    """
+    Returns a dict with the number of matplotlib figures handled by pyplot and the number of Figure objects
+    that are alive. Figures that are alive but not in use (e.g. in destroyed pages) are leaks.
+    matplotlib is not imported if it is not already loaded.
+    """
+    counts = dict(pyplot=0, alive=0)
+    figure_module = sys.modules.get('matplotlib.figure')
+    if figure_module is None:
+        return counts
+    pylab_helpers = sys.modules.get('matplotlib._pylab_helpers')
+    if pylab_helpers is not None:
+        counts['pyplot'] = pylab_helpers.Gcf.get_num_fig_managers()
+    gc.collect()
+    counts['alive'] = sum(1 for obj in gc.get_objects() if isinstance(obj, figure_module.Figure))
+    return counts
+
+
+class SessionDiagnostics(object):
+    """
+    Each call to record takes a tracemalloc snapshot and compares it with the snapshot of the previous record.
+    Widget counts are given by the caller (see gui.get_widget_counts) so that this class does not depend on tkinter.
+    """
+    def __init__(self, nr_top_stats=10, max_records=200, nr_frames=1):
+        """
+        :param nr_top_stats: Number of source lines with the largest memory change to keep per record
+        :param max_records: Number of records kept in memory
+        :param nr_frames: Number of frames stored by tracemalloc per allocation
+        """
+        self.nr_top_stats = nr_top_stats
+        self.records = deque(maxlen=max_records)
+        self.nr_frames = nr_frames
+        self.started = False
+        self._started_tracemalloc = False
+        self._snapshot = None
+        self._previous_record = None
+        self._filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                         tracemalloc.Filter(False, __file__),
+                         tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                         tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+                         tracemalloc.Filter(False, '<unknown>')]
+
+    def start(self):
+        if self.started:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.nr_frames)
+            self._started_tracemalloc = True
+        self._snapshot = self._take_snapshot()
+        self.started = True
+
+    def stop(self):
+        if not self.started:
+            return
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        self._snapshot = None
+        self.started = False
+
+    def _take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(self._filters)
+
+    def record(self, event, page_name=None, widget_counts=None, figure_counts=None):
+        """
+        Records memory, widget and figure counts. Returns the record (a dict).
+        :param event: e.g. "show_frame", "startup_pages" or "change_user"
+        :param page_name: Active page
+        :param widget_counts: dict with number of widgets per page (and "total")
+        :param figure_counts: Defaults to get_figure_counts()
+        :return:
+        """
+        if not self.started:
+            return None
+        t0 = time.perf_counter()
+        if not tracemalloc.is_tracing():
+            # Stopped by someone else (e.g. the startup profiler). Memory is counted from here.
+            tracemalloc.start(self.nr_frames)
+            self._started_tracemalloc = True
+            self._snapshot = self._take_snapshot()
+        snapshot = self._take_snapshot()
+        stats = snapshot.compare_to(self._snapshot, 'lineno')
+        self._snapshot = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+
+        widget_counts = dict(widget_counts or {})
+        figure_counts = figure_counts if figure_counts is not None else get_figure_counts()
+        previous = self._previous_record or {}
+        previous_widget_counts = previous.get('widget_counts', {})
+        previous_figure_counts = previous.get('figure_counts', {})
+
+        record = dict(time=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                      event=event,
+                      page_name=page_name,
+                      memory=current,
+                      memory_peak=peak,
+                      memory_diff=sum(stat.size_diff for stat in stats),
+                      top_stats=[dict(location='{}:{}'.format(stat.traceback[0].filename, stat.traceback[0].lineno),
+                                      size_diff=stat.size_diff,
+                                      count_diff=stat.count_diff)
+                                 for stat in stats[:self.nr_top_stats] if stat.size_diff],
+                      widget_counts=widget_counts,
+                      widget_diff={key: value - previous_widget_counts.get(key, 0)
+                                   for key, value in widget_counts.items()
+                                   if value != previous_widget_counts.get(key, 0)},
+                      figure_counts=figure_counts,
+                      figure_diff={key: value - previous_figure_counts.get(key, 0)
+                                   for key, value in figure_counts.items()})
+        record['duration'] = time.perf_counter() - t0
+        self.records.append(record)
+        self._previous_record = record
+        logger.debug('Diagnostics %s (%s): memory %.1f MB (%+.1f kB), widgets %s (%+d), figures %s',
+                     event, page_name, current / 1e6, record['memory_diff'] / 1e3,
+                     widget_counts.get('total', '-'), record['widget_diff'].get('total', 0),
+                     figure_counts.get('alive'))
+        return record
+
+    def get_records(self):
+        return list(self.records)
+
+    @staticmethod
+    def get_record_text(record):
+        """
+        Returns a readable text for the record.
+        :param record:
+        :return:
+        """
+        lines = ['{} {} ({})'.format(record['time'], record['event'], record['page_name']),
+                 '    Memory: {:.2f} MB ({:+.1f} kB), peak {:.2f} MB'.format(record['memory'] / 1e6,
+                                                                            record['memory_diff'] / 1e3,
+                                                                            record['memory_peak'] / 1e6),
+                 '    Figures: {}'.format(', '.join('{} {} ({:+d})'.format(key, value, record['figure_diff'].get(key, 0))
+                                                    for key, value in sorted(record['figure_counts'].items())))]
+        if record['widget_counts']:
+            lines.append('    Widgets:')
+            for key, value in sorted(record['widget_counts'].items()):
+                lines.append('        {:<30} {:>8} ({:+d})'.format(key, value, record['widget_diff'].get(key, 0)))
+        if record['top_stats']:
+            lines.append('    Largest memory changes:')
+            for stat in record['top_stats']:
+                lines.append('        {:+10.1f} kB {:+8d} blocks  {}'.format(stat['size_diff'] / 1e3,
+                                                                           stat['count_diff'],
+                                                                           stat['location']))
+        return '\n'.join(lines)
+
+    def get_report_text(self):
+        return '\n\n'.join(self.get_record_text(record) for record in self.records)
+
+    def dump(self, log=None):
+        """
+        Writes all records to the log.
+        :param log: Logger to use. Defaults to gismo_main
+        :return:
+        """
+        (log or logger).info('Diagnostics report (%s records)\n%s', len(self.records), self.get_report_text())
@@ -0,0 +1,208 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Shape preserving downsampling of time series used for interactive plot exports.
+All functions return the indices of the points to keep, sorted.
+"""
+import base64
+
+import numpy as np
+
+DOWNSAMPLING_METHODS = ['lttb', 'minmax']
+
+
+def _as_float_array(x):
+    """
+    Returns x as float array. Time values (datetime64, datetime objects, iso strings) are converted to ns.
+    If x can not be converted the position in the array is used.
+    """
+    x = np.asarray(x)
+    if x.dtype.kind in 'iuf':
+        return x.astype(float)
+    try:
+        return x.astype('datetime64[ns]').astype('int64').astype(float)
+    except (ValueError, TypeError):
+        return np.arange(len(x), dtype=float)
+
+
+def lttb_indices(x, y, nr_points):
+    """
+    Largest-Triangle-Three-Buckets. Keeps the first and last point and in each bucket the point that forms the
+    largest triangle with the point kept in the previous bucket and the mean of the next bucket.
+    :param x:
+    :param y:
+    :param nr_points:
+    :return:
+    """
+    x = _as_float_array(x)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if nr_points >= n or nr_points < 3:
+        return np.arange(n)
+    bucket_edges = np.linspace(1, n - 1, nr_points - 1).astype(int)
+    indices = np.empty(nr_points, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(nr_points - 2):
+        start, end = bucket_edges[i], bucket_edges[i + 1]
+        next_start, next_end = end, bucket_edges[i + 2] if i + 2 < len(bucket_edges) else n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def minmax_indices(x, y, nr_buckets):
+    """
+    Splits the x range in nr_buckets equally wide buckets (e.g. one per pixel or time window) and keeps the
+    points with min and max y in each bucket, plus the first and last point.
+    :param x:
+    :param y:
+    :param nr_buckets:
+    :return:
+    """
+    x = _as_float_array(x)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if 2 * nr_buckets >= n:
+        return np.arange(n)
+    edges = np.linspace(np.min(x), np.max(x), nr_buckets + 1)
+    bucket = np.clip(np.searchsorted(edges, x, side='right') - 1, 0, nr_buckets - 1)
+    order = np.lexsort((y, bucket))
+    sorted_bucket = bucket[order]
+    first = np.flatnonzero(np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]])
+    last = np.r_[first[1:] - 1, len(order) - 1]
+    return np.unique(np.r_[0, order[first], order[last], n - 1])
+
+
+def downsample_indices(x, y, max_points, method='lttb', keep_mask=None):
+    """
+    Returns the indices of the points to keep when downsampling y(x) to about max_points points.
+    Points that are not finite are ignored, except the first point of each gap between finite points, which is
+    kept so that the gap is still drawn as a break in the line. Points where keep_mask is True (e.g. flagged
+    data) are always kept.
+    :param x:
+    :param y:
+    :param max_points:
+    :param method: "lttb" or "minmax"
+    :param keep_mask: boolean array, same length as y
+    :return:
+    """
+    y = np.asarray(y, dtype=float)
+    is_finite = np.isfinite(y)
+    finite = np.flatnonzero(is_finite)
+    if keep_mask is None:
+        keep = np.array([], dtype=int)
+    else:
+        keep = np.flatnonzero(np.asarray(keep_mask, dtype=bool))
+    if len(finite):
+        gap_starts = np.flatnonzero(~is_finite[1:] & is_finite[:-1]) + 1
+        keep = np.union1d(keep, gap_starts[gap_starts < finite[-1]])
+    if len(finite) + len(keep) <= max_points:
+        return np.union1d(finite, keep)
+    x_finite = np.asarray(x)[finite]
+    if method == 'lttb':
+        selected = lttb_indices(x_finite, y[finite], max_points)
+    elif method == 'minmax':
+        selected = minmax_indices(x_finite, y[finite], max(max_points // 2, 1))
+    else:
+        raise ValueError('Unknown downsampling method: {}'.format(method))
+    return np.union1d(finite[selected], keep)
+
+
+def _get_trace_array(values):
+    """
+    Returns trace values as array. Newer plotly versions give numpy arrays as typed array dicts
+    ({"dtype": ..., "bdata": ...}) in to_plotly_json.
+    """
+    if values is None or isinstance(values, str):
+        return None
+    if isinstance(values, dict):
+        if 'bdata' not in values:
+            return None
+        array = np.frombuffer(base64.b64decode(values['bdata']), dtype=values['dtype'])
+        if values.get('shape'):
+            array = array.reshape([int(v) for v in str(values['shape']).split(',')])
+        return array
+    if not np.ndim(values):
+        return None
+    return np.asarray(values)
+
+
+# Per point marker arrays with at most this many distinct values are seen as categories (e.g. flags)
+MAX_MARKER_CATEGORIES = 16
+
+
+def get_keep_mask(trace, keep_flags=None):
+    """
+    Returns a boolean array with the points in the trace that must be kept when downsampling, None if all
+    points may be removed.
+    If keep_flags is given, points where marker color, marker symbol or customdata (first column if 2D) is one
+    of keep_flags are kept. Otherwise points are kept where a categorical marker color or symbol (few distinct
+    values) differs from the most common value, i.e. points drawn differently from the rest (flagged data).
+    :param trace: plotly trace dict
+    :param keep_flags: e.g. the flag values of flagged data
+    :return:
+    """
+    n = len(_get_trace_array(trace.get('y')))
+    marker = trace.get('marker') or {}
+    arrays = [_get_trace_array(marker.get('color')), _get_trace_array(marker.get('symbol'))]
+    if keep_flags is not None:
+        customdata = _get_trace_array(trace.get('customdata'))
+        if customdata is not None and customdata.ndim > 1:
+            customdata = customdata[:, 0]
+        arrays.append(customdata)
+    mask = np.zeros(n, dtype=bool)
+    for values in arrays:
+        if values is None or values.ndim != 1 or len(values) != n:
+            continue
+        if keep_flags is not None:
+            mask |= np.isin(values, list(keep_flags))
+            continue
+        categories, counts = np.unique(values.astype(str), return_counts=True)
+        if 1 < len(categories) <= MAX_MARKER_CATEGORIES:
+            mask |= values.astype(str) != categories[np.argmax(counts)]
+    if not mask.any():
+        return None
+    return mask
+
+
+def downsample_figure(figure, max_points, method='lttb', keep_traces=[], keep_flags=None):
+    """
+    Downsamples all traces with x and y data in a plotly figure dict (in place).
+    Traces named in keep_traces are not changed. Flagged points in the other traces are always kept
+    (see get_keep_mask).
+    Returns a list with (trace name, number of points before, number of points after).
+    :param figure: dict with "data"
+    :param max_points:
+    :param method:
+    :param keep_traces:
+    :param keep_flags: see get_keep_mask
+    :return:
+    """
+    result = []
+    for trace in figure.get('data', []):
+        x = _get_trace_array(trace.get('x'))
+        y = _get_trace_array(trace.get('y'))
+        if x is None or y is None or len(y) <= max_points:
+            continue
+        name = trace.get('name', '')
+        if name in keep_traces:
+            continue
+        try:
+            index = downsample_indices(x, y, max_points, method=method,
+                                       keep_mask=get_keep_mask(trace, keep_flags=keep_flags))
+        except (ValueError, TypeError):
+            # Not numeric y values
+            continue
+        for container, keys in [(trace, ['x', 'y', 'text', 'customdata', 'hovertext']),
+                                (trace.get('marker') or {}, ['color', 'size', 'symbol'])]:
+            for key in keys:
+                values = _get_trace_array(container.get(key))
+                if values is not None and len(values) == len(y):
+                    container[key] = values[index]
+        result.append((name, len(y), len(index)))
+    return result
@@ -52,3 +52,19 @@ class GUIExceptionNoRangeSelection(GUIException):
     """
     code = ''
     message = ''
+
+
+class GUIExceptionTaskCancelled(GUIException):
+    """
+    Raised in a task running in core.TaskExecutor when the task has been cancelled.
+    """
+    code = ''
+    message = 'Task cancelled'
+
+
+class GUIExceptionBatchError(GUIException):
+    """
+    Raised when a batch run can not be started (see batch.py).
+    """
+    code = ''
+    message = ''
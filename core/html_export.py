@@ -0,0 +1,293 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+import os
+import html
+import json
+import hashlib
+import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from core.utils import atomic_write_text
+from core.downsampling import downsample_figure
+
+import logging
+
+gui_logger = logging.getLogger('gui_logger')
+
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8"/>
+<title>{title}</title>
+<script src="{plotly_js}"></script>
+</head>
+<body>
+<div id="plot" style="width:100%;height:95vh;"></div>
+<script>
+var figure = {figure_json};
+Plotly.newPlot('plot', figure.data || [], figure.layout || {{}}, {{responsive: true}});
+</script>
+</body>
+</html>
+"""
+
+
+def _get_cache_key_value(value):
+    """
+    json default for the cache key. Arrays and pandas objects are represented by a hash of their content,
+    str() would only give a truncated repr. Other objects that can not be represented by their content raise
+    TypeError.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        content_hash = hashlib.sha1(pd.util.hash_pandas_object(value).values.tobytes())
+        if isinstance(value, pd.DataFrame):
+            content_hash.update(json.dumps([list(map(str, value.columns)),
+                                            list(map(str, value.dtypes))]).encode('utf8'))
+        else:
+            content_hash.update(json.dumps([str(value.name), str(value.dtype)]).encode('utf8'))
+        return [type(value).__name__, content_hash.hexdigest()]
+    if isinstance(value, np.ndarray):
+        content_hash = hashlib.sha1(pd.util.hash_array(value.ravel()).tobytes())
+        return ['ndarray', str(value.dtype), value.shape, content_hash.hexdigest()]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (datetime.date, datetime.time, datetime.timedelta)):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    raise TypeError('{} can not be used in the cache key of an html export'.format(type(value).__name__))
+
+
+def _render_figure_json(figure_function, kwargs, downsample=None):
+    """
+    Creates the figure and returns it as a json string together with downsampling statistics.
+    Runs in a worker process.
+    :param figure_function:
+    :param kwargs:
+    :param downsample: dict with max_points, method and keep_traces (see core.downsampling.downsample_figure)
+    :return:
+    """
+    import plotly.utils
+    figure = figure_function(**kwargs)
+    if hasattr(figure, 'to_plotly_json'):
+        figure = figure.to_plotly_json()
+    downsample_result = []
+    if downsample:
+        downsample_result = downsample_figure(figure, **downsample)
+    return json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder), downsample_result
+
+
+class HTMLExportJob(object):
+    """
+    Describes one html file to export.
+    figure_function is called with kwargs and should return a plotly figure (or a dict with data and layout).
+    It must be defined on module level so that it can be run in another process.
+    dataset_key, parameter, flag_state and kwargs identify the content of the figure and are used as cache
+    key, dataset_key should change when the data changes (e.g. file path and modification time).
+    kwargs are keyed on their content and may contain json values, numpy arrays and pandas objects.
+    Traces named in keep_traces (e.g. flagged data) are never downsampled. In other traces points with a flag
+    in keep_flags (or drawn with another marker than most points) are kept, see core.downsampling.get_keep_mask.
+    """
+    def __init__(self, file_path, figure_function, dataset_key='', parameter='', flag_state=None, title='',
+                 keep_traces=[], keep_flags=None, **kwargs):
+        self.file_path = file_path
+        self.figure_function = figure_function
+        self.dataset_key = dataset_key
+        self.parameter = parameter
+        self.flag_state = flag_state
+        self.title = title or parameter
+        self.keep_traces = keep_traces
+        self.keep_flags = keep_flags
+        self.kwargs = kwargs
+
+    def get_cache_key(self, downsample=None):
+        key = json.dumps([self.figure_function.__module__,
+                          self.figure_function.__name__,
+                          self.dataset_key,
+                          self.parameter,
+                          self.flag_state,
+                          sorted(self.kwargs.items()),
+                          downsample], sort_keys=True, default=_get_cache_key_value)
+        return hashlib.sha1(key.encode('utf8')).hexdigest()
+
+
+class HTMLExporter(object):
+    """
+    Exports plotly figures to html files.
+        Figures are created in parallel in a process pool.
+        Figure json is cached per (dataset, parameter, flag state, figure kwargs) so unchanged figures are not
+        created again. The least recently used cached figures are removed when the cache is larger than
+        max_cache_size_mb.
+        plotly.js is written once per export directory and referenced by all html files instead of being
+        included in every file.
+    """
+    plotly_js_file_name = 'plotly.min.js'
+
+    def __init__(self, cache_directory=None, max_workers=None, use_processes=True, max_cache_size_mb=200):
+        """
+        :param cache_directory: Directory for cached figure json. No caching if not given.
+        :param max_workers: Defaults to number of cpus
+        :param use_processes: If False figures are created in threads
+        :param max_cache_size_mb: 0 means no limit
+        """
+        self.cache_directory = cache_directory
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self.max_cache_size = int(max_cache_size_mb * 1024 * 1024)
+
+    def _get_cache_file_path(self, job, downsample=None):
+        if not self.cache_directory:
+            return None
+        return os.path.join(self.cache_directory, '{}.json'.format(job.get_cache_key(downsample)))
+
+    def _get_downsample_file_path(self, file_path):
+        return file_path[:-len('.json')] + '.downsample'
+
+    def _load_cached(self, job, downsample=None):
+        """
+        Returns the cached figure json and the downsampling result it was created with. None if not cached.
+        """
+        file_path = self._get_cache_file_path(job, downsample)
+        if not file_path or not os.path.exists(file_path):
+            return None, []
+        with open(file_path, encoding='utf8') as fid:
+            figure_json = fid.read()
+        # Mark as recently used
+        os.utime(file_path)
+        downsample_result = []
+        downsample_file_path = self._get_downsample_file_path(file_path)
+        if os.path.exists(downsample_file_path):
+            with open(downsample_file_path, encoding='utf8') as fid:
+                downsample_result = json.load(fid)
+        return figure_json, downsample_result
+
+    def _save_cached(self, job, figure_json, downsample=None, downsample_result=[]):
+        file_path = self._get_cache_file_path(job, downsample)
+        if not file_path:
+            return
+        if not os.path.exists(self.cache_directory):
+            os.makedirs(self.cache_directory)
+        if downsample_result:
+            atomic_write_text(self._get_downsample_file_path(file_path), json.dumps(downsample_result))
+        atomic_write_text(file_path, figure_json)
+
+    def prune_cache(self):
+        """
+        Removes the least recently used cached figures until the cache is smaller than max_cache_size_mb.
+        :return:
+        """
+        if not self.max_cache_size or not self.cache_directory or not os.path.exists(self.cache_directory):
+            return
+        entries = []
+        with os.scandir(self.cache_directory) as items:
+            for item in items:
+                if item.is_file() and item.name.endswith('.json'):
+                    stat = item.stat()
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, file_path in sorted(entries):
+            if total_size <= self.max_cache_size:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                continue
+            total_size -= size
+            downsample_file_path = self._get_downsample_file_path(file_path)
+            if os.path.exists(downsample_file_path):
+                os.remove(downsample_file_path)
+
+    def clear_cache(self):
+        if not self.cache_directory or not os.path.exists(self.cache_directory):
+            return
+        for file_name in os.listdir(self.cache_directory):
+            if file_name.endswith('.json') or file_name.endswith('.downsample'):
+                os.remove(os.path.join(self.cache_directory, file_name))
+
+    def _write_plotly_js(self, directory):
+        """
+        Writes plotly.js to directory if not already there. Returns the file path.
+        :param directory:
+        :return:
+        """
+        file_path = os.path.join(directory, self.plotly_js_file_name)
+        if not os.path.exists(file_path):
+            from plotly.offline import get_plotlyjs
+            atomic_write_text(file_path, get_plotlyjs())
+        return file_path
+
+    def _get_downsample_options(self, job, max_points, method):
+        if not max_points:
+            return None
+        return dict(max_points=max_points, method=method, keep_traces=list(job.keep_traces),
+                    keep_flags=list(job.keep_flags) if job.keep_flags is not None else None)
+
+    def _render(self, jobs, progress_callback=None, max_points=None, method='lttb'):
+        """
+        Returns a list with figure json for all jobs. Cached figures are reused, the rest are rendered in the pool.
+        """
+        downsample = [self._get_downsample_options(job, max_points, method) for job in jobs]
+        figures = []
+        to_render = []
+        for i, (job, ds) in enumerate(zip(jobs, downsample)):
+            figure_json, downsample_result = self._load_cached(job, ds)
+            figures.append(figure_json)
+            if figure_json is None:
+                to_render.append(i)
+            else:
+                self._log_downsampling(job, downsample_result)
+        gui_logger.info('HTML export: %s figures, %s from cache', len(jobs), len(jobs) - len(to_render))
+        if not to_render:
+            return figures
+
+        if self.use_processes and len(to_render) > 1:
+            pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.max_workers or 1)
+        with pool:
+            futures = [pool.submit(_render_figure_json, jobs[i].figure_function, jobs[i].kwargs, downsample[i])
+                       for i in to_render]
+            for nr, (i, future) in enumerate(zip(to_render, futures)):
+                figures[i], downsample_result = future.result()
+                self._log_downsampling(jobs[i], downsample_result)
+                self._save_cached(jobs[i], figures[i], downsample[i], downsample_result)
+                if progress_callback:
+                    progress_callback((nr + 1) / len(to_render), 'Created plot {}'.format(jobs[i].title))
+        self.prune_cache()
+        return figures
+
+    def _log_downsampling(self, job, downsample_result):
+        nr_before = sum(item[1] for item in downsample_result)
+        nr_after = sum(item[2] for item in downsample_result)
+        if not nr_before:
+            return
+        gui_logger.info('HTML export %s: downsampled %s traces from %s to %s points (%.1f %% kept)',
+                        job.title, len(downsample_result), nr_before, nr_after, 100. * nr_after / nr_before)
+
+    def export(self, jobs, progress_callback=None, max_points=None, method='lttb'):
+        """
+        Exports all jobs to html. Returns a list of the created file paths.
+        :param jobs: list of HTMLExportJob
+        :param progress_callback: Called with (fraction, message), e.g. Task.set_progress
+        :param max_points: If given, traces with more points are downsampled to about max_points
+        :param method: Downsampling method, "lttb" or "minmax" (see core.downsampling)
+        :return:
+        """
+        figures = self._render(jobs, progress_callback=progress_callback, max_points=max_points, method=method)
+        file_paths = []
+        for job, figure_json in zip(jobs, figures):
+            directory = os.path.dirname(os.path.abspath(job.file_path))
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            plotly_js_path = self._write_plotly_js(directory)
+            html_text = HTML_TEMPLATE.format(title=html.escape(job.title),
+                                        plotly_js=os.path.basename(plotly_js_path),
+                                        # Text in the figure must not end the script tag
+                                        figure_json=figure_json.replace('</', '<\\/'))
+            atomic_write_text(job.file_path, html_text)
+            file_paths.append(job.file_path)
+        return file_paths
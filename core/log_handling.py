@@ -0,0 +1,184 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+import os
+import time
+import queue
+import threading
+import collections
+import logging
+import logging.handlers
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(name)s (%(module)s:%(lineno)d): %(message)s'
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts log records on a queue. Only the message is merged with its %-style args here, since the args can be
+    objects that are changed by the tk thread before the listener thread gets to them. Time stamps, format and
+    tracebacks are handled by the QueueListener thread.
+    Only used with an in-process queue, the records are never pickled.
+    """
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    Keeps the latest capacity log records in memory. Used to show recent log messages in the GUI.
+    Each handled record gets a sequence number so that a viewer can ask for records newer than the ones it has.
+    """
+    def __init__(self, capacity=2000, level=logging.NOTSET):
+        logging.Handler.__init__(self, level=level)
+        self.records = collections.deque(maxlen=capacity)
+        self.sequence_number = 0
+
+    def emit(self, record):
+        try:
+            text = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self.lock:
+            self.sequence_number += 1
+            self.records.append((self.sequence_number, record.levelno, text))
+
+    def get_records(self, after=0, level=logging.NOTSET):
+        """
+        Returns a list of (sequence number, level, formatted text) for records with sequence number > after
+        and level >= level.
+        :param after:
+        :param level:
+        :return:
+        """
+        with self.lock:
+            records = list(self.records)
+        return [item for item in records if item[0] > after and item[1] >= level]
+
+
+class LogManager(object):
+    """
+    Sets up logging for the given loggers. Log calls only put records on a queue, a listener thread formats
+    them and writes them to:
+        <log_directory>/<name>_debug.log, _warning.log and _error.log (rotated on size)
+        a ring buffer with the latest records (see RingBufferHandler)
+    Rotated log files older than retention_days are removed when started.
+    """
+    file_levels = collections.OrderedDict([('debug', logging.DEBUG),
+                                           ('warning', logging.WARNING),
+                                           ('error', logging.ERROR)])
+
+    def __init__(self, log_directory, name='main', logger_names=[], level=logging.DEBUG,
+                 max_bytes=5*1024*1024, backup_count=5, retention_days=30, ring_buffer_size=2000):
+        """
+        :param log_directory:
+        :param name: Prefix of the log files
+        :param logger_names: Names of the loggers to handle
+        :param level: Level of the loggers. Records below level are not put on the queue.
+        :param max_bytes: Size of a log file before it is rotated. 0 means no rotation.
+        :param backup_count: Number of rotated files to keep per log file
+        :param retention_days: Rotated files older than this are removed. 0 means keep.
+        :param ring_buffer_size: Number of records kept in memory
+        """
+        self.log_directory = log_directory
+        self.name = name
+        self.logger_names = list(logger_names)
+        self.level = level
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.retention_days = retention_days
+
+        self.queue = queue.Queue(-1)
+        self.queue_handler = DeferredQueueHandler(self.queue)
+        self.ring_buffer = RingBufferHandler(capacity=ring_buffer_size)
+        self.file_handlers = []
+        self.listener = None
+        self._lock = threading.Lock()
+
+    def _get_log_file_path(self, level_name):
+        return os.path.join(self.log_directory, '{}_{}.log'.format(self.name, level_name))
+
+    def _remove_old_log_files(self):
+        if not self.retention_days:
+            return
+        limit = time.time() - self.retention_days * 24 * 3600
+        for level_name in self.file_levels:
+            prefix = os.path.basename(self._get_log_file_path(level_name)) + '.'
+            for file_name in os.listdir(self.log_directory):
+                if not file_name.startswith(prefix):
+                    continue
+                file_path = os.path.join(self.log_directory, file_name)
+                try:
+                    if os.path.getmtime(file_path) < limit:
+                        os.remove(file_path)
+                except OSError:
+                    pass
+
+    def start(self):
+        """
+        Creates the handlers and starts the listener thread.
+        :return:
+        """
+        with self._lock:
+            if self.listener:
+                return
+            if not os.path.exists(self.log_directory):
+                os.makedirs(self.log_directory)
+            self._remove_old_log_files()
+
+            formatter = logging.Formatter(LOG_FORMAT)
+            self.file_handlers = []
+            for level_name, level in self.file_levels.items():
+                handler = logging.handlers.RotatingFileHandler(self._get_log_file_path(level_name),
+                                                               maxBytes=self.max_bytes,
+                                                               backupCount=self.backup_count,
+                                                               encoding='utf8',
+                                                               delay=True)
+                handler.setLevel(level)
+                handler.setFormatter(formatter)
+                self.file_handlers.append(handler)
+            self.ring_buffer.setFormatter(formatter)
+
+            self.listener = logging.handlers.QueueListener(self.queue,
+                                                           *(self.file_handlers + [self.ring_buffer]),
+                                                           respect_handler_level=True)
+            self.listener.start()
+
+            for logger_name in self.logger_names:
+                self.add_logger(logger_name)
+
+    def add_logger(self, logger_name):
+        """
+        Sends the records of the given logger to the queue.
+        :param logger_name:
+        :return:
+        """
+        if logger_name not in self.logger_names:
+            self.logger_names.append(logger_name)
+        logger = logging.getLogger(logger_name)
+        logger.setLevel(self.level)
+        if self.queue_handler not in logger.handlers:
+            logger.addHandler(self.queue_handler)
+
+    def stop(self):
+        """
+        Writes all queued records, stops the listener thread and closes the log files.
+        :return:
+        """
+        with self._lock:
+            if not self.listener:
+                return
+            for logger_name in self.logger_names:
+                logging.getLogger(logger_name).removeHandler(self.queue_handler)
+            self.listener.stop()
+            self.listener = None
+            for handler in self.file_handlers:
+                handler.close()
+            self.file_handlers = []
+
+    def get_records(self, after=0, level=logging.NOTSET):
+        """
+        Returns the latest records from the ring buffer, see RingBufferHandler.get_records.
+        """
+        return self.ring_buffer.get_records(after=after, level=level)
@@ -1,23 +1,146 @@
 # Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 
-import cmocean
+import numpy as np
+
 
 class Colormaps(object):
-    def __init__(self, default_cmap='jet'):
+    """
+    Registry of colormaps. Colormaps are given by name:
+        "cmocean.cm.<name>" for cmocean colormaps
+        matplotlib colormap names (e.g. "jet" or "viridis")
+        names added with register()
+    Nothing is imported or created until a colormap is requested. Resolved colormaps and their
+    lookup tables (lut_size RGBA colors) are cached.
+    """
+    cmocean_prefix = 'cmocean.cm.'
+
+    def __init__(self, default_cmap='jet', lut_size=256):
         self.default_cmap = default_cmap
-        cmapname_list = cmocean.cm.cmapnames[:]
-        self.cmap_mapping = {}
-        for cmap in sorted(cmapname_list):
-            cmap_string = 'cmocean.cm.{}'.format(cmap)
-            self.cmap_mapping[cmap_string] = eval(cmap_string)
+        self.lut_size = lut_size
+        self._cmocean_list = None
+        self._registered = {}
+        self._resolved = {}
+        self._luts = {}
 
         # self.cmap_mapping = {'cmocean.cm.haline': cmocean.cm.haline,
         #                      'cmocean.cm.thermal': cmocean.cm.thermal,
         #                      'cmocean.cm.oxy': cmocean.cm.oxy}
 
-    def get_list(self):
-        return sorted(self.cmap_mapping)
+    def _get_cmocean_list(self):
+        if self._cmocean_list is None:
+            import cmocean
+            self._cmocean_list = ['{}{}'.format(self.cmocean_prefix, cmap) for cmap in cmocean.cm.cmapnames]
+        return self._cmocean_list
+
+    def _get_matplotlib_registry(self):
+        import matplotlib
+        if hasattr(matplotlib, 'colormaps'):
+            return matplotlib.colormaps
+        # matplotlib < 3.5
+        import matplotlib.cm
+        return matplotlib.cm.cmap_d
+
+    def _get_matplotlib_list(self):
+        return list(self._get_matplotlib_registry())
+
+    def get_list(self, include_matplotlib=False):
+        """
+        Returns a sorted list of cmocean and registered colormaps. Matplotlib colormaps are added if
+        include_matplotlib is True.
+        :param include_matplotlib:
+        :return:
+        """
+        cmap_list = self._get_cmocean_list() + list(self._registered)
+        if include_matplotlib:
+            cmap_list = cmap_list + self._get_matplotlib_list()
+        return sorted(set(cmap_list))
+
+    def register(self, name, cmap):
+        """
+        Adds a colormap (matplotlib Colormap object) that can be requested by name.
+        :param name:
+        :param cmap:
+        :return:
+        """
+        self._registered[name] = cmap
+        self._resolved.pop(name, None)
+        self._luts = {key: lut for key, lut in self._luts.items() if key[0] != name}
+
+    def _resolve(self, name):
+        if name in self._resolved:
+            return self._resolved[name]
+        if not isinstance(name, str):
+            # Already a colormap object
+            return name
+        cmap = None
+        if name in self._registered:
+            cmap = self._registered[name]
+        elif name.startswith(self.cmocean_prefix):
+            import cmocean
+            cmap = getattr(cmocean.cm, name[len(self.cmocean_prefix):], None)
+        else:
+            registry = self._get_matplotlib_registry()
+            if name in registry:
+                cmap = registry[name]
+        self._resolved[name] = cmap
+        return cmap
 
     def get(self, cmap):
-        return self.cmap_mapping.get(cmap, self.default_cmap)
\ No newline at end of file
+        """
+        Returns the colormap object for the given name. If not found the default colormap is returned.
+        :param cmap:
+        :return:
+        """
+        obj = self._resolve(cmap)
+        if obj is None:
+            return self.default_cmap
+        return obj
+
+    def get_lut(self, cmap, lut_size=None):
+        """
+        Returns a cached array (lut_size x 4) with the RGBA colors of the colormap.
+        :param cmap:
+        :param lut_size:
+        :return:
+        """
+        lut_size = lut_size or self.lut_size
+        key = (cmap, lut_size)
+        if key not in self._luts:
+            obj = self._resolve(cmap)
+            if obj is None:
+                obj = self._resolve(self.default_cmap)
+            lut = obj(np.linspace(0, 1, lut_size))
+            lut.setflags(write=False)
+            self._luts[key] = lut
+        return self._luts[key]
+
+    def to_rgba(self, values, cmap, vmin=None, vmax=None, lut_size=None):
+        """
+        Vectorized coloring of values using the cached lookup table of the colormap.
+        NaN values get the colormap "bad" color.
+        :param values:
+        :param cmap:
+        :param vmin: Defaults to min of values
+        :param vmax: Defaults to max of values
+        :param lut_size:
+        :return: Array (len(values) x 4) with RGBA colors
+        """
+        values = np.asarray(values, dtype=float)
+        lut = self.get_lut(cmap, lut_size)
+        if vmin is None:
+            vmin = np.nanmin(values)
+        if vmax is None:
+            vmax = np.nanmax(values)
+        span = (vmax - vmin) or 1.
+        nr_colors = len(lut)
+        with np.errstate(invalid='ignore'):
+            index = np.floor((values - vmin) / span * nr_colors)
+        nan_mask = np.isnan(index)
+        index = np.clip(np.nan_to_num(index), 0, nr_colors - 1).astype(int)
+        colors = lut[index]
+        if nan_mask.any():
+            obj = self._resolve(cmap)
+            bad = obj.get_bad() if hasattr(obj, 'get_bad') else (0., 0., 0., 0.)
+            colors[nan_mask] = bad
+        return colors
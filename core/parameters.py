@@ -0,0 +1,143 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Lookup of parameter names in the parameter (column) list of a dataset.
+"""
+
+# Names used for the same parameter in CMEMS and SHARK files. The first name in each group is used as key.
+DEFAULT_PARAMETER_ALIASES = [['TEMP', 'Temperature', 'Temperature CTD', 'SEA_WATER_TEMPERATURE'],
+                             ['PSAL', 'Salinity', 'Salinity CTD', 'SEA_WATER_SALINITY'],
+                             ['CPHL', 'CHLA', 'Chlorophyll-a', 'Chlorophyll-a bottle', 'Chlorophyll-a CTD'],
+                             ['DOX1', 'DOXY', 'Dissolved oxygen', 'Dissolved oxygen O2 bottle',
+                              'Dissolved oxygen O2 CTD'],
+                             ['PHPH', 'pH', 'PH'],
+                             ['NTRA', 'Nitrate NO3-N'],
+                             ['PHOS', 'Phosphate PO4-P'],
+                             ['SLCA', 'Silicate SiO3-Si'],
+                             ['TUR4', 'TURB', 'Turbidity']]
+
+
+class PrefixTrie(object):
+    """
+    Prefix tree of lower case keys. Each node holds the lowest position of the keys below it, so the first
+    key (in insert position order) with a given prefix is found in O(len(prefix)).
+    """
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, key, position):
+        node = self.root
+        for char in key.lower():
+            node = node.setdefault(char, {})
+            node['_first'] = min(node.get('_first', position), position)
+        node.setdefault('_positions', []).append(position)
+
+    def _get_node(self, prefix):
+        node = self.root
+        for char in prefix.lower():
+            node = node.get(char)
+            if node is None:
+                return None
+        return node
+
+    def first(self, prefix):
+        """
+        Returns the lowest position of the keys starting with prefix, None if there is no such key.
+        :param prefix:
+        :return:
+        """
+        node = self._get_node(prefix)
+        if node is None:
+            return None
+        return node.get('_first')
+
+    def find(self, prefix):
+        """
+        Returns a sorted list of the positions of all keys starting with prefix.
+        :param prefix:
+        :return:
+        """
+        node = self._get_node(prefix)
+        if node is None:
+            return []
+        positions = []
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            for char, child in node.items():
+                if char == '_positions':
+                    positions.extend(child)
+                elif char != '_first':
+                    nodes.append(child)
+        return sorted(positions)
+
+
+class ParameterCatalogue(object):
+    """
+    Index of a parameter list (e.g. the columns of a dataset) with:
+        set based membership, case insensitive lookup and lookup through aliases (resolve)
+        prefix search (find_prefix and get_default)
+    """
+    def __init__(self, parameters, aliases=DEFAULT_PARAMETER_ALIASES):
+        """
+        :param parameters: Parameter names in the order they should be prioritised (e.g. column order)
+        :param aliases: List of groups of names that are used for the same parameter
+        """
+        self.parameters = list(parameters)
+        self._positions = {}
+        self._lower_case = {}
+        self._trie = PrefixTrie()
+        for position, par in enumerate(self.parameters):
+            self._positions.setdefault(par, position)
+            self._lower_case.setdefault(par.lower(), par)
+            self._trie.insert(par, position)
+
+        # Lower case name -> all lower case names in its alias group
+        self._aliases = {}
+        for group in aliases or []:
+            lower_group = [name.lower() for name in group]
+            for name in lower_group:
+                self._aliases.setdefault(name, []).extend(lower_group)
+
+    def __contains__(self, par):
+        return par in self._positions
+
+    def __len__(self):
+        return len(self.parameters)
+
+    def resolve(self, par):
+        """
+        Returns the name in the catalogue for par. par can be the exact name, differ in case or be an alias.
+        Returns None if not found.
+        :param par:
+        :return:
+        """
+        if par in self._positions:
+            return par
+        lower_par = par.lower()
+        if lower_par in self._lower_case:
+            return self._lower_case[lower_par]
+        matches = [self._lower_case[name] for name in self._aliases.get(lower_par, []) if name in self._lower_case]
+        if not matches:
+            return None
+        return min(matches, key=self._positions.get)
+
+    def find_prefix(self, prefix):
+        """
+        Returns all parameters starting with prefix (case insensitive) in catalogue order.
+        :param prefix:
+        :return:
+        """
+        return [self.parameters[position] for position in self._trie.find(prefix)]
+
+    def get_default(self, prefixes):
+        """
+        Returns the first parameter starting with the first prefix that has a match. None if no match.
+        :param prefixes: e.g. ['chl', 'temp']
+        :return:
+        """
+        for prefix in prefixes:
+            position = self._trie.first(prefix)
+            if position is not None:
+                return self.parameters[position]
+        return None
@@ -0,0 +1,136 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+import os
+import json
+import importlib
+
+from core.profiler import profile_phase
+from core.exceptions import *
+
+import logging
+
+gui_logger = logging.getLogger('gui_logger')
+
+
+class Plugin(object):
+    """
+    Holds the information about a plugin. If the plugin directory contains a manifest file INFO and
+    USER_SETTINGS are read from it and the plugin module is not imported until it is needed (App is requested).
+    Without a manifest the module is imported directly.
+
+    Example of a manifest (manifest.json):
+        {
+            "INFO": {"title": "Ferrybox and fixed platforms",
+                     "users_directory": "users",
+                     "user_page_class": "PageUser",
+                     "sub_pages": [{"name": "PageFerrybox", "title": "Ferrybox"}]},
+            "USER_SETTINGS": [["basic", "options"], ["parameter", "parameter_colormap"]],
+            "BATCH": {"function": "batch:process_file",
+                      "file_patterns": ["*.txt"],
+                      "settings_directory": "settings_files",
+                      "default_settings_file": "default_settings"}
+        }
+
+    BATCH is optional and describes how files are processed without GUI (see batch.py in the app directory).
+    "function" is "<module in the plugin package>:<function name>". The function is called with
+    (file_path, output_directory=..., settings_file_path=..., user_settings=...) and should return a list of
+    the created files. The function module should not create any tk widgets.
+    """
+    manifest_file_name = 'manifest.json'
+
+    def __init__(self, name, plugins_directory, package='plugins'):
+        self.name = name
+        self.directory = os.path.join(plugins_directory, name)
+        self.module_name = '{}.{}'.format(package, name)
+        self._module = None
+
+        self.manifest = self._load_manifest()
+        if self.manifest is None:
+            self._import_module()
+
+    def __repr__(self):
+        return 'Plugin({})'.format(self.name)
+
+    def _load_manifest(self):
+        file_path = os.path.join(self.directory, self.manifest_file_name)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, encoding='utf8') as fid:
+            manifest = json.load(fid)
+        manifest.setdefault('INFO', {})
+        manifest.setdefault('USER_SETTINGS', [])
+        manifest.setdefault('BATCH', {})
+        return manifest
+
+    def _import_module(self):
+        gui_logger.debug('Importing plugin: %s', self.module_name)
+        with profile_phase('import {}'.format(self.module_name)):
+            self._module = importlib.import_module(self.module_name)
+        return self._module
+
+    @property
+    def is_loaded(self):
+        return self._module is not None
+
+    @property
+    def module(self):
+        """
+        Returns the plugin module. The module is imported the first time this is called.
+        :return:
+        """
+        if self._module is None:
+            self._import_module()
+        return self._module
+
+    @property
+    def App(self):
+        return self.module.App
+
+    @property
+    def INFO(self):
+        # When the module is loaded its INFO is used, it might hold classes (e.g. user_page_class)
+        if self._module is not None:
+            return self._module.INFO
+        return self.manifest['INFO']
+
+    @property
+    def USER_SETTINGS(self):
+        if self._module is not None:
+            return self._module.USER_SETTINGS
+        return [tuple(item) for item in self.manifest['USER_SETTINGS']]
+
+    @property
+    def BATCH(self):
+        if self.manifest is not None:
+            return self.manifest['BATCH']
+        return getattr(self._module, 'BATCH', {})
+
+    def get_batch_function_name(self):
+        """
+        Returns (module name, function name) of the batch function. The module is not imported.
+        Raises GUIExceptionBatchError if the plugin has no batch function.
+        :return:
+        """
+        function = self.BATCH.get('function')
+        if not function or ':' not in function:
+            raise GUIExceptionBatchError('Plugin {} has no batch function'.format(self.name))
+        module_name, function_name = function.rsplit(':', 1)
+        return '{}.{}'.format(self.module_name, module_name), function_name
+
+
+def get_plugins(plugins_directory, plugin_list, package='plugins', manifest_only=False):
+    """
+    Returns a dict with Plugin objects for all plugins in plugin_list.
+    :param plugins_directory:
+    :param plugin_list:
+    :param package:
+    :param manifest_only: If True plugins without manifest are left out, so no plugin module is imported
+    :return:
+    """
+    plugins = {}
+    for name in plugin_list:
+        if manifest_only and not os.path.exists(os.path.join(plugins_directory, name, Plugin.manifest_file_name)):
+            gui_logger.debug('Plugin %s has no manifest, skipped', name)
+            continue
+        plugins[name] = Plugin(name, plugins_directory, package=package)
+    return plugins
@@ -0,0 +1,157 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+import os
+import sys
+import json
+import time
+import datetime
+import platform
+import tracemalloc
+from contextlib import contextmanager
+
+from core.utils import atomic_write_json, atomic_write_text
+
+
+class StartupProfiler(object):
+    """
+    Records wall time and memory (tracemalloc) for named, possibly nested, phases.
+    The report is saved as json and as a "folded stacks" file that can be used with flame graph tools
+    (e.g. flamegraph.pl or speedscope). Values in the folded file are exclusive time in microseconds.
+    """
+    def __init__(self):
+        self.records = []
+        self._stack = []
+        self.started = False
+        self.start_time = None
+        self.total_time = None
+        self._started_tracemalloc = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.start_time = time.perf_counter()
+        self.started = True
+
+    def stop(self):
+        if not self.started:
+            return
+        self.total_time = time.perf_counter() - self.start_time
+        # Tracing is left on if started by someone else (e.g. core.SessionDiagnostics)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        self.started = False
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager recording the phase name.
+        :param name:
+        :return:
+        """
+        if not self.started:
+            yield
+            return
+        record = dict(name=name,
+                      stack=[item['name'] for item in self._stack] + [name],
+                      start=time.perf_counter() - self.start_time,
+                      children_time=0.,
+                      children_peak=0)
+        memory_start, peak = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, 'reset_peak'):
+            # Python 3.9+. Otherwise memory_peak is the peak since the profiler was started.
+            # The peak so far is kept for the enclosing phase.
+            if self._stack:
+                self._stack[-1]['children_peak'] = max(self._stack[-1]['children_peak'], peak)
+            tracemalloc.reset_peak()
+        self._stack.append(record)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - t0
+            memory_end, memory_peak = tracemalloc.get_traced_memory()
+            memory_peak = max(memory_peak, record.pop('children_peak'))
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]['children_time'] += duration
+                self._stack[-1]['children_peak'] = max(self._stack[-1]['children_peak'], memory_peak)
+            record['duration'] = duration
+            record['self_time'] = max(duration - record.pop('children_time'), 0.)
+            record['memory_start'] = memory_start
+            record['memory_end'] = memory_end
+            record['memory_diff'] = memory_end - memory_start
+            record['memory_peak'] = memory_peak
+            self.records.append(record)
+
+    def get_report(self, **kwargs):
+        """
+        Returns the report as a dict. kwargs are added to the report header.
+        :return:
+        """
+        report = dict(created=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                      python=sys.version.split()[0],
+                      platform=platform.platform(),
+                      total_time=self.total_time,
+                      phases=sorted(self.records, key=lambda item: item['start']))
+        report.update(kwargs)
+        return report
+
+    def get_folded_stacks(self):
+        lines = []
+        for record in sorted(self.records, key=lambda item: item['start']):
+            stack = ';'.join(name.replace(';', ',').replace(' ', '_') for name in record['stack'])
+            lines.append('{} {}'.format(stack, int(round(record['self_time'] * 1e6))))
+        return '\n'.join(lines) + '\n'
+
+    def save_report(self, directory, file_name=None, **kwargs):
+        """
+        Saves the report as json and folded stacks in directory. Returns the paths to the files.
+        :param directory:
+        :param file_name: File name without extension
+        :param kwargs: Added to the report header
+        :return:
+        """
+        if not file_name:
+            file_name = 'startup_profile_{}'.format(datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        json_file_path = os.path.join(directory, '{}.json'.format(file_name))
+        folded_file_path = os.path.join(directory, '{}.folded'.format(file_name))
+        atomic_write_json(json_file_path, self.get_report(**kwargs), indent=4)
+        atomic_write_text(folded_file_path, self.get_folded_stacks())
+        return json_file_path, folded_file_path
+
+
+_startup_profiler = None
+
+
+def start_startup_profiler():
+    """
+    Starts the global startup profiler. Phases marked with profile_phase are recorded after this is called.
+    :return:
+    """
+    global _startup_profiler
+    if _startup_profiler is None:
+        _startup_profiler = StartupProfiler()
+        _startup_profiler.start()
+    return _startup_profiler
+
+
+def get_startup_profiler():
+    return _startup_profiler
+
+
+@contextmanager
+def profile_phase(name):
+    """
+    Marks a phase for the startup profiler. Does nothing if the profiler is not started.
+    :param name:
+    :return:
+    """
+    if _startup_profiler is None:
+        yield
+        return
+    with _startup_profiler.phase(name):
+        yield
@@ -6,8 +6,47 @@
 
 import codecs
 import os
+import ast
+import copy
+import json
 import shutil
 import pickle
+import hashlib
+
+from core.exceptions import *
+from core.profiler import profile_phase
+from core.utils import atomic_write_json
+
+import logging
+
+gui_logger = logging.getLogger('gui_logger')
+
+# Version of the file format for saved settings (see Settings.save_settings)
+SETTINGS_SCHEMA_VERSION = 1
+# Version of the compiled settings.ini cache. Increase if the parsing of settings.ini changes.
+DEFAULT_SETTINGS_CACHE_VERSION = 1
+
+
+def _to_json_types(value):
+    """
+    Returns value with tuples and sets (also nested) converted to lists, as they are after a round trip
+    through json. Sets are sorted so that the order is the same every time.
+    """
+    if isinstance(value, set):
+        value = sorted(value, key=str)
+    if isinstance(value, (list, tuple)):
+        return [_to_json_types(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _to_json_types(item) for key, item in value.items()}
+    return value
+
+
+class _SafeUnpickler(pickle.Unpickler):
+    """
+    Unpickler for legacy settings.pkl files. Only builtin containers and values can be loaded.
+    """
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError('Not allowed in settings file: {}.{}'.format(module, name))
 
         
 """
@@ -39,16 +78,98 @@ class Settings(dict):
     def _load_settings(self, load_default=False):
 
         # Always load default settings first
-        self._load_default_settings()
-        
+        with profile_phase('settings.ini parse'):
+            self._load_default_settings()
+        self._default_values = self._get_comparable_values()
+        self._saved_values = {}
+
         self.file_path = self['directory']['Settings file path']
-        # Overwrite with pkl-file
-        if not load_default and os.path.exists(self.file_path): 
-            self._load_pkl_settings()
+        # Overwrite with saved settings
+        if not load_default:
+            with profile_phase('saved settings load'):
+                self._load_saved_settings()
                 
     
     #===========================================================================
     def _load_default_settings(self):
+        """
+        Loads the default settings from the compiled cache if it is valid, otherwise parses settings.ini
+        and updates the cache.
+        """
+        cache = self._load_default_settings_cache()
+        if cache:
+            for group, group_dict in cache['settings'].items():
+                if group == u'shapefile':
+                    group_dict = {key: tuple(value) for key, value in group_dict.items()}
+                self[group] = group_dict
+            self.settings_list = cache['settings_list']
+            self.page_list = sorted([page for page in self if u'page' in page.lower()])
+            return
+        self._parse_default_settings()
+        self._save_default_settings_cache()
+
+    #===========================================================================
+    def _get_default_settings_cache_file_path(self):
+        return os.path.splitext(self.default_settings_file_path)[0] + '.cache.json'
+
+    #===========================================================================
+    def _get_default_settings_file_hash(self):
+        with open(self.default_settings_file_path, 'rb') as fid:
+            return hashlib.sha1(fid.read()).hexdigest()
+
+    #===========================================================================
+    def _load_default_settings_cache(self):
+        """
+        Returns the cached default settings if the cache matches settings.ini (mtime and size, or content hash)
+        and root directory. Otherwise returns None.
+        """
+        cache_file_path = self._get_default_settings_cache_file_path()
+        try:
+            with open(cache_file_path, encoding='utf8') as fid:
+                cache = json.load(fid)
+            stat = os.stat(self.default_settings_file_path)
+        except (OSError, ValueError):
+            return None
+        if cache.get('cache_version') != DEFAULT_SETTINGS_CACHE_VERSION:
+            return None
+        if cache.get('root_directory') != self.root_directory:
+            return None
+        if cache.get('mtime') == stat.st_mtime_ns and cache.get('size') == stat.st_size:
+            return cache
+        # File is touched but might be unchanged
+        if cache.get('hash') == self._get_default_settings_file_hash():
+            cache['mtime'] = stat.st_mtime_ns
+            cache['size'] = stat.st_size
+            self._write_default_settings_cache(cache)
+            return cache
+        return None
+
+    #===========================================================================
+    def _save_default_settings_cache(self):
+        stat = os.stat(self.default_settings_file_path)
+        cache = dict(cache_version=DEFAULT_SETTINGS_CACHE_VERSION,
+                     root_directory=self.root_directory,
+                     mtime=stat.st_mtime_ns,
+                     size=stat.st_size,
+                     hash=self._get_default_settings_file_hash(),
+                     settings_list=self.settings_list,
+                     settings=dict(self))
+        self._write_default_settings_cache(cache)
+
+    #===========================================================================
+    def _write_default_settings_cache(self, cache):
+        try:
+            atomic_write_json(self._get_default_settings_cache_file_path(), cache)
+        except OSError as e:
+            # Read only installation. Settings are parsed each time.
+            gui_logger.debug('Could not write settings cache: %s', e)
+        except (TypeError, ValueError) as e:
+            # Values that can not be stored as json. Settings are parsed each time.
+            gui_logger.warning('Settings not cached, %s can not be stored as json: %s',
+                               self.default_settings_file_path, e)
+
+    #===========================================================================
+    def _parse_default_settings(self):
         """
         Updated 20181002    by Magnus Wenzer
         """
@@ -108,7 +229,7 @@ class Settings(dict):
                     # Replace "root" with root directory
                     if value.startswith(u'root/'):
                         if not self.root_directory:
-                            raise GTBExceptionMissingAttribute('"root" keyword found in settings file but root_directory is not given')
+                            raise GUIExceptionMissingAttribute('"root" keyword found in settings file but root_directory is not given')
                         value = value.replace(u'root/', self.root_directory.replace(u'\\',u'/') + u'/')
                         # print('---', value)
                     # shapefile
@@ -135,7 +256,8 @@ class Settings(dict):
                         split = string.split(u';')
                         self[group][key]['type'] = split[0]
                         if len(split) == 2:
-                            self[group][key]['value_list'] = eval(split[1])
+                            # Same types as when loaded from the cache (json)
+                            self[group][key]['value_list'] = _to_json_types(ast.literal_eval(split[1]))
                     else:
                         # if old values exist in settings.pkl len(split_line) might be 3 and not 4
                         pass
@@ -150,42 +272,116 @@ class Settings(dict):
     
     
     #===========================================================================
-    def _load_pkl_settings(self):
-        fid = open(self.file_path, 'rb')
-        loaded_dict = pickle.load(fid)
-        fid.close()
-        
-        for category in loaded_dict:
-            if category in self:
-                try:
-                    for key in loaded_dict[category]:
-                        if key in self[category]:
-                            
-                            self[category][key] = loaded_dict[category][key]
-                            
-                            if key==u'Max distance to station (m)':
-                                self[category][key][u'value'] = float(loaded_dict[category][key][u'value'])
-                                
-                            
-                except:
-                    self[key] = loaded_dict[key]
-        
-        
+    def _get_comparable_values(self):
+        """
+        Returns a copy of all settings as they look when saved to (and loaded from) json.
+        Values that can not be stored as json are compared as strings.
+        """
+        return json.loads(json.dumps(self, default=str))
+
+    #===========================================================================
+    def _get_legacy_pkl_file_path(self):
+        return os.path.splitext(self.file_path)[0] + '.pkl'
+
+    #===========================================================================
+    def _load_saved_settings(self):
+        """
+        Loads settings saved with save_settings. If no file is found settings are migrated from an old
+        settings.pkl file (if present).
+        """
+        if os.path.exists(self.file_path):
+            try:
+                with open(self.file_path, encoding='utf8') as fid:
+                    saved = json.load(fid)
+            except ValueError:
+                corrupt_file_path = self.file_path + '.corrupt'
+                gui_logger.warning('Could not read settings file %s. Moved to %s', self.file_path, corrupt_file_path)
+                os.replace(self.file_path, corrupt_file_path)
+                return
+        elif os.path.exists(self._get_legacy_pkl_file_path()):
+            saved = self._load_legacy_pkl_settings()
+        else:
+            return
+
+        saved = self._migrate_saved_settings(saved)
+        self._set_saved_settings(saved['settings'])
+        self._saved_values = copy.deepcopy(saved['settings'])
+
+        if saved['schema_version'] != SETTINGS_SCHEMA_VERSION or not os.path.exists(self.file_path):
+            self.save_settings()
+
+    #===========================================================================
+    def _load_legacy_pkl_settings(self):
+        file_path = self._get_legacy_pkl_file_path()
+        try:
+            with open(file_path, 'rb') as fid:
+                loaded_dict = _SafeUnpickler(fid).load()
+        except Exception as e:
+            gui_logger.warning('Could not migrate settings from %s: %s', file_path, e)
+            loaded_dict = {}
+        gui_logger.info('Migrating settings from %s to %s', file_path, self.file_path)
+        return dict(schema_version=0, settings=loaded_dict)
+
+    #===========================================================================
+    def _migrate_saved_settings(self, saved):
+        """
+        Converts saved settings from older schema versions to the current one.
+        """
+        version = saved.get('schema_version', 0)
+        if version > SETTINGS_SCHEMA_VERSION:
+            gui_logger.warning('Settings file %s has schema version %s, expected %s', self.file_path, version,
+                               SETTINGS_SCHEMA_VERSION)
+        if version < 1:
+            # Legacy pkl: all settings were saved. Keep only the values that differ from the defaults.
+            settings = {}
+            for group, group_dict in saved.get('settings', {}).items():
+                if not isinstance(group_dict, dict):
+                    continue
+                for key, value in group_dict.items():
+                    if json.loads(json.dumps(value)) != self._default_values.get(group, {}).get(key):
+                        settings.setdefault(group, {})[key] = value
+            saved = dict(settings=settings)
+        saved['schema_version'] = version
+        saved.setdefault('settings', {})
+        return saved
+
+    #===========================================================================
+    def _set_saved_settings(self, saved_settings):
+        for category in saved_settings:
+            if category not in self:
+                continue
+            for key in saved_settings[category]:
+                if key in self[category]:
+
+                    self[category][key] = saved_settings[category][key]
+
+                    if key==u'Max distance to station (m)':
+                        self[category][key][u'value'] = float(saved_settings[category][key][u'value'])
+
     #===========================================================================
     def save_settings(self):
+        """
+        Saves the settings that differ from the defaults in settings.ini. The file is only written if something
+        has changed since the last save, and it is replaced atomically.
+        """
+        current_values = self._get_comparable_values()
         save_dict = {}
-        # print(self)
-        for key in self.keys():
-            save_dict[key] = self[key]
-            # if key == u'map area':
-                # print(self[key])
-                # print(save_dict[key])
-                # print(self[key] == save_dict[key])
-        fid = open(self.file_path, 'wb')
-        pickle.dump(save_dict, fid)
-        fid.close()
-        
-    
+        for group, group_dict in current_values.items():
+            if not isinstance(group_dict, dict):
+                continue
+            for key, value in group_dict.items():
+                if value != self._default_values.get(group, {}).get(key):
+                    save_dict.setdefault(group, {})[key] = value
+
+        if save_dict == self._saved_values and os.path.exists(self.file_path):
+            return
+        atomic_write_json(self.file_path,
+                          dict(schema_version=SETTINGS_SCHEMA_VERSION,
+                               settings=save_dict),
+                          indent=4,
+                          ensure_ascii=False)
+        self._saved_values = save_dict
+
     #===========================================================================
     def change_setting(self, group, key, value):
         if key not in self[group]:
@@ -203,7 +399,7 @@ class Settings(dict):
             elif value == u'False':
                 value = False
         self[group][key] = value
-        print(group, key, value)
+        gui_logger.debug('Setting changed: %s %s %s', group, key, value)
 
     
     #===========================================================================
@@ -212,37 +408,147 @@ class Settings(dict):
 
 
 
+def read_settings_file_metadata(file_path):
+    """
+    Returns metadata for a settings file: sampling_type and parameters (sorted list).
+    Json files are read. sampling_type is taken from the key "sampling_type" (top level or in "info", "file" or
+    "general"). Parameters are taken from "parameters" (list) and from keys and values in "parameter_mapping"
+    and "column_mapping". Other files give empty metadata.
+    :param file_path:
+    :return:
+    """
+    metadata = dict(sampling_type='', parameters=[])
+    if not file_path.lower().endswith('.json'):
+        return metadata
+    with open(file_path, encoding='utf8') as fid:
+        data = json.load(fid)
+    if not isinstance(data, dict):
+        return metadata
+    for section in [data] + [data.get(key) for key in ['info', 'file', 'general']]:
+        if isinstance(section, dict) and section.get('sampling_type'):
+            metadata['sampling_type'] = str(section['sampling_type'])
+            break
+    parameters = set()
+    if isinstance(data.get('parameters'), list):
+        parameters.update(str(par) for par in data['parameters'])
+    for key in ['parameter_mapping', 'column_mapping']:
+        mapping = data.get(key)
+        if isinstance(mapping, dict):
+            parameters.update(str(par) for par in mapping)
+            parameters.update(str(par) for par in mapping.values() if isinstance(par, str))
+    metadata['parameters'] = sorted(parameters)
+    return metadata
+
+
 class SettingsFiles(object):
     """
-    Class hold
+    Catalogue of the settings files in a directory.
+    For each file the modification time, size and metadata (sampling type and parameters, see
+    read_settings_file_metadata) are kept. refresh() only reads files that are new or have changed.
+    Files can be looked up by sampling type and parameters without reading them again.
+    If cache_file_path is given the catalogue is saved there and loaded at start.
     """
-    def __init__(self, settings_directory):
+    cache_version = 1
+
+    def __init__(self, settings_directory, metadata_reader=read_settings_file_metadata, cache_file_path=None):
         """
 
-        :param settings_files_path:
+        :param settings_directory:
+        :param metadata_reader: Function returning a dict with metadata for a file path
+        :param cache_file_path:
         """
         self.directory = settings_directory
+        self.metadata_reader = metadata_reader
+        self.cache_file_path = cache_file_path
 
         self.file_names = []
         self.files = []
         self.paths = []
+        self.name_to_path = {}
 
-        self._list_files()
+        # file name -> dict(name, path, mtime, size, metadata)
+        self.catalogue = {}
+        self._sampling_type_index = {}
+        self._parameter_index = {}
 
-    def _list_files(self):
-        self.file_names = []
-        self.files = []
-        self.paths = []
+        self._load_cache()
+        self.refresh()
 
-        self.name_to_path = {}
+    def _load_cache(self):
+        if not self.cache_file_path or not os.path.exists(self.cache_file_path):
+            return
+        try:
+            with open(self.cache_file_path, encoding='utf8') as fid:
+                data = json.load(fid)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == self.cache_version and data.get('directory') == self.directory:
+            self.catalogue = data.get('files', {})
+
+    def _save_cache(self):
+        if not self.cache_file_path:
+            return
+        atomic_write_json(self.cache_file_path, dict(version=self.cache_version,
+                                                     directory=self.directory,
+                                                     files=self.catalogue))
+
+    def _read_entry(self, file_name, file_path, stat):
+        try:
+            metadata = self.metadata_reader(file_path)
+        except Exception as e:
+            gui_logger.warning('Could not read metadata from settings file %s: %s', file_path, e)
+            metadata = {}
+        metadata.setdefault('sampling_type', '')
+        metadata.setdefault('parameters', [])
+        return dict(name=file_name.split('.')[0],
+                    path=file_path,
+                    mtime=stat.st_mtime,
+                    size=stat.st_size,
+                    metadata=metadata)
+
+    def refresh(self):
+        """
+        Updates the catalogue. Only new or modified files are read. Returns True if anything has changed.
+        :return:
+        """
+        changed = False
+        present = set()
+        cache_file_name = os.path.basename(self.cache_file_path) if self.cache_file_path else None
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name == cache_file_name:
+                    continue
+                present.add(entry.name)
+                stat = entry.stat()
+                item = self.catalogue.get(entry.name)
+                if item and item['mtime'] == stat.st_mtime and item['size'] == stat.st_size \
+                        and item['path'] == entry.path:
+                    continue
+                self.catalogue[entry.name] = self._read_entry(entry.name, entry.path, stat)
+                changed = True
+        for file_name in set(self.catalogue) - present:
+            self.catalogue.pop(file_name)
+            changed = True
+        if changed or not self.file_names:
+            self._update_index()
+        if changed:
+            self._save_cache()
+        return changed
 
-        for file_name in sorted(os.listdir(self.directory)):
-            self.file_names.append(file_name)
-            name = file_name.split('.')[0]
-            self.files.append(name)
-            p = os.path.join(self.directory, file_name)
-            self.paths.append(p)
-            self.name_to_path[name] = p
+    def _update_index(self):
+        self.file_names = sorted(self.catalogue)
+        self.files = [self.catalogue[file_name]['name'] for file_name in self.file_names]
+        self.paths = [self.catalogue[file_name]['path'] for file_name in self.file_names]
+        self.name_to_path = dict(zip(self.files, self.paths))
+
+        self._sampling_type_index = {}
+        self._parameter_index = {}
+        for file_name in self.file_names:
+            item = self.catalogue[file_name]
+            sampling_type = item['metadata'].get('sampling_type', '')
+            self._sampling_type_index.setdefault(sampling_type.lower(), []).append(item['name'])
+            for par in item['metadata'].get('parameters', []):
+                self._parameter_index.setdefault(par.lower(), set()).add(item['name'])
 
     def get_list(self):
         return self.files
@@ -250,16 +556,53 @@ class SettingsFiles(object):
     def get_path(self, file):
         return self.name_to_path.get(file, '')
 
+    def get_metadata(self, file):
+        """
+        Returns the metadata for the given settings file (name without extension).
+        :param file:
+        :return:
+        """
+        path = self.name_to_path.get(file)
+        if not path:
+            return {}
+        return self.catalogue[os.path.basename(path)]['metadata']
+
+    def get_files_for_sampling_type(self, sampling_type):
+        return list(self._sampling_type_index.get(sampling_type.lower(), []))
+
+    def find_settings_file(self, sampling_type=None, parameters=None):
+        """
+        Returns the name of the settings file best matching the given sampling type and parameters, i.e.
+        the file (with the sampling type if given) that covers most of the parameters. Returns None if no
+        file matches.
+        :param sampling_type:
+        :param parameters: Parameters (columns) in the data file
+        :return:
+        """
+        if sampling_type:
+            candidates = self.get_files_for_sampling_type(sampling_type)
+        else:
+            candidates = list(self.files)
+        if not candidates:
+            return None
+        if not parameters:
+            return candidates[0]
+        candidate_set = set(candidates)
+        nr_matches = dict.fromkeys(candidates, 0)
+        for par in parameters:
+            for name in self._parameter_index.get(str(par).lower(), ()):
+                if name in candidate_set:
+                    nr_matches[name] += 1
+        # Candidates are sorted by name so ties give the first in alphabetical order
+        return max(candidates, key=lambda name: nr_matches[name])
+
     def import_file(self, file_path):
         """
-        Copies the given file to the settings directory and adds update the lists.
+        Copies the given file to the settings directory and adds it to the catalogue.
         :param file_path:
         :return:
         """
         file_name = os.path.basename(file_path)
-        base, ext = os.path.splitext(file_name)
         target_file_path = os.path.join(self.directory, file_name)
         shutil.copy(file_path, target_file_path)
-        self._list_files()
-
-
+        self.refresh()
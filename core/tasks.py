@@ -0,0 +1,228 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, CancelledError
+
+from core.exceptions import *
+
+import logging
+
+gui_logger = logging.getLogger('gui_logger')
+
+
+class Task(object):
+    """
+    A job submitted to TaskExecutor. If the task function is submitted with pass_task=True it gets the task as
+    keyword argument "task" and can report progress with task.set_progress and check for cancellation with
+    task.check_cancelled.
+    """
+    def __init__(self, executor, function, args=(), kwargs={}, key=None, callback=None, error_callback=None,
+                 progress_callback=None, cancel_callback=None):
+        self.executor = executor
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.callback = callback
+        self.error_callback = error_callback
+        self.progress_callback = progress_callback
+        self.cancel_callback = cancel_callback
+
+        self.future = None
+        self.result = None
+        self.exception = None
+        self._cancel_event = threading.Event()
+
+    def __repr__(self):
+        return 'Task({})'.format(self.key)
+
+    def cancel(self):
+        """
+        Requests cancellation. A task that has not started is never run.
+        A running task stops the next time it calls check_cancelled. Tasks running in a process can not
+        check for cancellation and run to the end. In all cases the result is passed to cancel_callback
+        and not to callback.
+        :return:
+        """
+        self._cancel_event.set()
+        if self.future and not self.future.cancel() and not self.future.done() and self.executor.use_processes:
+            gui_logger.warning('Task %s is running in a process and can not be stopped', self.key)
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def check_cancelled(self):
+        """
+        Call from the task function. Raises GUIExceptionTaskCancelled if the task has been cancelled.
+        :return:
+        """
+        if self.cancelled:
+            raise GUIExceptionTaskCancelled(str(self.key))
+
+    def set_progress(self, fraction=None, message=''):
+        """
+        Call from the task function. Progress is passed on to progress_callback in the main (tk) thread.
+        :param fraction: Value between 0 and 1. None means unknown progress.
+        :param message:
+        :return:
+        """
+        self.executor._queue.put(('progress', self, (fraction, message)))
+
+
+class TaskExecutor(object):
+    """
+    Runs functions in a thread (or process) pool. Results, errors and progress are put on a queue that is
+    polled from the tk main loop via after(), so all callbacks are called in the tk thread.
+    Task functions must not touch tk widgets.
+    Only one task per key runs at a time (single flight).
+    """
+    def __init__(self, after=None, max_workers=2, use_processes=False, poll_interval=50):
+        """
+        :param after: Function to schedule a call in the tk main loop, typically tk_root.after
+        :param max_workers:
+        :param use_processes: If True a process pool is used. Functions and arguments must then be picklable
+                              and tasks can not report progress. Cancel only stops tasks that have not started.
+        :param poll_interval: Milliseconds between polls of the result queue
+        """
+        self.after = after
+        self.use_processes = use_processes
+        self.poll_interval = poll_interval
+        if use_processes:
+            self._pool = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._queue = queue.Queue()
+        self._tasks = {}
+        # Submitted tasks that are not finished, including cancelled tasks no longer in self._tasks
+        self._running = set()
+        self._polling = False
+
+    def submit(self, function, *args, key=None, callback=None, error_callback=None, progress_callback=None,
+               cancel_callback=None, pass_task=False, **kwargs):
+        """
+        Submits function to the pool. Returns the Task. If a task with the same key is running that task is
+        returned and function is not submitted.
+        :param function:
+        :param key: Key used for single flight. Defaults to the function.
+        :param callback: Called with the result when the task is finished
+        :param error_callback: Called with the exception if the task fails
+        :param progress_callback: Called with (fraction, message) when the task reports progress
+        :param cancel_callback: Called without arguments when a cancelled task has stopped (or was never run)
+        :param pass_task: If True the task is passed to function as keyword argument "task"
+        :return:
+        """
+        if key is None:
+            key = function
+        if key in self._tasks:
+            return self._tasks[key]
+        if pass_task and self.use_processes:
+            raise GUIExceptionUserError('pass_task is not supported when running in processes')
+        task = Task(self, function, args=args, kwargs=kwargs, key=key, callback=callback,
+                    error_callback=error_callback, progress_callback=progress_callback,
+                    cancel_callback=cancel_callback)
+        if pass_task:
+            task.kwargs = dict(kwargs, task=task)
+        self._tasks[key] = task
+        self._running.add(task)
+        if self.use_processes:
+            task.future = self._pool.submit(function, *args, **task.kwargs)
+        else:
+            task.future = self._pool.submit(self._run_task, task)
+        task.future.add_done_callback(lambda future, t=task: self._queue.put(('done', t, None)))
+        self._start_polling()
+        return task
+
+    @staticmethod
+    def _run_task(task):
+        task.check_cancelled()
+        return task.function(*task.args, **task.kwargs)
+
+    def is_running(self, key):
+        return key in self._tasks
+
+    def is_running_any(self):
+        return bool(self._running)
+
+    def get_task(self, key):
+        return self._tasks.get(key)
+
+    def cancel(self, key):
+        """
+        Cancels the task with the given key. The key is released directly, so a new task with the same key
+        can be submitted while the cancelled task is stopping.
+        :param key:
+        :return:
+        """
+        task = self._tasks.pop(key, None)
+        if task:
+            task.cancel()
+
+    def cancel_all(self):
+        for key in list(self._tasks):
+            self.cancel(key)
+
+    def shutdown(self, wait=False):
+        """
+        Cancels all tasks and shuts down the pool.
+        :param wait:
+        :return:
+        """
+        self.cancel_all()
+        self._pool.shutdown(wait=wait)
+
+    def _start_polling(self):
+        if self._polling:
+            return
+        self._polling = True
+        if self.after:
+            self.after(self.poll_interval, self.poll)
+
+    def poll(self):
+        """
+        Handles finished tasks and progress reports. Called in the tk thread.
+        If no after function is given this has to be called by the owner.
+        :return:
+        """
+        while True:
+            try:
+                event, task, data = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if event == 'progress':
+                if task.progress_callback and not task.cancelled:
+                    task.progress_callback(*data)
+            elif event == 'done':
+                self._finish_task(task)
+
+        self._polling = False
+        if self._running:
+            self._start_polling()
+
+    def _finish_task(self, task):
+        self._running.discard(task)
+        if self._tasks.get(task.key) is task:
+            self._tasks.pop(task.key)
+        try:
+            task.result = task.future.result()
+            if task.cancelled:
+                # The function did not check for cancellation (or runs in a process) and finished anyway
+                raise GUIExceptionTaskCancelled(str(task.key))
+        except (CancelledError, GUIExceptionTaskCancelled):
+            gui_logger.debug('Task cancelled: %s', task.key)
+            if task.cancel_callback:
+                task.cancel_callback()
+            return
+        except Exception as e:
+            task.exception = e
+            gui_logger.error('Task failed: %s', task.key, exc_info=e)
+            if task.error_callback:
+                task.error_callback(e)
+            return
+        if task.callback:
+            task.callback(task.result)
@@ -0,0 +1,167 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Sorted time index for a loaded dataset. Time ranges are translated to row positions with binary search
+instead of filtering the data with boolean masks.
+"""
+import numpy as np
+
+import logging
+
+gui_logger = logging.getLogger('gui_logger')
+
+
+def _to_datetime64(value):
+    if value is None:
+        return None
+    if isinstance(value, np.datetime64):
+        return value.astype('datetime64[ns]')
+    return np.datetime64(value, 'ns')
+
+
+def _to_datetime(value):
+    """
+    Returns a datetime.datetime for a datetime64 value (microsecond resolution as in the time widgets).
+    """
+    return value.astype('datetime64[us]').item()
+
+
+class TimeIndex(object):
+    """
+    Sorted datetime64 array of the timestamps in a dataset.
+    Ranges are given as datetime objects, datetime64 or strings and are inclusive in both ends.
+    """
+    def __init__(self, times):
+        """
+        :param times: Timestamps of the rows in the dataset (any order, NaT/None are ignored)
+        """
+        times = np.asarray(times, dtype='datetime64[ns]')
+        valid = np.flatnonzero(~np.isnat(times))
+        order = np.argsort(times[valid], kind='stable')
+        # Row positions in the original data in time order
+        self.rows = valid[order]
+        self.times = times[self.rows]
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def start(self):
+        if not len(self.times):
+            return None
+        return _to_datetime(self.times[0])
+
+    @property
+    def end(self):
+        if not len(self.times):
+            return None
+        return _to_datetime(self.times[-1])
+
+    def get_slice(self, start=None, end=None):
+        """
+        Returns the slice of self.times (and self.rows) with start <= time <= end.
+        :param start: None means from the first time
+        :param end: None means to the last time
+        :return:
+        """
+        i0 = 0 if start is None else int(np.searchsorted(self.times, _to_datetime64(start), side='left'))
+        i1 = len(self.times) if end is None else int(np.searchsorted(self.times, _to_datetime64(end), side='right'))
+        return slice(i0, max(i0, i1))
+
+    def get_rows(self, start=None, end=None):
+        """
+        Returns the positions (in the original data) of the rows in the range, in time order.
+        Use with DataFrame.iloc instead of a boolean mask.
+        """
+        return self.rows[self.get_slice(start, end)]
+
+    def count(self, start=None, end=None):
+        """
+        Returns the number of samples in the range.
+        """
+        s = self.get_slice(start, end)
+        return s.stop - s.start
+
+    def get_counts(self, edges):
+        """
+        Returns the number of samples between consecutive edges (edges[i] <= time < edges[i+1]).
+        :param edges: Sorted times
+        :return:
+        """
+        edges = np.asarray([_to_datetime64(edge) for edge in edges], dtype='datetime64[ns]')
+        return np.diff(np.searchsorted(self.times, edges, side='left'))
+
+    def snap(self, time, direction='nearest'):
+        """
+        Returns the existing timestamp closest to time as a datetime.
+        :param time:
+        :param direction: "nearest", "before" (latest time <= time) or "after" (first time >= time)
+        :return: None if there is no timestamp in the given direction
+        """
+        if not len(self.times):
+            return None
+        value = _to_datetime64(time)
+        i = int(np.searchsorted(self.times, value, side='left'))
+        if i < len(self.times) and self.times[i] == value:
+            return _to_datetime(self.times[i])
+        before = self.times[i - 1] if i > 0 else None
+        after = self.times[i] if i < len(self.times) else None
+        if direction == 'before':
+            result = before
+        elif direction == 'after':
+            result = after
+        elif before is None:
+            result = after
+        elif after is None:
+            result = before
+        else:
+            result = before if value - before <= after - value else after
+        if result is None:
+            return None
+        return _to_datetime(result)
+
+    def clamp(self, start=None, end=None, snap=False):
+        """
+        Limits the range to the times in the index. If snap is True start and end are moved to existing
+        timestamps inside the range. Returns (start, end) as datetime.
+        :param start:
+        :param end:
+        :param snap:
+        :return:
+        """
+        if not len(self.times):
+            return None, None
+        start = self.times[0] if start is None else max(_to_datetime64(start), self.times[0])
+        end = self.times[-1] if end is None else min(_to_datetime64(end), self.times[-1])
+        if snap:
+            return self.snap(start, direction='after'), self.snap(end, direction='before')
+        return _to_datetime(start), _to_datetime(end)
+
+
+_time_indexes = {}
+
+
+def get_time_index(dataset_key, times=None):
+    """
+    Returns the TimeIndex for the dataset. The index is created from times the first time and then reused.
+    :param dataset_key: e.g. file path of the loaded data
+    :param times: Needed the first time
+    :return: None if no index exists and times is not given
+    """
+    if dataset_key not in _time_indexes:
+        if times is None:
+            return None
+        _time_indexes[dataset_key] = TimeIndex(times)
+        gui_logger.debug('Time index created for %s: %s times', dataset_key, len(_time_indexes[dataset_key]))
+    return _time_indexes[dataset_key]
+
+
+def clear_time_index(dataset_key=None):
+    """
+    Removes the index for the dataset (all indexes if no key is given). Call when the data is changed or
+    unloaded.
+    """
+    if dataset_key is None:
+        _time_indexes.clear()
+    else:
+        _time_indexes.pop(dataset_key, None)
@@ -1,44 +1,560 @@
 # Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 import os
+import copy
+import time
 import shutil
 import json
+import hashlib
 import datetime
-import pandas as pd
+import queue
 import socket
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from core.exceptions import *
+from core.utils import atomic_write_json
+from core.parameters import ParameterCatalogue, DEFAULT_PARAMETER_ALIASES
 
 import logging
 
 gui_logger = logging.getLogger('gui_logger')
 
 
+def _copy_inherited(value):
+    """
+    Returns a copy of a value inherited from a parent profile if it can be changed in place (dict, list or set),
+    so that changes made by the caller do not change the parent. Other values are returned as they are.
+    """
+    if isinstance(value, (dict, list, set)):
+        return copy.deepcopy(value)
+    return value
+
+
+def _is_same_value(value, other_value):
+    """
+    Returns True if the values are equal. Values that can not be compared to a single bool (e.g. numpy arrays
+    and pandas objects) are seen as different.
+    """
+    try:
+        result = value == other_value
+    except (TypeError, ValueError):
+        return False
+    return result if isinstance(result, bool) else False
+
+
+class UserDirectoryMirror(object):
+    """
+    Local copy of a users directory on a slow (network) share.
+    pull() copies new and changed files from the share. After that the user manager only reads and writes the
+    local copy, and changed files are pushed back to the share in a background thread (push).
+
+    When a json file is pushed with the changed keys, the share is locked with a lock file next to the file
+    and only the changed keys are merged into the file on the share, so changes made on another workstation
+    are kept. The merged file is copied back to the local directory. Files pushed without keys replace the
+    file on the share. Files without changed keys take the version on the share if it has changed since it
+    was last copied (mtime and size).
+    local_change_callback is called with the local file path (from the mirror thread) each time a local file
+    is replaced or removed by the mirror, e.g. to reload the settings in memory.
+    """
+    lock_timeout = 10
+    stale_lock_age = 60
+
+    def __init__(self, remote_directory, local_directory, local_change_callback=None):
+        self.remote_directory = remote_directory
+        self.local_directory = local_directory
+        self.local_change_callback = local_change_callback
+        self.state_file_path = self.local_directory.rstrip('/\\') + '.mirror.json'
+        # Relative file path -> [mtime, size] of the file on the share when last copied
+        self._versions = self._load_versions()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _load_versions(self):
+        if not os.path.exists(self.state_file_path):
+            return {}
+        try:
+            with open(self.state_file_path) as fid:
+                return json.load(fid)
+        except ValueError:
+            return {}
+
+    def _save_versions(self):
+        with self._lock:
+            versions = dict(self._versions)
+        atomic_write_json(self.state_file_path, versions)
+
+    def _get_remote_version(self, remote_path):
+        try:
+            stat = os.stat(remote_path)
+        except OSError:
+            return None
+        return [stat.st_mtime, stat.st_size]
+
+    def _iter_files(self, directory):
+        for root, dirs, files in os.walk(directory):
+            for file_name in files:
+                if file_name.endswith('.lock') or '.tmp' in file_name:
+                    continue
+                yield os.path.relpath(os.path.join(root, file_name), directory)
+
+    def _local_changed(self, local_path):
+        if not self.local_change_callback:
+            return
+        try:
+            self.local_change_callback(local_path)
+        except Exception:
+            gui_logger.exception('Error in local change callback for %s', local_path)
+
+    def pull(self):
+        """
+        Copies new and changed files from the share to the local directory. Files that have been removed from
+        the share are removed locally, together with directories that are empty after that, and files only
+        found locally are pushed.
+        Files with a scheduled push are not copied, the push merges them with the share.
+        :return:
+        """
+        if not os.path.exists(self.remote_directory):
+            os.makedirs(self.remote_directory)
+        remote_files = set()
+        for rel_path in self._iter_files(self.remote_directory):
+            remote_files.add(rel_path)
+            remote_path = os.path.join(self.remote_directory, rel_path)
+            local_path = os.path.join(self.local_directory, rel_path)
+            version = self._get_remote_version(remote_path)
+            with self._lock:
+                if self._versions.get(rel_path) == version and os.path.exists(local_path):
+                    continue
+                if rel_path in self._pending:
+                    continue
+            self._copy(remote_path, local_path)
+            with self._lock:
+                self._versions[rel_path] = version
+            self._local_changed(local_path)
+        if os.path.exists(self.local_directory):
+            for rel_path in list(self._iter_files(self.local_directory)):
+                if rel_path in remote_files:
+                    continue
+                local_path = os.path.join(self.local_directory, rel_path)
+                with self._lock:
+                    removed = self._versions.pop(rel_path, None) is not None
+                if removed:
+                    # Removed from the share
+                    os.remove(local_path)
+                    self._remove_empty_directories(os.path.dirname(rel_path))
+                    self._local_changed(local_path)
+                else:
+                    self.push(local_path)
+        else:
+            os.makedirs(self.local_directory)
+        self._save_versions()
+
+    def _remove_empty_directories(self, rel_directory):
+        """
+        Removes the local directory rel_directory and its parents if they are empty and removed from the share
+        (e.g. a removed user).
+        """
+        while rel_directory:
+            local_directory = os.path.join(self.local_directory, rel_directory)
+            if os.path.exists(os.path.join(self.remote_directory, rel_directory)) or os.listdir(local_directory):
+                return
+            os.rmdir(local_directory)
+            rel_directory = os.path.dirname(rel_directory)
+
+    def pull_in_background(self):
+        """
+        Schedules pull() in the mirror thread. Changed files are reported through local_change_callback.
+        :return:
+        """
+        self._executor.submit(self._pull_safe)
+
+    def _pull_safe(self):
+        try:
+            self.pull()
+        except Exception:
+            gui_logger.exception('Could not pull %s', self.remote_directory)
+
+    def _copy(self, from_path, to_path):
+        directory = os.path.dirname(to_path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = '{}.{}.tmp'.format(to_path, os.getpid())
+        shutil.copy2(from_path, tmp_path)
+        os.replace(tmp_path, to_path)
+
+    def push(self, local_path, keys=None):
+        """
+        Schedules a copy of the local file to the share.
+        :param local_path: File in the local directory
+        :param keys: Keys changed in a json file since last push. None means that the whole file is replaced.
+        :return:
+        """
+        rel_path = os.path.relpath(local_path, self.local_directory)
+        with self._lock:
+            queued = rel_path in self._pending
+            if not queued:
+                self._pending[rel_path] = set()
+            if keys is None:
+                self._pending[rel_path] = None
+            elif self._pending[rel_path] is not None:
+                self._pending[rel_path].update(keys)
+        if not queued:
+            self._executor.submit(self._push_pending, rel_path)
+
+    def push_directory(self, local_directory):
+        """
+        Schedules a push of all files in the given local directory (e.g. a new user).
+        """
+        for rel_path in self._iter_files(local_directory):
+            self.push(os.path.join(local_directory, rel_path))
+
+    def _push_pending(self, rel_path):
+        with self._lock:
+            keys = self._pending.pop(rel_path)
+        try:
+            self._push_file(rel_path, keys)
+        except Exception:
+            gui_logger.exception('Could not push %s to %s', rel_path, self.remote_directory)
+
+    @contextmanager
+    def _remote_lock(self, remote_path):
+        lock_path = remote_path + '.lock'
+        t0 = time.time()
+        while True:
+            try:
+                fid = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > self.stale_lock_age:
+                        os.remove(lock_path)
+                        continue
+                except OSError:
+                    continue
+                if time.time() - t0 > self.lock_timeout:
+                    raise TimeoutError('Could not lock {}'.format(remote_path))
+                time.sleep(0.1)
+        try:
+            os.write(fid, socket.gethostname().encode('utf8'))
+            os.close(fid)
+            yield
+        finally:
+            os.remove(lock_path)
+
+    def _push_file(self, rel_path, keys):
+        local_path = os.path.join(self.local_directory, rel_path)
+        remote_path = os.path.join(self.remote_directory, rel_path)
+        if not os.path.exists(local_path):
+            return
+        directory = os.path.dirname(remote_path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._remote_lock(remote_path):
+            remote_version = self._get_remote_version(remote_path)
+            remote_changed = remote_version is not None and remote_version != self._versions.get(rel_path)
+            if remote_version is None or keys is None:
+                # New file or the whole file is replaced (latest write is used)
+                self._copy(local_path, remote_path)
+            elif keys and rel_path.endswith('.json'):
+                # Only the changed keys are written. The local file may have been written from data loaded
+                # before the latest merge, so it is never copied as a whole.
+                if remote_changed:
+                    gui_logger.info('%s changed on %s, merging %s', rel_path, self.remote_directory, sorted(keys))
+                if self._merge(local_path, remote_path, keys):
+                    self._local_changed(local_path)
+            elif remote_changed:
+                gui_logger.info('%s changed on %s, using that version', rel_path, self.remote_directory)
+                self._copy(remote_path, local_path)
+                self._local_changed(local_path)
+            else:
+                self._copy(local_path, remote_path)
+            with self._lock:
+                self._versions[rel_path] = self._get_remote_version(remote_path)
+        self._save_versions()
+
+    def _merge(self, local_path, remote_path, keys):
+        """
+        Writes the given keys of the local file to the file on the share and copies the result back.
+        Returns True if the local file got other content than it had.
+        """
+        with open(local_path) as fid:
+            local_data = json.load(fid)
+        with open(remote_path) as fid:
+            merged_data = json.load(fid)
+        for key in keys:
+            if key in local_data:
+                merged_data[key] = local_data[key]
+            else:
+                merged_data.pop(key, None)
+        atomic_write_json(remote_path, merged_data)
+        if merged_data == local_data:
+            return False
+        self._copy(remote_path, local_path)
+        return True
+
+    def flush(self):
+        """
+        Waits until all scheduled pushes are done.
+        :return:
+        """
+        self._executor.submit(lambda: None).result()
+
+    def shutdown(self):
+        self.flush()
+        self._executor.shutdown()
+
+
 class UserManager(object):
-    def __init__(self, users_root_directory):
+    def __init__(self, users_root_directory, read_only=False):
+        """
+        :param users_root_directory:
+        :param read_only: If True nothing is written to disk: no users or settings files are created, the
+                          active user is not saved and changes in user settings are only kept in memory
+                          (used in batch mode).
+        """
+        self.read_only = read_only
         self.directory_user_settings = {}
+        self.save_scheduler = None
+        self.users = {}
+        # Users directory on share -> UserDirectoryMirror
+        self.mirrors = {}
+        # Local files replaced by a mirror thread, handled in process_mirror_changes
+        self._mirror_changes = queue.Queue()
+        # Cache of users per users directory. Each entry holds the users, the directory mtime at the
+        # last scan, the name stored in the .active file and a version that is set when users are
+        # added or removed.
+        self._directory_cache = {}
+        # Versions come from one counter that only increases, also when a directory is rescanned from scratch
+        self._user_list_version = 0
+
+    def set_save_scheduler(self, save_scheduler):
+        """
+        Sets the function used to postpone saving of user settings. save_scheduler is called with a single
+        callback that should be called later, for example: lambda func: tk_root.after(1000, func).
+        If no scheduler is set user settings are saved directly.
+        :param save_scheduler:
+        :return:
+        """
+        self.save_scheduler = save_scheduler
+        for user in self._get_all_cached_users():
+            user.set_save_scheduler(save_scheduler)
+
+    def flush(self):
+        """
+        Writes all pending user settings changes to file (and waits until they are pushed to the share if
+        mirrored).
+        :return:
+        """
+        for user in self._get_all_cached_users():
+            user.flush()
+        for mirror in self.mirrors.values():
+            mirror.flush()
+        self.process_mirror_changes()
 
-    def set_users_directory(self, users_root_directory):
+    def add_mirror(self, users_root_directory, local_directory, background_pull=True):
+        """
+        Mirrors the users directory to local_directory (see UserDirectoryMirror). The users directory is still
+        given as users_root_directory in all calls, but files are read from and written to the local copy.
+        Must be called before the directory is used.
+        :param users_root_directory:
+        :param local_directory:
+        :param background_pull: If True and a local copy exists from before, the local copy is used directly
+                                and updated from the share in the mirror thread (see process_mirror_changes).
+                                The first time the share is always copied before returning.
+        :return:
+        """
+        if users_root_directory in self.mirrors:
+            return
+        mirror = UserDirectoryMirror(users_root_directory, local_directory,
+                                     local_change_callback=self._mirror_changes.put)
+        if background_pull and os.path.exists(local_directory):
+            mirror.pull_in_background()
+        else:
+            mirror.pull()
+            self._clear_mirror_changes()
+        self.mirrors[users_root_directory] = mirror
+
+    def _clear_mirror_changes(self):
+        changed = set()
+        while True:
+            try:
+                changed.add(os.path.normcase(os.path.abspath(self._mirror_changes.get_nowait())))
+            except queue.Empty:
+                return changed
+
+    def process_mirror_changes(self):
+        """
+        Reloads the user settings whose files have been replaced by a mirror (merged with changes from another
+        workstation or pulled from the share), and rescans users directories that have changed.
+        If the active user has been removed from the share, the "default" user is made active.
+        Should be called regularly from the thread using the user manager (e.g. with tk after).
+        Returns True if anything was reloaded.
+        :return:
+        """
+        changed = self._clear_mirror_changes()
+        if not changed:
+            return False
+        for directory, cache in list(self._directory_cache.items()):
+            for user in cache['users'].values():
+                for obj in user.settings.values():
+                    if os.path.normcase(os.path.abspath(obj.file_path)) in changed:
+                        gui_logger.debug('Reloading %s', obj.file_path)
+                        obj.reload()
+            if cache['mtime'] != self._get_directory_mtime(directory):
+                # Users added or removed on the share
+                cache = self._scan_users_directory(directory)
+                if directory == getattr(self, 'users_root_directory', None):
+                    self.users = cache['users']
+                    self._replace_removed_active_user()
+        return True
+
+    def _replace_removed_active_user(self):
+        user = getattr(self, 'user', None)
+        if user is None or user.name in self.users:
+            return
+        if 'default' in self.users or not self.read_only:
+            new_user_name = 'default'
+        elif self.users:
+            new_user_name = sorted(self.users)[0]
+        else:
+            self.user = None
+            return
+        gui_logger.warning('User %s has been removed, changing to user %s', user.name, new_user_name)
+        self.set_user(new_user_name, create_if_missing=True)
+
+    def _get_local_directory(self, users_root_directory):
+        mirror = self.mirrors.get(users_root_directory)
+        if mirror:
+            return mirror.local_directory
+        return users_root_directory
+
+    def _get_mirror_for_local_directory(self, local_directory):
+        for mirror in self.mirrors.values():
+            if mirror.local_directory == local_directory:
+                return mirror
+        return None
+
+    def _get_all_cached_users(self):
+        all_users = []
+        for cache in self._directory_cache.values():
+            all_users.extend(cache['users'].values())
+        return all_users
+
+    def set_users_directory(self, users_root_directory, check_modified=False):
+        """
+        Sets the active users directory. Users are cached per directory so switching back to a directory
+        that has been loaded before does not touch the disk.
+        :param users_root_directory:
+        :param check_modified: If True the directory is rescanned if its modification time has changed.
+        :return:
+        """
+        users_root_directory = self._get_local_directory(users_root_directory)
         self.users_root_directory = users_root_directory
-        if not os.path.exists(self.users_root_directory):
-            os.mkdir(self.users_root_directory)
-        self.users = {}
-        for user in os.listdir(users_root_directory):
-            if user == '.active':
-                continue
-            # print('-', user)
-            self.users[user] = User(user, users_root_directory)
-            directory_dict = self.directory_user_settings.get(self.users_root_directory, {})
-            for settings_type in directory_dict:
-                # print('--', settings_type)
-                for item in directory_dict[settings_type]:
-                    # print('---', item)
-                    self.users[user]._add_user_settings(settings_type, **item)
+        cache = self._directory_cache.get(users_root_directory)
+        if not cache:
+            cache = self._scan_users_directory(users_root_directory)
+        elif check_modified and cache['mtime'] != self._get_directory_mtime(users_root_directory):
+            cache = self._scan_users_directory(users_root_directory)
+        self.users = cache['users']
         try:
             self.set_active_user()
         except GUIExceptionUserError:
             pass
 
+    def refresh_users_directory(self, users_root_directory=None):
+        """
+        Rebuilds all users in the given directory (default is the active directory) from disk.
+        :param users_root_directory:
+        :return:
+        """
+        if not users_root_directory:
+            users_root_directory = self.users_root_directory
+        users_root_directory = self._get_local_directory(users_root_directory)
+        cache = self._directory_cache.pop(users_root_directory, None)
+        if cache:
+            for user in cache['users'].values():
+                if os.path.exists(user.user_directory):
+                    user.flush()
+                else:
+                    user.discard_pending()
+        if users_root_directory == self.users_root_directory:
+            self.set_users_directory(users_root_directory)
+
+    def _get_directory_mtime(self, directory):
+        try:
+            return os.stat(directory).st_mtime
+        except OSError:
+            return None
+
+    def _scan_users_directory(self, users_root_directory):
+        """
+        Lists the users directory and updates the cache. Users already in the cache are kept as they are.
+        :param users_root_directory:
+        :return:
+        """
+        if not os.path.exists(users_root_directory) and not self.read_only:
+            os.mkdir(users_root_directory)
+        cache = self._directory_cache.setdefault(users_root_directory, dict(users={},
+                                                                             mtime=None,
+                                                                             active_user=None,
+                                                                             version=0))
+        old_users = cache['users']
+        cache['users'] = {}
+        user_names = os.listdir(users_root_directory) if os.path.exists(users_root_directory) else []
+        for user in user_names:
+            # .active and lock files
+            if user.startswith('.') or user.endswith('.lock'):
+                continue
+            # print('-', user)
+            if user in old_users:
+                cache['users'][user] = old_users.pop(user)
+            else:
+                cache['users'][user] = self._create_user(user, users_root_directory)
+        # Users removed from disk. Pending changes can not be written to the removed directory.
+        for user in old_users.values():
+            user.discard_pending()
+        self._link_parents(cache['users'])
+        cache['mtime'] = self._get_directory_mtime(users_root_directory)
+        cache['active_user'] = None
+        cache['version'] = self._get_next_user_list_version()
+        return cache
+
+    def _get_next_user_list_version(self):
+        self._user_list_version += 1
+        return self._user_list_version
+
+    def _link_parents(self, users):
+        """
+        Sets the parent (template) user of all layered users in users. A parent that is missing or that
+        would give a cycle is ignored.
+        :param users: dict with users in the same directory
+        :return:
+        """
+        for user in users.values():
+            parent = users.get(user.parent_name) if user.parent_name else None
+            ancestor = parent
+            while ancestor is not None:
+                if ancestor is user:
+                    gui_logger.warning('Cyclic user profiles, %s is not layered on %s', user.name, user.parent_name)
+                    parent = None
+                    break
+                ancestor = ancestor.parent
+            user.parent = parent
+
+    def _create_user(self, user_name, users_root_directory):
+        mirror = self._get_mirror_for_local_directory(users_root_directory)
+        user = User(user_name, users_root_directory, save_scheduler=self.save_scheduler,
+                    save_callback=mirror.push if mirror else None, read_only=self.read_only)
+        directory_dict = self.directory_user_settings.get(users_root_directory, {})
+        for settings_type in directory_dict:
+            # print('--', settings_type)
+            for item in directory_dict[settings_type]:
+                # print('---', item)
+                user._add_user_settings(settings_type, **item)
+        return user
+
     def set_user(self, user_name, create_if_missing=False):
         if user_name not in self.users:
             if create_if_missing:
@@ -51,22 +567,39 @@ class UserManager(object):
     def get_user_list(self):
         return sorted(self.users)
 
+    def get_user_list_id(self):
+        """
+        Returns a value that changes when the user list changes, i.e. when the users directory is changed or
+        users are added or removed. Used to check if the user list has changed without listing the users.
+        :return:
+        """
+        cache = self._directory_cache.get(self.users_root_directory, {})
+        return self.users_root_directory, cache.get('version')
+
     def add_user(self, user_name, from_user=None):
-        print('¤¤¤', self.users_root_directory)
+        if self.read_only:
+            raise GUIExceptionUserError('Can not add user {}, users are read only'.format(user_name))
         if user_name in self.users:
             raise GUIExceptionUserError('User already exists')
         if from_user:
             if from_user not in self.users:
                 raise GUIExceptionUserError('Could not find source user')
-            from_dir = os.path.join(self.users_root_directory, from_user)
-            to_dir = os.path.join(self.users_root_directory, user_name)
-            shutil.copytree(from_dir, to_dir)
+            # Layered profile. Only the changes are stored for the new user, the rest is read from from_user.
+            User.write_profile(os.path.join(self.users_root_directory, user_name), parent=from_user)
         else:
             # New user
             pass
-        self.users[user_name] = User(user_name, self.users_root_directory)
+        self.users[user_name] = self._create_user(user_name, self.users_root_directory)
+        self._link_parents(self.users)
+        mirror = self._get_mirror_for_local_directory(self.users_root_directory)
+        if mirror:
+            mirror.push_directory(os.path.join(self.users_root_directory, user_name))
+        self._directory_cache[self.users_root_directory]['mtime'] = \
+            self._get_directory_mtime(self.users_root_directory)
+        self._directory_cache[self.users_root_directory]['version'] = self._get_next_user_list_version()
 
     def add_user_settings(self, users_directory=None, settings_type=None, settings_name=None, **kwargs):
+        users_directory = self._get_local_directory(users_directory)
         self.directory_user_settings.setdefault(users_directory, {})
         kw = dict(name=settings_name)
         kw.update(kwargs)
@@ -79,15 +612,28 @@ class UserManager(object):
         elif settings_type == 'prioritylist':
             self.directory_user_settings[users_directory].setdefault('prioritylist', [])
             self.directory_user_settings[users_directory]['prioritylist'].append(kw)
+        else:
+            return
+        # Users already cached for the directory get the new settings directly
+        cache = self._directory_cache.get(users_directory)
+        if cache:
+            for user in cache['users'].values():
+                if settings_name not in user.settings:
+                    user._add_user_settings(settings_type, **kw)
 
     def get_default_user_settings(self, settings, key):
-        try:
-            user = self.users['default']
-            settings = getattr(user, settings)
-            value = settings.get(key)
-            return value
-        except:
+        """
+        Returns the value of key in the template profile of the active user, i.e. the value the user would
+        have without own changes. The "default" user is used if the active user has no template.
+        :param settings: Name of the settings, e.g. "options"
+        :param key:
+        :return:
+        """
+        user = getattr(self, 'user', None)
+        template = user.parent if user and user.parent else self.users.get('default')
+        if not template or settings not in template.settings:
             return None
+        return template.settings[settings].get(key)
 
     def load_active_user(self):
         """
@@ -104,59 +650,177 @@ class UserManager(object):
         return os.path.join(self.users_root_directory, '.active')
 
     def _get_active_user(self):
+        cache = self._directory_cache.get(self.users_root_directory)
+        if cache and cache['active_user']:
+            return cache['active_user']
         file_path = self._get_active_user_file_path()
         if not os.path.exists(file_path):
             active_user = socket.gethostname()
         else:
             with open(file_path) as fid:
                 active_user = fid.readline().strip()
+            if cache:
+                cache['active_user'] = active_user
         return active_user
 
     def _save_active_user(self, user):
+        if self.read_only:
+            return
+        cache = self._directory_cache.get(self.users_root_directory)
+        if cache and cache['active_user'] == user:
+            return
         file_path = self._get_active_user_file_path()
         with open(file_path, 'w') as fid:
             fid.write(user)
+        if cache:
+            cache['active_user'] = user
+        mirror = self._get_mirror_for_local_directory(self.users_root_directory)
+        if mirror:
+            mirror.push(file_path)
 
 
 class User(object):
-    def __init__(self, name, users_root_directory, **kwargs):
+    """
+    A user profile. If the user directory contains a profile file with a parent (template) user, the user is
+    layered: the settings files only hold the changes made by this user and everything else is read from the
+    parent (see UserSettings). Changes in the parent are then seen by the user.
+    """
+    profile_file_name = '.profile'
+
+    def __init__(self, name, users_root_directory, save_scheduler=None, save_callback=None, read_only=False,
+                 **kwargs):
         self.name = name
+        self.read_only = read_only
         # print(self.name)
         self.user_directory = os.path.join(users_root_directory, self.name)
-        if not os.path.exists(self.user_directory):
+        self.save_scheduler = save_scheduler
+        self.save_callback = save_callback
+        self.settings = {}
+        # Parent User object, set by UserManager
+        self.parent = None
+        if not os.path.exists(self.user_directory) and not self.read_only:
             os.mkdir(self.user_directory)
+        self.parent_name = self._load_profile().get('parent')
+
+    def _load_profile(self):
+        file_path = os.path.join(self.user_directory, self.profile_file_name)
+        if not os.path.exists(file_path):
+            return {}
+        with open(file_path) as fid:
+            return json.load(fid)
+
+    @classmethod
+    def write_profile(cls, user_directory, parent=None):
+        if not os.path.exists(user_directory):
+            os.makedirs(user_directory)
+        atomic_write_json(os.path.join(user_directory, cls.profile_file_name), dict(parent=parent))
+
+    def _get_parent_settings(self, settings_name):
+        if self.parent is None:
+            return None
+        return self.parent.settings.get(settings_name)
 
 
     def _add_user_settings(self, settings_type, **kwargs):
+        kwargs.setdefault('save_scheduler', self.save_scheduler)
+        kwargs.setdefault('save_callback', self.save_callback)
+        kwargs.setdefault('read_only', self.read_only)
+        if self.parent_name:
+            kwargs.setdefault('get_parent', lambda name=kwargs.get('name'): self._get_parent_settings(name))
         if settings_type == 'basic':
             obj = UserSettings(directory=self.user_directory, user=self.name, **kwargs)
         elif settings_type == 'parameter':
             obj = UserSettingsParameter(directory=self.user_directory, user=self.name, **kwargs)
         elif settings_type == 'prioritylist':
             obj = UserSettingsPriorityList(directory=self.user_directory, user=self.name, **kwargs)
+        self.settings[obj.name] = obj
         setattr(self, obj.name, obj)
 
+    def set_save_scheduler(self, save_scheduler):
+        self.save_scheduler = save_scheduler
+        for obj in self.settings.values():
+            obj.save_scheduler = save_scheduler
+
+    def flush(self):
+        """
+        Writes all pending settings changes for the user to file.
+        :return:
+        """
+        for obj in self.settings.values():
+            obj.flush()
+
+    def discard_pending(self):
+        """
+        Drops all pending settings changes and makes the user read only. Used when the user directory has been
+        removed from disk (e.g. by another workstation).
+        :return:
+        """
+        self.read_only = True
+        for obj in self.settings.values():
+            obj.discard_pending()
 
 
 class UserSettings(object):
     """
     Baseclass for user settings.
+    Changes are written behind: set, setdefault and remove mark the settings as dirty and the json file is
+    written by the save_scheduler (if given), at the end of a batch() or when flush() is called.
+    save_callback is called with the file path and the changed keys after each write, e.g.
+    UserDirectoryMirror.push. When the whole file is saved (save, reset) the keys are all keys in the file now
+    or when it was last read or written, so keys only set on another workstation are kept by the mirror.
+    If get_parent returns a settings object (the same settings of the parent user), keys that are not set
+    for this user are read from the parent. Values read from the parent are copies, so changing them and
+    calling set stores them for this user and never changes the parent.
+    If read_only is True the file is never written (or created), changes are only kept in memory.
     """
-    def __init__(self, directory=None, name=None, user=None, time_string_format='%Y-%m-%d %H:%M:%S'):
+    def __init__(self, directory=None, name=None, user=None, time_string_format='%Y-%m-%d %H:%M:%S',
+                 save_scheduler=None, save_callback=None, get_parent=None, read_only=False):
         self.directory = directory
         self.name = name
         self.user = user
         self.file_path = os.path.join(self.directory, '{}.json'.format(self.name))
         self.time_string_format = time_string_format
+        self.save_scheduler = save_scheduler
+        self.save_callback = save_callback
+        self.get_parent = get_parent
+        self.read_only = read_only
         self.data = {}
+        # Increased on every change, used to cache values computed from the settings
+        self.version = 0
+
+        self._dirty_keys = set()
+        # Keys in the file when it was last read or written
+        self._file_keys = set()
+        self._save_pending = False
+        self._batch_level = 0
 
-        if not os.path.exists(self.directory):
-            os.makedirs(self.directory)
+        if not self.read_only:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            if not os.path.exists(self.file_path):
+                self.save()
+
+        self._load()
 
-        if not os.path.exists(self.file_path):
-            self.save()
+    @property
+    def parent(self):
+        if self.get_parent is None:
+            return None
+        return self.get_parent()
 
+    def reload(self):
+        """
+        Loads the file again, e.g. after it has been merged with changes from another workstation.
+        Changes not yet written to file are kept.
+        :return:
+        """
+        unsaved = {key: self.data[key] for key in self._dirty_keys if key in self.data}
+        removed = [key for key in self._dirty_keys if key not in self.data]
         self._load()
+        for key in removed:
+            self.data.pop(key, None)
+        self.data.update(unsaved)
+        self.version += 1
 
     def _load(self):
         """
@@ -166,6 +830,7 @@ class UserSettings(object):
         if os.path.exists(self.file_path):
             with open(self.file_path) as fid:
                 self.data = json.load(fid)
+            self._file_keys = set(self.data)
         self.datestring_to_datetime()
 
     def datestring_to_datetime(self):
@@ -174,31 +839,94 @@ class UserSettings(object):
                 if value:
                     self.data[key] = datetime.datetime.strptime(value, self.time_string_format)
 
-    def datetime_to_datestring(self):
-        for key, value in self.data.items():
+    def _datetime_to_datestring(self, value):
+        if hasattr(value, 'strftime'):
+            return value.strftime(self.time_string_format)
+        # Other time representations (numpy, strings etc.). pandas is only needed here.
+        import pandas as pd
+        return pd.to_datetime(value).strftime(self.time_string_format)
+
+    def _get_save_data(self):
+        """
+        Returns a copy of self.data where time objects are converted to strings.
+        :return:
+        """
+        save_data = dict(self.data)
+        for key, value in save_data.items():
             if 'time' in key:
                 if value:
-                    self.data[key] = pd.to_datetime(value).strftime(self.time_string_format)
+                    save_data[key] = self._datetime_to_datestring(value)
+        return save_data
 
     def save(self):
         """
-        Writes information to json file.
-        :return:
-        """
-        # if self.user == 'default':
-        #     return
-        # Convert datetime object to str
-        self.datetime_to_datestring()
-        # print('=' * 20)
-        # print('SAVE')
-        # for key in sorted(self.data):
-        #     print(key, type(self.data[key]), self.data[key])
-        #     import datetime
-        #
-        # print('=' * 20)
-        with open(self.file_path, 'w') as fid:
-            json.dump(self.data, fid)
-        self.datestring_to_datetime()
+        Writes information to json file. The file is replaced atomically.
+        :return:
+        """
+        self._write(keys=None)
+
+    def _write(self, keys=None):
+        if self.read_only:
+            self._dirty_keys = set()
+            return
+        save_data = self._get_save_data()
+        if keys is None:
+            keys = self._file_keys | set(save_data)
+        atomic_write_json(self.file_path, save_data)
+        self._file_keys = set(save_data)
+        self._dirty_keys = set()
+        if self.save_callback:
+            self.save_callback(self.file_path, keys)
+
+    def flush(self):
+        """
+        Writes information to json file if there are unsaved changes.
+        :return:
+        """
+        self._save_pending = False
+        if self._dirty_keys:
+            self._write(keys=set(self._dirty_keys))
+
+    def discard_pending(self):
+        """
+        Drops changes not yet written to file. Later changes are not written (the settings are made read only).
+        :return:
+        """
+        gui_logger.debug('Discarding unsaved changes in %s: %s', self.file_path, sorted(self._dirty_keys))
+        self.read_only = True
+        self._dirty_keys = set()
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager used to make several changes with only one write to file:
+            with user.parameter_priority.batch():
+                ...
+        :return:
+        """
+        self._batch_level += 1
+        try:
+            yield self
+        finally:
+            self._batch_level -= 1
+            if not self._batch_level:
+                self.flush()
+
+    def _request_save(self, key):
+        """
+        Marks key as changed and saves or schedules a save.
+        :param key:
+        :return:
+        """
+        self._dirty_keys.add(key)
+        self.version += 1
+        if self._batch_level:
+            return
+        if not self.save_scheduler:
+            self._write(keys=set(self._dirty_keys))
+        elif not self._save_pending:
+            self._save_pending = True
+            self.save_scheduler(self.flush)
 
     def get(self, key, if_missing=None):
         """
@@ -206,11 +934,18 @@ class UserSettings(object):
         :param key:
         :return:
         """
-        gui_logger.debug('USER-get: {}; {}, {}, {}'.format(self.name, key, type(self.data.get(key, if_missing)), self.data.get(key, if_missing)))
+        if key not in self.data:
+            parent = self.parent
+            if parent is not None:
+                return _copy_inherited(parent.get(key, if_missing))
+        gui_logger.debug('USER-get: %s; %s, %s, %s', self.name, key, type(self.data.get(key, if_missing)), self.data.get(key, if_missing))
         return self.data.get(key, if_missing)
 
     def get_keys(self):
-        return self.data.keys()
+        parent = self.parent
+        if parent is None:
+            return self.data.keys()
+        return set(parent.get_keys()) | set(self.data)
 
     def setdefault(self, key, value, save=True):
         """
@@ -222,13 +957,14 @@ class UserSettings(object):
         """
         if self.user == 'default':
             raise GUIExceptionUserError('Cannot change default user')
-        gui_logger.debug('USER-setdefault: {}; {}, {}, {}'.format(self.name, key, type(value), value))
-        if self.data.get(key):
-            return self.data.get(key)
+        gui_logger.debug('USER-setdefault: %s; %s, %s, %s', self.name, key, type(value), value)
+        current_value = self.get(key)
+        if current_value:
+            return current_value
         else:
             value = self.data.setdefault(key, value)
             if save:
-                self.save()
+                self._request_save(key)
             return value
 
     def set(self, key, value, save=True):
@@ -243,6 +979,10 @@ class UserSettings(object):
         # print('set1', key, type(value), value)
         # print('set11', key, type(self.data.get(key)), self.data.get(key))
         #gui_logger.debug('USER-set1: {}; {}, {}, {}'.format(self.settings_type, key, type(value), value))
+        parent = self.parent
+        if key not in self.data and parent is not None and _is_same_value(parent.get(key), value):
+            # Same as in the parent, no own value needed
+            return
         if key not in self.data:
             self.data.setdefault(key, value)
         else:
@@ -253,27 +993,40 @@ class UserSettings(object):
         # print('???', self.settings_type, key, type(self.data[key]), self.data[key])
 
         if save:
-            self.save()
+            self._request_save(key)
 
 
     def get_settings(self):
         """
-        Returns the whole dictionary self.data
+        Returns the whole dictionary self.data. For a layered user a new dict is returned with the settings
+        merged with copies of the values inherited from the parent. Changes in that dict are not stored, use set.
         :return:
         """
-        return self.data
+        parent = self.parent
+        if parent is None:
+            return self.data
+        settings = {key: _copy_inherited(value) for key, value in parent.get_settings().items()
+                    if key not in self.data}
+        settings.update(self.data)
+        return settings
 
     def remove(self, key):
+        """
+        Removes key. For a layered user the value of the parent is used after this.
+        :param key:
+        :return:
+        """
         if self.user == 'default':
             return
         if key in self.data:
             self.data.pop(key)
-            self.save()
+            self._request_save(key)
 
     def reset(self):
         if self.user == 'default':
             return
         self.data = {}
+        self.version += 1
         self.save()
 
 
@@ -291,10 +1044,14 @@ class UserSettingsParameter(UserSettings):
         """
         if self.user == 'default':
             return
+        current_value = self.get(par, key)
+        if current_value is not None and key not in self.data.get(par, {}):
+            # Given by parent
+            return current_value
         self.data.setdefault(par, {})
         value = self.data[par].setdefault(key, value)
         if save:
-            self.save()
+            self._request_save(par)
         return value
 
     def set(self, par, key, value, save=True):
@@ -307,11 +1064,16 @@ class UserSettingsParameter(UserSettings):
         """
         if self.user == 'default':
             return
+        parent = self.parent
+        if key not in self.data.get(par, {}) and parent is not None \
+                and _is_same_value(parent.get(par, key), value):
+            # Same as in the parent, no own value needed
+            return
         self.data.setdefault(par, {})
         self.data[par].setdefault(key, value)
         self.data[par][key] = value
         if save:
-            self.save()
+            self._request_save(par)
 
     def get(self, par, key):
         """
@@ -320,18 +1082,41 @@ class UserSettingsParameter(UserSettings):
         :param key:
         :return:
         """
-        return self.data.get(par, {}).get(key, None)
+        par_data = self.data.get(par, {})
+        if key not in par_data:
+            parent = self.parent
+            if parent is not None:
+                return _copy_inherited(parent.get(par, key))
+        return par_data.get(key, None)
 
     def get_settings(self, par=None):
         """
-        Returns the whole dictionary self.data. If par is given self.data[par] is returned
+        Returns the whole dictionary self.data. If par is given self.data[par] is returned.
+        For a layered user new dicts are returned with the settings merged with copies of the values inherited
+        from the parent. Changes in those dicts are not stored, use set.
         :param par:
         :return:
         """
+        parent = self.parent
+        if parent is None:
+            if par:
+                return self.data.get(par, {})
+            else:
+                return self.data
         if par:
-            return self.data.get(par, {})
-        else:
-            return self.data
+            return self._merge_inherited(parent.get_settings(par), self.data.get(par, {}))
+        parent_settings = parent.get_settings()
+        settings = {}
+        for key in set(parent_settings) | set(self.data):
+            settings[key] = self._merge_inherited(parent_settings.get(key, {}), self.data.get(key, {}))
+        return settings
+
+    @staticmethod
+    def _merge_inherited(parent_par_settings, par_settings):
+        settings = {key: _copy_inherited(value) for key, value in parent_par_settings.items()
+                    if key not in par_settings}
+        settings.update(par_settings)
+        return settings
 
     def datestring_to_datetime(self):
         for par in self.data:
@@ -340,36 +1125,144 @@ class UserSettingsParameter(UserSettings):
                     if value:
                         self.data[par][key] = datetime.datetime.strptime(value, self.time_string_format)
 
-    def datetime_to_datestring(self):
+    def _get_save_data(self):
+        save_data = {}
         for par in self.data:
-            for key, value in self.data[par].items():
+            save_data[par] = dict(self.data[par])
+            for key, value in save_data[par].items():
                 if 'time' in key:
                     if value:
-                        self.data[par][key] = pd.to_datetime(value).strftime(self.time_string_format)
+                        save_data[par][key] = self._datetime_to_datestring(value)
+        return save_data
 
 
 class UserSettingsPriorityList(UserSettings):
-    def __init__(self, directory=None, name=None, user=None, **kwargs):
+    """
+    List of items (e.g. parameters) in priority order. get_priority returns the item with the highest priority
+    found in a given list. Lookups go through a core.ParameterCatalogue of the given list, so items are also
+    found if they differ in case or are aliases (e.g. CMEMS and SHARK names for the same parameter).
+    If no prioritised item is found the first item starting with one of default_prefixes is used.
+    A layered user uses the list of the parent until a priority is set.
+    """
+    def __init__(self, directory=None, name=None, user=None, default_prefixes=['chl'],
+                 aliases=DEFAULT_PARAMETER_ALIASES, **kwargs):
+        # Set in _set_priority_list, used when UserSettings.__init__ creates the file
+        self._own_priority_list = True
         UserSettings.__init__(self, directory=directory, name=name, user=user, **kwargs)
+        self.default_prefixes = default_prefixes
+        self.aliases = aliases
+        self._catalogue = None
+        self._catalogue_key = None
+        self._priority_cache = {}
+        self._set_priority_list()
 
-        self.data.setdefault('priority_list', [])
-        self.save()
+    def _set_priority_list(self):
+        """
+        Makes sure data["priority_list"] exists. For a user that is not layered the list is saved.
+        """
+        self._own_priority_list = 'priority_list' in self.data
+        if self._own_priority_list:
+            return
+        self.data['priority_list'] = []
+        if self.get_parent is None:
+            self._own_priority_list = True
+            self._request_save('priority_list')
+
+    def reload(self):
+        UserSettings.reload(self)
+        self._set_priority_list()
+
+    def _get_save_data(self):
+        save_data = UserSettings._get_save_data(self)
+        if not self._own_priority_list:
+            save_data.pop('priority_list', None)
+        return save_data
+
+    def _get_priority_list(self):
+        if not self._own_priority_list:
+            parent = self.parent
+            if parent is not None:
+                return parent._get_priority_list()
+        return self.data['priority_list']
+
+    def get(self, key, if_missing=None):
+        if key == 'priority_list' and not self._own_priority_list:
+            return _copy_inherited(self._get_priority_list())
+        return UserSettings.get(self, key, if_missing)
+
+    def get_settings(self):
+        settings = UserSettings.get_settings(self)
+        if not self._own_priority_list:
+            settings['priority_list'] = _copy_inherited(self._get_priority_list())
+        return settings
 
     def set_priority(self, item):
         if self.user == 'default':
             return
-        if item in self.data['priority_list']:
-            self.data['priority_list'].pop(self.data['priority_list'].index(item))
-        self.data['priority_list'].insert(0, item)
-        self.save()
+        if not self._own_priority_list:
+            self.data['priority_list'] = list(self._get_priority_list())
+            self._own_priority_list = True
+        priority_list = self.data['priority_list']
+        if priority_list and priority_list[0] == item:
+            return
+        if item in priority_list:
+            priority_list.remove(item)
+        priority_list.insert(0, item)
+        self._request_save('priority_list')
 
-    def get_priority(self, check_in_list):
-        for item in self.data['priority_list']:
-            if item in check_in_list:
-                return item
-        # Return parameter starting with Chlo
-        for item in check_in_list:
-            if item.lower().startswith('chl'):
+    def set_priorities(self, items):
+        """
+        Sets the priority of several items with one save. The first item gets the highest priority.
+        :param items:
+        :return:
+        """
+        with self.batch():
+            for item in reversed(items):
                 self.set_priority(item)
-                return item
-        return check_in_list[0]
\ No newline at end of file
+
+    def get_catalogue(self, check_in_list):
+        """
+        Returns a ParameterCatalogue for check_in_list. The latest catalogue is reused if check_in_list has the
+        same content, so building the catalogue (aliases, lower case and prefix index) is only done when the
+        list changes.
+        :param check_in_list:
+        :return:
+        """
+        key = tuple(check_in_list)
+        if self._catalogue is None or key != self._catalogue_key:
+            self._catalogue = ParameterCatalogue(key, aliases=self.aliases)
+            self._catalogue_key = key
+            self._priority_cache = {}
+        return self._catalogue
+
+    def _get_priority_key(self):
+        parent = self.parent
+        return self.version, parent.version if parent is not None else None
+
+    def get_priority(self, check_in_list):
+        """
+        Returns the item in check_in_list with the highest priority.
+        The result is cached until the content of the list or the priorities change.
+        :param check_in_list:
+        :return:
+        """
+        catalogue = self.get_catalogue(check_in_list)
+        key = self._get_priority_key()
+        if key in self._priority_cache:
+            return self._priority_cache[key]
+        item = self._find_priority(catalogue)
+        # set_priority in _find_priority changes the version
+        self._priority_cache = {self._get_priority_key(): item}
+        return item
+
+    def _find_priority(self, catalogue):
+        for item in self._get_priority_list():
+            match = catalogue.resolve(item)
+            if match is not None:
+                return match
+        # Return first parameter starting with one of the default prefixes (e.g. "chl")
+        item = catalogue.get_default(self.default_prefixes)
+        if item is not None:
+            self.set_priority(item)
+            return item
+        return catalogue.parameters[0]
@@ -0,0 +1,58 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+import os
+import json
+import tempfile
+
+
+def atomic_write_text(file_path, text, encoding='utf8'):
+    """
+    Writes text to file_path via a temporary file in the same directory that is then renamed.
+    A crash during the write leaves the old file untouched.
+    :param file_path:
+    :param text:
+    :param encoding:
+    :return:
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_file_path = tempfile.mkstemp(prefix='.{}.'.format(os.path.basename(file_path)),
+                                          suffix='.tmp',
+                                          dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding) as fid:
+            fid.write(text)
+            fid.flush()
+            os.fsync(fid.fileno())
+        os.replace(temp_file_path, file_path)
+    except:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+
+
+def atomic_write_json(file_path, data, **kwargs):
+    """
+    Dumps data as json to file_path using atomic_write_text.
+    :param file_path:
+    :param data:
+    :param kwargs: passed on to json.dumps
+    :return:
+    """
+    atomic_write_text(file_path, json.dumps(data, **kwargs))
+
+
+def get_sorted_list_changes(old_items, new_items):
+    """
+    Compares two sorted lists, e.g. the entries in a menu and the items they should show.
+    Returns the indexes in old_items to delete, highest first so that deleting one does not change the
+    indexes of the rest, and (index, item) for the items to insert after that, in order.
+    :param old_items: sorted list
+    :param new_items: sorted list
+    :return: (delete_indexes, insert_items)
+    """
+    new_items_set = set(new_items)
+    old_items_set = set(old_items)
+    delete_indexes = [i for i in reversed(range(len(old_items))) if old_items[i] not in new_items_set]
+    # Both lists are sorted so inserting in order puts the new items at the right place
+    insert_items = [(i, item) for i, item in enumerate(new_items) if item not in old_items_set]
+    return delete_indexes, insert_items
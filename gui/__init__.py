@@ -4,7 +4,14 @@
 from gui.page_start import PageStart
 from gui.page_about import PageAbout
 
+from gui.page_registry import PageRegistry
+from gui.page_registry import UPDATE_TOPICS
+from gui.redraw_scheduler import RedrawScheduler
+from gui.diagnostics import DiagnosticsPopup
+from gui.diagnostics import get_widget_counts
+
 from gui.widgets import InformationPopup
+from gui.widgets import LogViewerPopup
 from gui.widgets import SaveWidget
 from gui.widgets import SaveWidgetHTML
 from gui.widgets import show_information
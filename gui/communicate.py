@@ -9,6 +9,7 @@ def sync_user_and_time_widgets(user_sub_object=None,
                                time_widget_start=None,
                                time_widget_end=None,
                                source=None,
+                               time_index=None,
                                **kwargs):
     """
     Sync user and time widgets.
@@ -16,11 +17,17 @@ def sync_user_and_time_widgets(user_sub_object=None,
     :param time_widget_from:
     :param time_widget_to:
     :param source: Where to take information
+    :param time_index: core.TimeIndex for the loaded data. If given the range is limited to and snapped to
+                       the times in the data.
     :param kwargs:
     :return:
     """
-    min_range = time_widget_start.from_time
-    max_range = time_widget_start.to_time
+    if time_index is not None and len(time_index):
+        min_range = time_index.start
+        max_range = time_index.end
+    else:
+        min_range = time_widget_start.from_time
+        max_range = time_widget_start.to_time
 
     if source in ['full range', 'full_range']:
         min_value = min_range
@@ -41,12 +48,21 @@ def sync_user_and_time_widgets(user_sub_object=None,
     if not all([min_value, max_value]):
         return
 
-    min_value = max(min_value, min_range)
-    max_value = min(max_value, max_range)
+    if time_index is not None and len(time_index):
+        min_value, max_value = time_index.clamp(min_value, max_value)
+        snapped_min_value = time_index.snap(min_value, direction='after')
+        snapped_max_value = time_index.snap(max_value, direction='before')
+        # Only snap if there is data in the range
+        if snapped_min_value and snapped_max_value and snapped_min_value <= snapped_max_value:
+            min_value, max_value = snapped_min_value, snapped_max_value
+    else:
+        min_value = max(min_value, min_range)
+        max_value = min(max_value, max_range)
 
-    # Set limits in user
-    user_sub_object.set('time_start', min_value)
-    user_sub_object.set('time_end', max_value)
+    # Set limits in user. One save for both.
+    with user_sub_object.batch():
+        user_sub_object.set('time_start', min_value)
+        user_sub_object.set('time_end', max_value)
 
     # Set limits in time widgets
     time_widget_start.set_time(datetime_object=min_value)
@@ -0,0 +1,89 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Tk side of core.SessionDiagnostics: widget counting and a popup showing the records.
+"""
+import tkinter as tk
+
+
+def count_widgets(widget):
+    """
+    Returns the number of widgets in the subtree of widget (widget included).
+    :param widget:
+    :return:
+    """
+    count = 0
+    widgets = [widget]
+    while widgets:
+        widget = widgets.pop()
+        count += 1
+        widgets.extend(widget.winfo_children())
+    return count
+
+
+def get_widget_counts(controller):
+    """
+    Returns a dict with the number of widgets for each live page, for toplevel windows (popups) and in total.
+    :param controller: MainApp
+    :return:
+    """
+    counts = {}
+    for page_name, frame in controller.page_registry.frames.items():
+        counts['page: {}'.format(page_name)] = count_widgets(frame)
+    toplevels = [widget for widget in controller.winfo_children() if isinstance(widget, tk.Toplevel)]
+    counts['toplevels'] = len(toplevels)
+    counts['toplevel widgets'] = sum(count_widgets(widget) for widget in toplevels)
+    counts['total'] = count_widgets(controller)
+    return counts
+
+
+class DiagnosticsPopup(object):
+    """
+    Shows the records of a core.SessionDiagnostics, latest first.
+    """
+    def __init__(self, controller, diagnostics):
+        self.controller = controller
+        self.diagnostics = diagnostics
+        self.popup_frame = None
+
+    def display(self):
+        if self.popup_frame and self.popup_frame.winfo_exists():
+            self.popup_frame.lift()
+            self._reload()
+            return
+        padx = 5
+        pady = 5
+
+        self.popup_frame = tk.Toplevel(self.controller)
+        self.popup_frame.title('Diagnostics')
+
+        self.text = tk.Text(self.popup_frame, width=120, height=40, wrap='none')
+        self.text.grid(row=0, column=0, columnspan=4, padx=padx, pady=pady, sticky='nsew')
+        scrollbar = tk.Scrollbar(self.popup_frame, command=self.text.yview)
+        scrollbar.grid(row=0, column=4, sticky='ns')
+        self.text.configure(yscrollcommand=scrollbar.set)
+
+        button_record = tk.Button(self.popup_frame, text='Record now', command=self._record)
+        button_record.grid(row=1, column=0, padx=padx, pady=pady, sticky='w')
+        button_reload = tk.Button(self.popup_frame, text='Reload', command=self._reload)
+        button_reload.grid(row=1, column=1, padx=padx, pady=pady, sticky='w')
+        button_dump = tk.Button(self.popup_frame, text='Write to log', command=self.diagnostics.dump)
+        button_dump.grid(row=1, column=2, padx=padx, pady=pady, sticky='w')
+        button_close = tk.Button(self.popup_frame, text='Close', command=self.popup_frame.destroy)
+        button_close.grid(row=1, column=3, padx=padx, pady=pady, sticky='w')
+
+        self.popup_frame.grid_rowconfigure(0, weight=1)
+        self.popup_frame.grid_columnconfigure(3, weight=1)
+
+        self._reload()
+
+    def _record(self):
+        self.controller.record_diagnostics('manual')
+        self._reload()
+
+    def _reload(self):
+        self.text.configure(state='normal')
+        self.text.delete('1.0', 'end')
+        for record in reversed(self.diagnostics.get_records()):
+            self.text.insert('end', self.diagnostics.get_record_text(record) + '\n\n')
+        self.text.configure(state='disabled')
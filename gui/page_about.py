@@ -20,6 +20,9 @@ class PageAbout(tk.Frame):
     """
     Dummy page used as a base.
     """
+    # Static page, no updates needed (see gui.PageRegistry)
+    update_topics = []
+
     def __init__(self, parent, controller):
         tk.Frame.__init__(self, parent)
         # parent is the frame "container" in App. contoller is the App class
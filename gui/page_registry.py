@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+from collections import OrderedDict
+
+import logging
+
+gui_logger = logging.getLogger('gui_logger')
+
+# Topics that pages can depend on. A topic can be narrowed with "/", e.g. "settings/plot" for a settings group.
+UPDATE_TOPICS = ['user', 'settings', 'data']
+
+
+def _topics_match(topic, other_topic):
+    return topic == other_topic or topic.startswith(other_topic + '/') or other_topic.startswith(topic + '/')
+
+
+class PageRegistry(object):
+    """
+    Holds the pages (frames) shown in the container of the main app.
+    A page frame is created the first time it is requested with get(). If max_live_pages is set, the least
+    recently used pages (that are not pinned) are destroyed when more than max_live_pages are alive.
+    A destroyed page is created and started again the next time it is requested.
+
+    Pages list the topics (see UPDATE_TOPICS) they depend on in the class attribute "update_topics".
+    Pages without the attribute depend on all topics. invalidate() marks the started pages that depend on the
+    given topics as dirty and update() only calls update_page on dirty pages.
+    """
+    def __init__(self, container, controller, get_page_class=None, max_live_pages=0, pinned_pages=[]):
+        """
+        :param container: Parent frame of the pages
+        :param controller: Main app passed on to the pages
+        :param get_page_class: Function returning the page class for a page name
+        :param max_live_pages: Max number of unpinned pages kept alive. 0 means no limit.
+        :param pinned_pages: Pages that are never destroyed
+        """
+        self.container = container
+        self.controller = controller
+        self.get_page_class = get_page_class
+        self.max_live_pages = max_live_pages
+        self.pinned_pages = set(pinned_pages)
+
+        # Ordered from least to most recently used
+        self.frames = OrderedDict()
+        self.pages_started = {}
+        self.dirty_pages = set()
+
+    def __contains__(self, page_name):
+        return page_name in self.frames
+
+    def get(self, page_name):
+        """
+        Returns the frame for page_name. The frame is created if not alive.
+        :param page_name:
+        :return:
+        """
+        frame = self.frames.get(page_name)
+        if frame is None:
+            frame = self._create_frame(page_name)
+        self.frames.move_to_end(page_name)
+        self._destroy_least_recently_used(keep=page_name)
+        return frame
+
+    def _create_frame(self, page_name):
+        Page = self.get_page_class(page_name)  # Capital P to emphasize class
+        frame = Page(self.container, self.controller)
+        frame.grid(row=0, column=0, sticky="nsew")
+
+        self.container.rowconfigure(0, weight=1)
+        self.container.columnconfigure(0, weight=1)
+
+        self.frames[page_name] = frame
+        self.pages_started[page_name] = False
+        gui_logger.debug('Page created: %s', page_name)
+        return frame
+
+    def _destroy_least_recently_used(self, keep=None):
+        if not self.max_live_pages:
+            return
+        unpinned = [name for name in self.frames if name not in self.pinned_pages and name != keep]
+        nr_to_destroy = len(unpinned) + (keep not in self.pinned_pages) - self.max_live_pages
+        for page_name in unpinned[:max(nr_to_destroy, 0)]:
+            self.destroy(page_name)
+
+    def destroy(self, page_name):
+        """
+        Destroys the frame for page_name.
+        :param page_name:
+        :return:
+        """
+        frame = self.frames.pop(page_name, None)
+        self.pages_started.pop(page_name, None)
+        self.dirty_pages.discard(page_name)
+        if frame is not None:
+            frame.destroy()
+            gui_logger.debug('Page destroyed: %s', page_name)
+
+    def destroy_all(self):
+        for page_name in list(self.frames):
+            self.destroy(page_name)
+
+    def get_update_topics(self, page_name):
+        """
+        Returns the topics the page depends on.
+        :param page_name:
+        :return:
+        """
+        topics = getattr(self.frames.get(page_name), 'update_topics', None)
+        if topics is None:
+            return UPDATE_TOPICS
+        return topics
+
+    def invalidate(self, *topics):
+        """
+        Marks all started pages that depend on any of the given topics as dirty. All topics if none given.
+        Returns a list of the pages marked as dirty.
+        :param topics: e.g. "user", "data" or "settings/<group>"
+        :return:
+        """
+        topics = topics or UPDATE_TOPICS
+        dirty = []
+        for page_name in self.frames:
+            if not self.pages_started.get(page_name) or page_name in self.dirty_pages:
+                continue
+            page_topics = self.get_update_topics(page_name)
+            if any(_topics_match(topic, page_topic) for topic in topics for page_topic in page_topics):
+                self.dirty_pages.add(page_name)
+                dirty.append(page_name)
+        if dirty:
+            gui_logger.debug('Pages invalidated by %s: %s', topics, dirty)
+        return dirty
+
+    def is_dirty(self, page_name):
+        return page_name in self.dirty_pages
+
+    def update(self, page_name, force=False):
+        """
+        Calls update_page on the frame if the page is dirty (or if force is True). Returns True if updated.
+        :param page_name:
+        :param force:
+        :return:
+        """
+        if page_name not in self.frames or not (force or page_name in self.dirty_pages):
+            return False
+        self.dirty_pages.discard(page_name)
+        self.frames[page_name].update_page()
+        return True
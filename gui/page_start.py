@@ -15,6 +15,8 @@ import tkinter as tk
 ================================================================================
 """
 class PageStart(tk.Frame):
+    # Static page, no updates needed (see gui.PageRegistry)
+    update_topics = []
 
     def __init__(self, parent, main_app, **kwargs):
         tk.Frame.__init__(self, parent, **kwargs)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import time
+from collections import OrderedDict
+
+import logging
+
+gui_logger = logging.getLogger('gui_logger')
+
+
+class RedrawScheduler(object):
+    """
+    Collects redraw requests (page updates, menu updates, canvas draws etc.) and runs them when Tk is idle.
+    Requests with the same key are only run once per pass, so several events firing together
+    (e.g. a user change followed by showing a page) give one redraw.
+    Requests are run in the order they were first requested. When a pass has used frame_budget seconds the
+    remaining requests are run in the next pass, frame_interval milliseconds later.
+    """
+    def __init__(self, widget, frame_budget=0.03, frame_interval=15):
+        """
+        :param widget: Tk widget used for after and after_idle, normally the main app
+        :param frame_budget: Max time in seconds to spend in one pass. At least one request is always run.
+        :param frame_interval: Milliseconds between passes when requests are left after a pass
+        """
+        self.widget = widget
+        self.frame_budget = frame_budget
+        self.frame_interval = frame_interval
+        self.requests = OrderedDict()
+        self._scheduled_id = None
+
+    def request(self, function, key=None):
+        """
+        Requests that function is called at the next idle pass. If a request with the same key is pending
+        the function replaces the pending one but keeps its place in the queue.
+        :param function: Called without arguments
+        :param key: Defaults to the function
+        :return:
+        """
+        if key is None:
+            key = function
+        self.requests[key] = function
+        self._schedule()
+
+    def request_draw(self, canvas):
+        """
+        Requests a draw of a matplotlib canvas.
+        :param canvas:
+        :return:
+        """
+        self.request(canvas.draw_idle, key=('draw', id(canvas)))
+
+    def cancel(self, key):
+        self.requests.pop(key, None)
+
+    def is_pending(self, key):
+        return key in self.requests
+
+    def _schedule(self, delay=None):
+        if self._scheduled_id is not None or not self.requests:
+            return
+        if delay:
+            self._scheduled_id = self.widget.after(delay, self._run)
+        else:
+            self._scheduled_id = self.widget.after_idle(self._run)
+
+    def _run(self):
+        self._scheduled_id = None
+        t0 = time.perf_counter()
+        nr_run = 0
+        while self.requests:
+            if nr_run and time.perf_counter() - t0 > self.frame_budget:
+                gui_logger.debug('Redraw budget exceeded after %s requests, %s left for next pass',
+                                 nr_run, len(self.requests))
+                break
+            key, function = self.requests.popitem(last=False)
+            nr_run += 1
+            try:
+                function()
+            except Exception:
+                gui_logger.exception('Redraw request %s failed', key)
+        self._schedule(delay=self.frame_interval)
+
+    def flush(self):
+        """
+        Runs all pending requests now, without time budget.
+        :return:
+        """
+        if self._scheduled_id is not None:
+            self.widget.after_cancel(self._scheduled_id)
+            self._scheduled_id = None
+        while self.requests:
+            key, function = self.requests.popitem(last=False)
+            try:
+                function()
+            except Exception:
+                gui_logger.exception('Redraw request %s failed', key)
@@ -12,17 +12,17 @@ from tkinter import messagebox
 import datetime
 
 import os
+import logging
 import numpy as np
 import pandas as pd
 #import shutil
 
-from libs.sharkpylib import loglib
 from plugins.gismo_qc import gui
 
 import libs.sharkpylib.tklib.tkinter_widgets as tkw
 import libs.sharkpylib.tklib.tkmap as tkmap
 
-logger = loglib.get_logger(name='gismo_gui')
+logger = logging.getLogger('gismo_gui')
 
 
 class SaveWidget(ttk.LabelFrame):
@@ -193,13 +193,38 @@ class SaveWidgetHTML(ttk.LabelFrame):
                                                       row=0,
                                                       column=1)
 
-        ttk.Button(frame, text='Export', command=self._save_file).grid(row=1, column=0, columnspan=2, padx=padx,
+        self._set_frame_downsample(frame, row=0, column=2)
+
+        ttk.Button(frame, text='Export', command=self._save_file).grid(row=1, column=0, columnspan=3, padx=padx,
                                                                       pady=pady, sticky='sw')
 
-        tkw.grid_configure(frame, nr_rows=2, nr_columns=2)
+        tkw.grid_configure(frame, nr_rows=2, nr_columns=3)
 
         self._set_frame_listbox_parameters()
 
+    def _set_frame_downsample(self, parent, **kwargs):
+        padx = 5
+        pady = 5
+
+        frame = tk.Frame(parent)
+        frame.grid(padx=padx, pady=pady, sticky='nw', **kwargs)
+
+        self.intvar_downsample = tk.IntVar()
+        tk.Checkbutton(frame, text='Downsample plots', variable=self.intvar_downsample).grid(row=0, column=0,
+                                                                                           columnspan=2, sticky='w')
+        tk.Label(frame, text='Max points per parameter:').grid(row=1, column=0, padx=padx, sticky='w')
+        self.stringvar_max_points = tk.StringVar()
+        self.stringvar_max_points.set('5000')
+        tk.Entry(frame, textvariable=self.stringvar_max_points, width=8).grid(row=1, column=1, sticky='w')
+
+        tk.Label(frame, text='Method:').grid(row=2, column=0, padx=padx, sticky='w')
+        self.stringvar_downsample_method = tk.StringVar()
+        self.stringvar_downsample_method.set('lttb')
+        ttk.Combobox(frame, textvariable=self.stringvar_downsample_method, values=['lttb', 'minmax'],
+                     state='readonly', width=8).grid(row=2, column=1, sticky='w')
+
+        tkw.grid_configure(frame, nr_rows=3, nr_columns=2)
+
     def _set_frame_listbox_parameters(self):
 
         self.listbox_widget_parameters = tkw.ListboxSelectionWidget(self.frame_parameters,
@@ -242,9 +267,23 @@ class SaveWidgetHTML(ttk.LabelFrame):
         selection['combined_plot'] = 'Combined plot' in plot_types_selected
         selection['individual_plots'] = 'Individual plots' in plot_types_selected
         selection['individual_maps'] = 'Individual maps' in plot_types_selected
+        selection['max_points'] = self.get_max_points()
+        selection['downsample_method'] = self.stringvar_downsample_method.get()
 
         return selection
 
+    def get_max_points(self):
+        """
+        Returns the max number of points per parameter if downsampling is selected, else None.
+        :return:
+        """
+        if not self.intvar_downsample.get():
+            return None
+        try:
+            return max(int(self.stringvar_max_points.get().strip()), 3)
+        except ValueError:
+            return None
+
     def has_sufficient_selections(self):
         if self.checkbutton_widget.get_checked_item_list() and self.listbox_widget_parameters.get_selected():
             return True
@@ -264,9 +303,11 @@ class SaveWidgetHTML(ttk.LabelFrame):
 class MovableText(object):
     """ A simple class to handle Drag n Drop.
 
-    This is a simple example, which works for Text objects only
+    This is a simple example, which works for Text objects only.
+    If the canvas supports blitting the text follows the mouse while dragging. Only the dragged text is redrawn
+    on top of a cached background and the whole figure is drawn once when the text is released.
     """
-    def __init__(self, figure=None) :
+    def __init__(self, figure=None, use_blit=True) :
         """ Create a new drag handler and connect it to the figure's event system.
         If the figure handler is not given, the current figure is used instead
         """
@@ -274,14 +315,18 @@ class MovableText(object):
 #         if figure is None : figure = p.gcf()
         # simple attibute to store the dragged text object
         self.dragged = None
+        self.background = None
         self.events = {}
+        self.use_blit = use_blit and getattr(self.fig.canvas, 'supports_blit', False)
 
         # Connect events and callbacks
 #         figure.canvas.mpl_connect("pick_event", self.on_pick_event)
         self.events[u'pick_event'] = self.fig.canvas.mpl_connect('pick_event', lambda event: self.on_pick_event(event))
 #         self.events[u'button_press_event'] = self.fig.canvas.mpl_connect('button_pres_event', lambda event: self.on_press_event(event)) # Have to remove saved entris too.
         self.events[u'button_release_event'] = self.fig.canvas.mpl_connect('button_release_event', lambda event: self.on_release_event(event))
-#         self.events[u'motion_notify_event'] = self.fig.canvas.mpl_connect('motion_notify_event', lambda event: self.on_motion_notify_event(event))
+        if self.use_blit:
+            self.events[u'motion_notify_event'] = self.fig.canvas.mpl_connect('motion_notify_event', lambda event: self.on_motion_notify_event(event))
+            self.events[u'draw_event'] = self.fig.canvas.mpl_connect('draw_event', lambda event: self.on_draw_event(event))
 #         figure.canvas.mpl_connect("button_release_event", self.on_release_event)
         
     def on_pick_event(self, event):
@@ -291,10 +336,16 @@ class MovableText(object):
         if isinstance(event.artist, mpl.text.Text):
             if event.mouseevent.button == 3:
                 event.artist.remove()
-                self.fig.canvas.draw()
+                self.fig.canvas.draw_idle()
                 return
             self.dragged = event.artist
             self.pick_pos = (event.mouseevent.xdata, event.mouseevent.ydata)
+            self.start_pos = self.dragged.get_position()
+            if self.use_blit:
+                # Draw everything but the dragged text once. The background is saved in on_draw_event.
+                self.dragged.set_animated(True)
+                self.fig.canvas.draw()
+                self._blit_dragged()
         return True
     
     #==========================================================================
@@ -303,7 +354,7 @@ class MovableText(object):
         if event.button == 3 and self.dragged:
             self.dragged.remove()
             self.dragged = None
-            self.fig.canvas.draw()
+            self.fig.canvas.draw_idle()
             
     #==========================================================================
     def on_release_event(self, event):
@@ -311,31 +362,47 @@ class MovableText(object):
         
 #         print('on_release_event'
         if self.dragged is not None :
-            old_pos = self.dragged.get_position()
-            new_pos = (old_pos[0] + event.xdata - self.pick_pos[0],
-                       old_pos[1] + event.ydata - self.pick_pos[1])
-            self.dragged.set_position(new_pos)
+            if event.xdata is not None:
+                self.dragged.set_position(self._get_new_position(event))
+            self.dragged.set_animated(False)
             self.dragged = None
-            self.fig.canvas.draw()
+            self.background = None
+            self.fig.canvas.draw_idle()
         return True
     
     #==========================================================================
     def on_motion_notify_event(self, event):
-        " Update text position and redraw"
+        " Update text position and redraw only the text"
         
-        if self.dragged is not None :
-            print('on_motion_notify_event')
-            old_pos = self.dragged.get_position()
-            new_pos = (old_pos[0] + event.xdata - self.pick_pos[0],
-                       old_pos[1] + event.ydata - self.pick_pos[1])
-            self.dragged.set_position(new_pos)
-            self.fig.canvas.draw()
+        if self.dragged is not None and self.background is not None and event.xdata is not None:
+            self.dragged.set_position(self._get_new_position(event))
+            self._blit_dragged()
         return True
+
+    #==========================================================================
+    def on_draw_event(self, event):
+        " Save the background (everything but the animated text) after a full draw"
+        if self.dragged is not None:
+            self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+            self.fig.draw_artist(self.dragged)
+
+    #==========================================================================
+    def _blit_dragged(self):
+        if self.background is None:
+            return
+        self.fig.canvas.restore_region(self.background)
+        self.fig.draw_artist(self.dragged)
+        self.fig.canvas.blit(self.fig.bbox)
+
+    #==========================================================================
+    def _get_new_position(self, event):
+        return (self.start_pos[0] + event.xdata - self.pick_pos[0],
+                self.start_pos[1] + event.ydata - self.pick_pos[1])
     
     #==========================================================================
     def disconnect(self):
         for event in self.events:
-            self.fig.canvas.mpl_disconnect(event)
+            self.fig.canvas.mpl_disconnect(self.events[event])
         self.events = {}
 
 
@@ -386,15 +453,15 @@ class InformationPopup(object):
         # self.controller.withdraw()
 
     def _ok(self):
+        # Nothing has changed so no pages need to be updated
         self.popup_frame.destroy()
         # self.controller.deiconify()
-        self.controller.update_all()
 
     def _ok_and_forget(self):
         self.user_manager.user.options.set('show_info_popups', False)
         self.popup_frame.destroy()
         # self.controller.deiconify()
-        self.controller.update_all()
+        self.controller.invalidate('user/options')
 
     def _update_wrap(self, event):
         self.label.config(wraplength=self.popup_frame.winfo_width())
@@ -460,6 +527,86 @@ class EntryPopup(object):
         # self.controller.deiconify()
 
 
+class LogViewerPopup(object):
+    """
+    Shows the latest log records (kept in memory by core.LogManager) in a popup.
+    New records are added while the popup is open.
+    """
+    levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+
+    def __init__(self, controller, log_manager, update_interval=500):
+        self.controller = controller
+        self.log_manager = log_manager
+        self.update_interval = update_interval
+        self.popup_frame = None
+        self.last_sequence_number = 0
+        self._after_id = None
+
+    def display(self):
+        if self.popup_frame and self.popup_frame.winfo_exists():
+            self.popup_frame.lift()
+            return
+        padx = 5
+        pady = 5
+
+        self.popup_frame = tk.Toplevel(self.controller)
+        self.popup_frame.title('Log')
+
+        self.stringvar_level = tk.StringVar()
+        self.stringvar_level.set('INFO')
+        label = tk.Label(self.popup_frame, text='Show level')
+        label.grid(row=0, column=0, padx=padx, pady=pady, sticky='w')
+        combobox = ttk.Combobox(self.popup_frame, textvariable=self.stringvar_level, values=self.levels,
+                                state='readonly', width=10)
+        combobox.grid(row=0, column=1, padx=padx, pady=pady, sticky='w')
+        combobox.bind('<<ComboboxSelected>>', lambda event: self._reload())
+
+        self.text = tk.Text(self.popup_frame, width=140, height=40, wrap='none')
+        self.text.grid(row=1, column=0, columnspan=2, padx=padx, pady=pady, sticky='nsew')
+        scrollbar = tk.Scrollbar(self.popup_frame, command=self.text.yview)
+        scrollbar.grid(row=1, column=2, sticky='ns')
+        self.text.configure(yscrollcommand=scrollbar.set)
+        self.text.tag_configure('WARNING', foreground='darkorange')
+        self.text.tag_configure('ERROR', foreground='red')
+
+        button_close = tk.Button(self.popup_frame, text='Close', command=self.popup_frame.destroy)
+        button_close.grid(row=2, column=0, padx=padx, pady=pady, sticky='w')
+
+        self.popup_frame.grid_rowconfigure(1, weight=1)
+        self.popup_frame.grid_columnconfigure(1, weight=1)
+
+        self._reload()
+
+    def _reload(self):
+        if self._after_id:
+            self.popup_frame.after_cancel(self._after_id)
+            self._after_id = None
+        self.text.configure(state='normal')
+        self.text.delete('1.0', 'end')
+        self.last_sequence_number = 0
+        self._add_new_records()
+
+    def _add_new_records(self):
+        self._after_id = None
+        if not self.popup_frame or not self.popup_frame.winfo_exists():
+            return
+        level = logging.getLevelName(self.stringvar_level.get())
+        records = self.log_manager.get_records(after=self.last_sequence_number, level=level)
+        if records:
+            at_end = self.text.yview()[1] >= 1.
+            self.text.configure(state='normal')
+            for sequence_number, record_level, text in records:
+                tag = 'ERROR' if record_level >= logging.ERROR else 'WARNING' if record_level >= logging.WARNING else ''
+                self.text.insert('end', text + '\n', tag)
+            self.text.configure(state='disabled')
+            if at_end:
+                self.text.see('end')
+            self.last_sequence_number = records[-1][0]
+        else:
+            self.text.configure(state='disabled')
+        self._after_id = self.popup_frame.after(self.update_interval, self._add_new_records)
+
+
 def show_information(title, message):
     messagebox.showinfo(title, message)
 
@@ -2,7 +2,7 @@
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 
 # To use basemap you might need to install Microsoft Visual C++: https://visualstudio.microsoft.com/visual-cpp-build-tools/
-import plugins
+# plugins is imported in load_plugins, so that the import is included in the startup profile
 # print(plugins.MODULE_LIST)
 import tkinter as tk
 # print(MODULE_LIST)
@@ -12,7 +12,7 @@ import tkinter as tk
 import os
 import sys
 import socket
-import importlib
+import hashlib
 #
 # import matplotlib.pyplot as plt
 #
@@ -22,7 +22,7 @@ import core
 # from libs.sharkpylib.gismo import GISMOsession
 #
 # from libs.sharkpylib import gismo
-from libs.sharkpylib import loglib
+import logging
 import libs.sharkpylib.tklib.tkinter_widgets as tkw
 #
 # from libs.sharkpylib.gismo.exceptions import *
@@ -30,24 +30,35 @@ from core.exceptions import *
 #
 # import threading
 #
+# Start profiler before plugins are imported
+if '--profile-startup' in sys.argv:
+    core.start_startup_profiler()
+
 ALL_PAGES = dict()
 ALL_PAGES['PageStart'] = gui.PageStart
 ALL_PAGES['PageAbout'] = gui.PageAbout
 
-# Initiate plugins
-PLUGINS = {}
-for plugin in plugins.PLUGIN_LIST:
-    PLUGINS[plugin] = importlib.import_module('plugins.{}'.format(plugin), '.')
-    plugin_app = PLUGINS[plugin].App
-    ALL_PAGES[plugin] = plugin_app
+# Set by load_plugins
+PLUGINS = None
 
-APP_TO_PAGE = dict()
-for plugin_name, plugin_app in ALL_PAGES.items():
-    APP_TO_PAGE[plugin_app] = plugin_name
 
+def load_plugins():
+    """
+    Initiates the plugins. Plugins with a manifest are imported the first time their page is shown.
+    Called by main after the startup profiler is started (and by MainApp if not already done), so that the
+    plugin imports are included in the profile also when main is called from code.
+    :return:
+    """
+    global PLUGINS
+    if PLUGINS is not None:
+        return PLUGINS
+    with core.profile_phase('plugin discovery'):
+        import plugins
+        PLUGINS = core.get_plugins(os.path.dirname(os.path.abspath(plugins.__file__)), plugins.PLUGIN_LIST)
 
-    # PLUGINS[plugin] = eval('plugins.{}'.format(plugin))
-    # eval('ALL_PAGES.add(plugins.{}.App)'.format(plugin))
+        # PLUGINS[plugin] = eval('plugins.{}'.format(plugin))
+        # eval('ALL_PAGES.add(plugins.{}.App)'.format(plugin))
+    return PLUGINS
 
 # TODO: Check required constants in plugins
 
@@ -83,6 +94,7 @@ class MainApp(tk.Tk):
         if not all([users_directory, root_directory, log_directory]):
             raise AttributeError
 
+        load_plugins()
         self._set_user_settings()
 
         # Load settings and constants (singletons)
@@ -92,33 +104,21 @@ class MainApp(tk.Tk):
         self.log_directory = log_directory
         self.mapping_files_directory = mapping_files_directory
 
-        # Setting upp GUI logger
-        if not os.path.exists(self.log_directory):
-            os.makedirs(self.log_directory)
-
-        # TODO: When to clear log files?
-        self.logger = loglib.get_logger(name='gismo_main',
-                                        logfiles=[dict(level='DEBUG',
-                                                       file_path=os.path.join(self.log_directory,
-                                                                              'main_debug.log')),
-                                                  dict(level='WARNING',
-                                                       file_path=os.path.join(self.log_directory,
-                                                                              'main_warning.log')),
-                                                  dict(level='ERROR',
-                                                       file_path=os.path.join(self.log_directory,
-                                                                              'main_error.log'))
-                                                  ])
-
-        self.logger.debug('===== START ======')
-
         # Load paths
         self.paths = core.Paths(self.app_directory)
 
         # TODO: See if root directory and Settings are necessary
-        self.settings = core.Settings(default_settings_file_path=default_settings_file_path,
-                                      root_directory=self.root_directory)
+        with core.profile_phase('settings'):
+            self.settings = core.Settings(default_settings_file_path=default_settings_file_path,
+                                          root_directory=self.root_directory)
 
-        self._load_user()
+        # Setting upp logging. Log files are written in a separate thread.
+        self._set_logging()
+        self.logger = logging.getLogger('gismo_main')
+        self.logger.debug('===== START ======')
+
+        with core.profile_phase('_load_user'):
+            self._load_user()
 
         screen_padx = self.settings['general']['Main window indent x']
         screen_pady = self.settings['general']['Main window indent y']
@@ -149,25 +149,93 @@ class MainApp(tk.Tk):
 
         self.latest_loaded_sampling_type = ''
 
+        # Background tasks. Results are passed back to the tk thread via after()
+        self.task_executor = core.TaskExecutor(after=self.after)
+
+        # Used by plugins to export interactive plots (see export_html and SaveWidgetHTML)
+        self.html_exporter = core.HTMLExporter(cache_directory=os.path.join(self.settings['directory']['Cache directory'],
+                                                                            'html_export'),
+                                               max_cache_size_mb=self.settings['general'].get('HTML export cache size (MB)', 200))
+
+        # Parsed data files are cached as memory-mapped columns, keyed on file content and settings file
+        self.data_cache = None
+        if self.settings['general'].get('Use parsed data cache', 1):
+            self.data_cache = core.ParsedDataCache(os.path.join(self.settings['directory']['Cache directory'],
+                                                                'parsed_data'),
+                                                   max_size_mb=self.settings['general'].get('Parsed data cache size (MB)', 0))
+
+        # Page updates, menu updates and canvas draws are coalesced and run when idle
+        self.redraw_scheduler = gui.RedrawScheduler(self)
+
+        # Memory and widget accounting per page (off by default, tracemalloc slows down the app)
+        self._set_diagnostics()
+
         #        self.sv = tk.StringVar()
         self._set_frame()
 
         # Make menu at the top
-        self._set_menubar()
+        with core.profile_phase('_set_menubar'):
+            self._set_menubar()
 
-        self.startup_pages()
+        with core.profile_phase('startup_pages'):
+            self.startup_pages()
         self.user_manager.set_users_directory(self.users_directory)
 
         # Show start page given in settings.ini
         self.page_history = ['PageAbout']
-        self.show_frame('PageStart')
+        with core.profile_phase("show_frame('PageStart')"):
+            self.show_frame('PageStart')
+
+        # Mirrored users directories are updated from the share in a background thread
+        if self.user_manager.mirrors:
+            self._poll_mirror_changes()
 
-        self.update_all()
         self.deiconify()
 
     def _set_user_settings(self):
         self.USER_SETTINGS = []
 
+    def _set_logging(self):
+        """
+        Starts the log manager handling gismo_main, gismo_gui and gui_logger.
+        Log files are rotated on size and rotated files older than the retention time are removed.
+        """
+        general = self.settings['general']
+        self.log_manager = core.LogManager(self.log_directory,
+                                           name='main',
+                                           logger_names=['gismo_main', 'gismo_gui', 'gui_logger'],
+                                           level=general.get('Log level', 'DEBUG'),
+                                           max_bytes=int(float(general.get('Log file max size (MB)', 5)) * 1024 * 1024),
+                                           backup_count=int(general.get('Log file backup count', 5)),
+                                           retention_days=float(general.get('Log retention days', 30)))
+        self.log_manager.start()
+        self.log_viewer = gui.LogViewerPopup(self, self.log_manager)
+
+    def _set_diagnostics(self):
+        """
+        Starts diagnostics if "Diagnostics" is set in settings.ini or the app is started with --diagnostics.
+        A record is made on page changes, user changes and when the pages are recreated (see Info -> Diagnostics).
+        """
+        self.diagnostics = None
+        self.diagnostics_popup = None
+        if not (self.settings['general'].get('Diagnostics', 0) or '--diagnostics' in sys.argv):
+            return
+        self.diagnostics = core.SessionDiagnostics(nr_top_stats=self.settings['general'].get('Diagnostics top stats', 10))
+        self.diagnostics.start()
+        self.diagnostics_popup = gui.DiagnosticsPopup(self, self.diagnostics)
+
+    def record_diagnostics(self, event):
+        """
+        Records memory, widget and figure counts if diagnostics is active.
+        :param event:
+        :return:
+        """
+        if not self.diagnostics:
+            return
+        self.diagnostics.record(event,
+                                page_name=self.active_page,
+                                widget_counts=gui.get_widget_counts(self))
+
     def get_root_window_position(self):
         return dict(x=self.winfo_x(),
                     y=self.winfo_y(),
@@ -183,31 +251,66 @@ class MainApp(tk.Tk):
             if users_dir:
                 user_directories[plugin_module] = os.path.join(self.app_directory, 'plugins', name, users_dir)
         self.user_manager = core.UserManager(self.users_directory)
+        # Coalesce user settings changes into one write per delay
+        save_delay = self.settings['general'].get('User settings save delay', 1000)
+        self.user_manager.set_save_scheduler(lambda func: self.after(save_delay, func))
         for plugin_module, directory in user_directories.items():
-            # Load user managers. One for each plugin. We only use one at the end.
-            self.user_manager.set_users_directory(directory)
-            self.computer_name = 'my_computer'
-            try:
-                self.computer_name = socket.gethostname()
-                # os.path.expanduser('~').split('\\')[-1]
-            except:
-                pass
-            default_user = self.settings.get('user', {}).get('Startup user', 'default')
-            startup_user = self.computer_name
-            self.user_manager.set_user('default', create_if_missing=True)
-            # self.user = self.user_manager.user
-            if default_user == 'default':
-                if startup_user not in self.user_manager.get_user_list():
-                    self.user_manager.add_user(startup_user, default_user)
-            else:
-                startup_user = default_user
-            # print('startup_user', startup_user)
-            self.settings.change_setting('user', 'Startup user', startup_user)
-            self.settings.save_settings()
-            self.user_manager.set_user(startup_user, create_if_missing=True)
-            self.user = self.user_manager.user
+            with core.profile_phase('_load_user {}'.format(getattr(plugin_module, 'name', 'main'))):
+                if self.settings['general'].get('Mirror users directories', 0):
+                    self.user_manager.add_mirror(directory, self._get_users_mirror_directory(directory))
+                self._load_user_directory(plugin_module, directory)
 
-            self._add_user_settings(plugin_module, user_directory=directory)
+    def _poll_mirror_changes(self):
+        """
+        Reloads user settings changed by the users directory mirrors (see core.UserManager.process_mirror_changes).
+        """
+        if self.user_manager.process_mirror_changes():
+            if self.user_manager.user is not self.user:
+                # The active user has been removed on the share
+                self.user = self.user_manager.user
+                self._update_program_title()
+            self.invalidate('user')
+            self.redraw_scheduler.request(self._update_menubar_users)
+        self.after(1000, self._poll_mirror_changes)
+
+    def _get_users_mirror_directory(self, users_directory):
+        """
+        Returns the local directory used as mirror for the given users directory (see core.UserManager.add_mirror).
+        The mirrors are in "Users mirror directory" in settings, default is .gismo_toolbox/users_mirror in the
+        home directory.
+        """
+        mirror_root = self.settings['directory'].get('Users mirror directory') or \
+                      os.path.join(os.path.expanduser('~'), '.gismo_toolbox', 'users_mirror')
+        # Unique name per users directory
+        key = hashlib.sha1(os.path.abspath(users_directory).encode('utf8')).hexdigest()[:10]
+        name = os.path.basename(os.path.dirname(os.path.abspath(users_directory)))
+        return os.path.join(mirror_root, '{}_{}'.format(name, key))
+
+    def _load_user_directory(self, plugin_module, directory):
+        # Load user managers. One for each plugin. We only use one at the end.
+        self.user_manager.set_users_directory(directory)
+        self.computer_name = 'my_computer'
+        try:
+            self.computer_name = socket.gethostname()
+            # os.path.expanduser('~').split('\\')[-1]
+        except:
+            pass
+        default_user = self.settings.get('user', {}).get('Startup user', 'default')
+        startup_user = self.computer_name
+        self.user_manager.set_user('default', create_if_missing=True)
+        # self.user = self.user_manager.user
+        if default_user == 'default':
+            if startup_user not in self.user_manager.get_user_list():
+                self.user_manager.add_user(startup_user, default_user)
+        else:
+            startup_user = default_user
+        # print('startup_user', startup_user)
+        self.settings.change_setting('user', 'Startup user', startup_user)
+        self.settings.save_settings()
+        self.user_manager.set_user(startup_user, create_if_missing=True)
+        self.user = self.user_manager.user
+
+        self._add_user_settings(plugin_module, user_directory=directory)
 
     def _add_user_settings(self, plugin_module, user_directory=None):
         user_settings_list = plugin_module.USER_SETTINGS
@@ -217,10 +320,13 @@ class MainApp(tk.Tk):
             directory = user_directory
         else:
             directory = os.path.join(self.app_directory, 'plugins', plugin_module.INFO.get('users_directory', 'users'))
-        for settings_type, settings_name in user_settings_list:
+        # Items are (settings_type, settings_name) with an optional dict of options as third item,
+        # e.g. ('prioritylist', 'parameter_priority', {'default_prefixes': ['chl', 'temp']})
+        for settings_type, settings_name, *options in user_settings_list:
             self.user_manager.add_user_settings(users_directory=directory,
                                                 settings_type=settings_type,
-                                                settings_name=settings_name)
+                                                settings_name=settings_name,
+                                                **(options[0] if options else {}))
 
 
     # ==========================================================================
@@ -265,9 +371,8 @@ class MainApp(tk.Tk):
         self.frame_info.grid(row=0, column=0, sticky="nsew")
 
         # ttk.Separator(self.frame_bot, orient=tk.VERTICAL).grid(row=0, column=1, sticky='ns')
-        # TODO: Progressbar deactivated. Threading not working as expected.
+        # Progressbar is shown (gridded) while tasks started with run_progress are running
         self.frame_progress = tk.Frame(self.frame_bot)
-        # self.frame_progress.grid(row=0, column=2, sticky="nsew")
         self.progress_widget = tkw.ProgressbarWidget(self.frame_progress, sticky='nsew')
 
         self.info_widget = tkw.LabelFrameLabel(self.frame_info, pack=False)
@@ -278,76 +383,190 @@ class MainApp(tk.Tk):
         tkw.grid_configure(self.frame_bot)
         # tkw.grid_configure(self.frame_bot, nr_columns=3, c0=20, c2=4)
 
-    def run_progress(self, run_function, message=''):
+    def run_progress(self, run_function, message='', key=None, callback=None, pass_task=False):
+        """
+        Runs run_function in the background (see core.TaskExecutor) while the progressbar is shown.
+        run_function must not touch tk widgets, use callback (called in the tk thread with the result) for that.
+        Only one task per key can run at the same time.
+        :param run_function:
+        :param message:
+        :param key: Defaults to run_function
+        :param callback:
+        :param pass_task: If True run_function gets the task as keyword argument "task" and can report
+                          progress with task.set_progress(fraction, message).
+        :return: The task
+        """
+        if key is None:
+            key = run_function
+        if self.task_executor.is_running(key):
+            gui.show_information('Progress is running', 'A progress is running, please wait until it is finished!')
+            return self.task_executor.get_task(key)
+
+        def on_done(result):
+            self._stop_progress(self.progress_widget)
+            self.progress_running = self.task_executor.is_running_any()
+            if callback:
+                callback(result)
 
-        def run_thread():
-            self.progress_widget.run_progress(run_function, message=message)
-            # try:
-            #     self.progress_widget.run_progress(run_function, message=message)
-            # except Exception as e:
-            #     print(e)
-            #     raise
+        def on_error(e):
+            self._stop_progress(self.progress_widget)
+            self.progress_running = self.task_executor.is_running_any()
+            gui.show_error('Progress', '{}\n{}'.format(message, e))
 
-        if self.progress_running:
-            gui.show_information('Progress is running', 'A progress is running, please wait until it is finished!')
-            return
-        self.progress_running = True
-        # run_thread = lambda: self.progress_widget.run_progress(run_function, message=message)
-        threading.Thread(target=run_thread).start()
-        self.progress_running = False
+        def on_cancel():
+            self._stop_progress(self.progress_widget)
+            self.progress_running = self.task_executor.is_running_any()
 
-    def run_progress_in_toplevel(self, run_function, message=''):
+        self.progress_running = True
+        self.frame_progress.grid(row=0, column=2, sticky="nsew")
+        self._start_progress(self.progress_widget, message)
+        return self.task_executor.submit(run_function,
+                                         key=key,
+                                         callback=on_done,
+                                         error_callback=on_error,
+                                         cancel_callback=on_cancel,
+                                         progress_callback=lambda fraction, msg: self._set_progress(
+                                             self.progress_widget, fraction, msg),
+                                         pass_task=pass_task)
+
+    def run_progress_in_toplevel(self, run_function, message='', key=None, callback=None, pass_task=False):
         """
-        Rins progress in a toplevel window.
+        Runs progress in a toplevel window. See run_progress.
         :param run_function:
         :param message:
-        :return:
+        :return: The task
         """
-
-        def run_thread():
-            self.frame_toplevel_progress = tk.Toplevel(self)
-            self.progress_widget_toplevel = tkw.ProgressbarWidget(self.frame_toplevel_progress, sticky='nsew',
-                                                                  in_rows=True)
-            self.frame_toplevel_progress.update_idletasks()
-            self.progress_widget_toplevel.update_idletasks()
-            print('running')
-            self.progress_widget.run_progress(run_function, message=message)
-            self.frame_toplevel_progress.destroy()
-
-        if self.progress_running_toplevel:
+        if key is None:
+            key = run_function
+        if self.task_executor.is_running(key):
             gui.show_information('Progress is running', 'A progress is running, please wait until it is finished!')
+            return self.task_executor.get_task(key)
+
+        frame_toplevel_progress = tk.Toplevel(self)
+        progress_widget_toplevel = tkw.ProgressbarWidget(frame_toplevel_progress, sticky='nsew', in_rows=True)
+        frame_toplevel_progress.update_idletasks()
+
+        def close():
+            self.progress_running_toplevel = False
+            if frame_toplevel_progress.winfo_exists():
+                frame_toplevel_progress.destroy()
+
+        def on_done(result):
+            close()
+            if callback:
+                callback(result)
+
+        def on_error(e):
+            close()
+            gui.show_error('Progress', '{}\n{}'.format(message, e))
+
+        self.progress_running_toplevel = True
+        self._start_progress(progress_widget_toplevel, message)
+        task = self.task_executor.submit(run_function,
+                                         key=key,
+                                         callback=on_done,
+                                         error_callback=on_error,
+                                         cancel_callback=close,
+                                         progress_callback=lambda fraction, msg: self._set_progress(
+                                             progress_widget_toplevel, fraction, msg),
+                                         pass_task=pass_task)
+        # Closing the window cancels the task
+        frame_toplevel_progress.protocol('WM_DELETE_WINDOW', lambda: (task.cancel(), close()))
+        return task
+
+    def export_html(self, jobs, max_points=None, method='lttb', callback=None):
+        """
+        Exports interactive plots with self.html_exporter in the background while the progressbar is shown.
+        Typically called from the callback of a SaveWidgetHTML with max_points and method from its
+        get_selection().
+        :param jobs: list of core.HTMLExportJob
+        :param max_points: If given, traces with more points are downsampled
+        :param method: Downsampling method, "lttb" or "minmax"
+        :param callback: Called in the tk thread with the list of created files
+        :return: The task
+        """
+        def run(task=None):
+            return self.html_exporter.export(jobs, progress_callback=task.set_progress, max_points=max_points,
+                                             method=method)
+        return self.run_progress(run, message='Exporting html...', key='html_export', callback=callback,
+                                 pass_task=True)
+
+    def _start_progress(self, progress_widget, message=''):
+        self.update_help_information(message)
+        progressbar = getattr(progress_widget, 'progressbar', None)
+        if progressbar:
+            progressbar.configure(mode='indeterminate')
+            progressbar.start()
+
+    def _set_progress(self, progress_widget, fraction=None, message=''):
+        """
+        Progress reported from a running task. Called in the tk thread.
+        :param progress_widget:
+        :param fraction: Value between 0 and 1. None gives an indeterminate progressbar.
+        :param message:
+        :return:
+        """
+        if message:
+            self.update_help_information(message)
+        progressbar = getattr(progress_widget, 'progressbar', None)
+        if not progressbar or fraction is None:
             return
-        self.progress_running = True
-        # run_thread = lambda: self.progress_widget.run_progress(run_function, message=message)
-        threading.Thread(target=run_thread).start()
-        self.progress_running = False
+        progressbar.stop()
+        progressbar.configure(mode='determinate', maximum=100, value=int(fraction * 100))
+
+    def _stop_progress(self, progress_widget):
+        progressbar = getattr(progress_widget, 'progressbar', None)
+        if progressbar:
+            progressbar.stop()
+            progressbar.configure(value=0)
+        if not self.task_executor.is_running_any():
+            self.frame_progress.grid_forget()
+            self.reset_help_information()
 
     # ===========================================================================
     def startup_pages(self):
-        # Tuple that store all pages
+        """
+        Sets up the page registry. Pages are created the first time they are shown (see _get_frame).
+        """
+        # Destroy old pages if called as an update
+        if getattr(self, 'page_registry', None):
+            self.page_registry.destroy_all()
 
-        self.pages_started = {}
+        self.page_registry = gui.PageRegistry(self.container,
+                                              self,
+                                              get_page_class=self.get_app_class,
+                                              max_live_pages=self.settings['general'].get('Max live plugin pages', 0),
+                                              pinned_pages=list(ALL_PAGES))
 
-        # Dictionary to store all frame classes
-        self.frames = {}
+        # Dictionary to store all frames and if they are started. Only holds pages that are alive.
+        self.frames = self.page_registry.frames
+        self.pages_started = self.page_registry.pages_started
 
-        # Looping all pages to make them active.
-        for page_name, Page in ALL_PAGES.items():  # Capital P to emphasize class
-            # Destroy old page if called as an update
-            try:
-                self.frames[page_name].destroy()
-                print(page_name, u'Destroyed')
-            except:
-                pass
-            frame = Page(self.container, self)
-            frame.grid(row=0, column=0, sticky="nsew")
+        self.activate_binding_keys()
 
-            self.container.rowconfigure(0, weight=1)
-            self.container.columnconfigure(0, weight=1)
+        self.record_diagnostics('startup_pages')
 
-            self.frames[page_name] = frame
+    def _get_frame(self, page_name):
+        """
+        Returns the frame for the given page. The frame (and the plugin module) is created if not alive.
+        :param page_name:
+        :return:
+        """
+        return self.page_registry.get(page_name)
 
-        self.activate_binding_keys()
+    def _get_page_name(self, page):
+        """
+        Returns the page name for the given page class.
+        :param page:
+        :return:
+        """
+        for page_name, Page in ALL_PAGES.items():
+            if Page == page:
+                return page_name
+        for page_name, plugin in PLUGINS.items():
+            if plugin.is_loaded and plugin.App == page:
+                return page_name
+        return None
 
 
 
@@ -370,8 +589,8 @@ class MainApp(tk.Tk):
         """
         Load binding keys
         """
-        self.bind("<Home>", lambda event: self.show_frame(gui.PageStart))
-        self.bind("<Escape>", lambda event: self.show_frame(gui.PageStart))
+        self.bind("<Home>", lambda event: self.show_frame('PageStart'))
+        self.bind("<Escape>", lambda event: self.show_frame('PageStart'))
 
         self.bind("<F1>", self._quick_run_F1)
         self.bind("<F2>", self._quick_run_F2)
@@ -397,10 +616,24 @@ class MainApp(tk.Tk):
         self.info_widget.reset()
 
     def update_all(self):
+        """
+        Marks all started pages as dirty. Only the active page is updated now, the others when shown.
+        """
+        self.invalidate()
 
-        for page_name, frame in self.frames.items():
-            if self.pages_started.get(page_name):
-                frame.update_page()
+    def invalidate(self, *topics):
+        """
+        Marks the started pages that depend on the given topics as dirty (see gui.PageRegistry).
+        The active page is updated directly if dirty, hidden pages are updated when shown with show_frame.
+        :param topics: e.g. "user", "data" or "settings/<group>". All topics if none given.
+        :return:
+        """
+        self.page_registry.invalidate(*topics)
+        self.redraw_scheduler.request(self._update_active_page)
+
+    def _update_active_page(self):
+        if self.active_page:
+            self.page_registry.update(self.active_page)
 
     def _set_menubar(self):
         """
@@ -460,6 +693,7 @@ class MainApp(tk.Tk):
         # Users menu
         self.user_menu = tk.Menu(self.menubar, tearoff=0)
 
+        self._set_menubar_users()
         self._update_menubar_users()
 
         self.menubar.add_cascade(label='Users', menu=self.user_menu)
@@ -469,6 +703,11 @@ class MainApp(tk.Tk):
         self.info_menu = tk.Menu(self.menubar, tearoff=0)
         self.info_menu.add_command(label='About',
                                    command=lambda: self.show_frame('PageAbout'))
+        self.info_menu.add_command(label='Log',
+                                   command=self.log_viewer.display)
+        if self.diagnostics_popup:
+            self.info_menu.add_command(label='Diagnostics',
+                                       command=self.diagnostics_popup.display)
         self.menubar.add_cascade(label='Info', menu=self.info_menu)
 
         # -----------------------------------------------------------------------
@@ -499,6 +738,8 @@ class MainApp(tk.Tk):
         """
         if not plugin:
             return None
+        if plugin in PLUGINS:
+            return PLUGINS[plugin].App
         return ALL_PAGES.get(plugin)
         # if plugin and 'plugins' in plugin.__name__:
         #     app_class = plugin.
@@ -508,33 +749,17 @@ class MainApp(tk.Tk):
         #     return None
 
 
-    def _update_menubar_users(self):
-        # delete old entries
-        for k in range(100):
-            try:
-                self.user_menu.delete(0)
-            except:
-                break
-        # Add items
-        # print('self.active_page', self.active_page)
-        # User settings
-        user_page = self._get_user_page_class(self.active_page)
-        if user_page:
-            self.user_menu.add_command(label='User settings',
-                                       command=lambda: self.show_plugin_user_page(self.active_page))
-            # self.user_menu.entryconfig('User settings', state='normal')
-        else:
-            # Set random Page and disable
-            self.user_menu.add_command(label='User settings',
-                                       command=lambda: self.show_frame(gui.PageStart))
-            self.user_menu.entryconfig('User settings', state='disabled')
-
+    def _set_menubar_users(self):
+        """
+        Creates the static entries in the Users menu. The user entries are added in _update_menubar_users.
+        Menu layout: User settings, separator, one entry per user, separator, Create new user.
+        """
+        # User settings. Disabled if the active page has no user page.
+        self.user_menu.add_command(label='User settings',
+                                   command=lambda: self.show_plugin_user_page(self.active_page))
         self.user_menu.add_separator()
 
-        # All users
-        for user in self.user_manager.get_user_list():
-            self.user_menu.add_command(label='Change to user: {}'.format(user),
-                                       command=lambda x=user: self._change_user(x))
+        # All users are inserted here
         self.user_menu.add_separator()
 
         # New user
@@ -545,6 +770,40 @@ class MainApp(tk.Tk):
         # self.user_menu.add_command(label='Import user',
         #                            command=None)
 
+        # What is shown in the menu
+        self._user_menu_state = dict(user_page_state=None,
+                                     user_list_id=None,
+                                     users=[])
+
+    def _update_menubar_users(self):
+        """
+        Updates the Users menu. Only entries that have changed are updated. The user list is only compared
+        if the user manager reports that it has changed (other users directory or users added/removed).
+        """
+        state = self._user_menu_state
+        first_user_index = 2
+
+        # User settings
+        user_page_state = 'normal' if self._get_user_page_class(self.active_page) else 'disabled'
+        if user_page_state != state['user_page_state']:
+            self.user_menu.entryconfig(0, state=user_page_state)
+            state['user_page_state'] = user_page_state
+
+        # All users
+        user_list_id = self.user_manager.get_user_list_id()
+        if user_list_id == state['user_list_id']:
+            return
+        state['user_list_id'] = user_list_id
+        new_users = self.user_manager.get_user_list()
+        delete_indexes, insert_users = core.get_sorted_list_changes(state['users'], new_users)
+        for i in delete_indexes:
+            self.user_menu.delete(first_user_index + i)
+        for i, user in insert_users:
+            self.user_menu.insert_command(first_user_index + i,
+                                          label='Change to user: {}'.format(user),
+                                          command=lambda x=user: self._change_user(x))
+        state['users'] = new_users
+
     def _create_new_user(self):
 
         def _create_user():
@@ -608,8 +867,10 @@ class MainApp(tk.Tk):
         # Make updates
         self.make_user_updates()
 
+        self.record_diagnostics('change_user')
+
     def make_user_updates(self):
-        self.update_all()
+        self.invalidate('user')
 
     def _update_program_title(self):
         tk.Tk.wm_title(self, 'GISMOtoolbox (user: {}) :: {}'.format(self.user.name, self._get_title(self.active_page)))
@@ -626,11 +887,8 @@ class MainApp(tk.Tk):
         self.frames[active_page].show_frame(user_page)
 
     def show_subframe(self, main_page, sub_page):
-        print(0)
         self.show_frame(main_page)
-        print(1)
         self.frames[main_page].show_frame(sub_page)
-        print(2)
 
     def _get_users_directory_for_plugin(self, plugin_name):
         plugin_module = PLUGINS.get(plugin_name)
@@ -655,13 +913,13 @@ class MainApp(tk.Tk):
 
         load_page = True
         if page:
-            page_name = APP_TO_PAGE[page]
-        frame = self.frames[page_name]
+            page_name = self._get_page_name(page)
+        frame = self._get_frame(page_name)
 
         # Update user directory
         # Save user name
         user_name = self.user_manager.user.name
-        print('USER NAME', user_name)
+        self.logger.debug('Show page %s for user %s', page_name, user_name)
         user_dir = self._get_users_directory_for_plugin(page_name)
         if user_dir:
             self.user_manager.set_users_directory(user_dir)
@@ -674,9 +932,10 @@ class MainApp(tk.Tk):
             # self.run_progress_in_toplevel(frame.startup, 'Opening page, please wait...')
             frame.startup()
             self.pages_started[page_name] = True
-
-
-        frame.update_page()
+            self.page_registry.update(page_name, force=True)
+        else:
+            # Only update if something the page depends on has changed since it was last shown
+            self.redraw_scheduler.request(self._update_active_page)
         # self.deiconify()
         #             try:
         #                 frame.update()
@@ -694,9 +953,9 @@ class MainApp(tk.Tk):
                 self.page_history.pop()
                 self.page_history.append(page_name)
 
-        self._update_menubar_users()
+        self.redraw_scheduler.request(self._update_menubar_users)
 
-        self.update()
+        self.record_diagnostics('show_frame')
 
     def _show_frame(self, page):
         self.withdraw()
@@ -768,7 +1027,7 @@ class MainApp(tk.Tk):
         Updates all information about loaded series.
         """
 
-        self.update_all()
+        self.invalidate('data')
 
     # ===========================================================================
     def quit_toolbox(self):
@@ -786,6 +1045,14 @@ class MainApp(tk.Tk):
             else:
                 return
 
+        # Write pending user settings before closing
+        self.user_manager.flush()
+        self.task_executor.shutdown()
+        if self.diagnostics:
+            self.diagnostics.dump()
+            self.diagnostics.stop()
+        self.log_manager.stop()
+
         self.destroy()  # Closes window
         self.quit()  # Terminates program
 
@@ -827,16 +1094,37 @@ class Boxen(object):
     def __init__(self, *args, **kwargs):
         self.open_directory = kwargs.get('open_directory', '')
         self.loaded_files_widget = None
+        # core.ParsedDataCache (e.g. MainApp.data_cache). Files are parsed every time if None.
+        self.data_cache = kwargs.get('data_cache')
 
     # ==========================================================================
     def set_open_directory(self, directory):
         if os.path.exists(directory):
             self.open_directory = directory
 
+    # ==========================================================================
+    def load_data_file(self, file_path, parse_function, settings_file_path=None, parser_version=None):
+        """
+        Returns the parsed data (a pandas DataFrame) for the file. parse_function(file_path) is only called if
+        the file has not been parsed with the same settings file and parser before.
+        :param file_path:
+        :param parse_function:
+        :param settings_file_path: Settings file (see core.SettingsFiles) used when parsing
+        :param parser_version: Version of the parser, e.g. the plugin version
+        :return:
+        """
+        if not self.data_cache:
+            return parse_function(file_path)
+        return self.data_cache.get(file_path, parse_function, settings_file_path=settings_file_path,
+                                   parser_version=parser_version)
 
-def main():
+
+def main(profile_startup=False):
     """
     Updated 20181002    by
+
+    :param profile_startup: If True a startup profile report (json and folded stacks) is saved in the log directory.
+                            Also activated by starting with the argument --profile-startup.
     """
     root_directory = os.path.dirname(os.path.abspath(__file__))
     users_directory = os.path.join(root_directory, 'users')
@@ -844,14 +1132,28 @@ def main():
     default_settings_file_path = os.path.join(root_directory, 'system/settings.ini')
     mapping_files_directory = os.path.join(root_directory, 'data/mapping_files')
 
+    if profile_startup:
+        core.start_startup_profiler()
+    profiler = core.get_startup_profiler()
+    load_plugins()
+
     if not os.path.exists(log_directory):
         os.mkdir(log_directory)
 
-    app = MainApp(root_directory=root_directory,
-                  users_directory=users_directory,
-                  log_directory=log_directory,
-                  mapping_files_directory=mapping_files_directory,
-                  default_settings_file_path=default_settings_file_path)
+    with core.profile_phase('MainApp'):
+        app = MainApp(root_directory=root_directory,
+                      users_directory=users_directory,
+                      log_directory=log_directory,
+                      mapping_files_directory=mapping_files_directory,
+                      default_settings_file_path=default_settings_file_path)
+    if profiler:
+        profiler.stop()
+        file_paths = profiler.save_report(log_directory,
+                                          version=app.version,
+                                          nr_plugins=len(PLUGINS),
+                                          plugins_loaded=[name for name, plugin in PLUGINS.items()
+                                                          if plugin.is_loaded])
+        print('Startup profile saved to:', *file_paths)
     if not app.all_ok:
         return 
     app.focus_force()
@@ -860,7 +1162,7 @@ def main():
     
 if __name__ == '__main__':
     print('Version', )
-    app = main()
+    app = main(profile_startup='--profile-startup' in sys.argv)
 
 
 
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Benchmarks for the core settings, user and mapping code. Runs without GUI:
+
+    python -m tests.benchmark_core                 (from the gismo_gui_tkinter directory)
+    python -m tests.benchmark_core --only user     (benchmarks with "user" in the name)
+
+Each benchmark is repeated and the min and median times are reported. Results are added to a json history
+(tests/benchmark_history.json by default) per machine. A benchmark is reported as a regression if its median
+is more than threshold times the median of the latest runs in the history. The exit code is 1 if there
+are regressions (unless --no-fail is given).
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import random
+import shutil
+import socket
+import argparse
+import platform
+import datetime
+import tempfile
+import statistics
+import subprocess
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIRECTORY not in sys.path:
+    sys.path.insert(0, ROOT_DIRECTORY)
+
+import core
+from core.user import UserSettings, UserSettingsParameter, UserSettingsPriorityList
+from core.utils import atomic_write_json
+
+DEFAULT_HISTORY_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_history.json')
+DEFAULT_THRESHOLD = 1.3
+# Benchmarks that vary more between runs (mostly file system) get a larger threshold
+THRESHOLDS = {'user_manager_set_users_directory_1000': 1.6,
+              'settings_save': 1.6}
+NR_BASELINE_RUNS = 5
+
+
+class Benchmark(object):
+    """
+    A timed function. setup is called before each repeat and its return value is passed to function,
+    the setup time is not measured.
+    """
+    def __init__(self, name, function, setup=None, repeat=5, description=''):
+        self.name = name
+        self.function = function
+        self.setup = setup
+        self.repeat = repeat
+        self.description = description
+
+    def run(self):
+        times = []
+        for _ in range(self.repeat):
+            args = self.setup() if self.setup else None
+            t0 = time.perf_counter()
+            if self.setup:
+                self.function(args)
+            else:
+                self.function()
+            times.append(time.perf_counter() - t0)
+        return dict(min=min(times), median=statistics.median(times), repeat=self.repeat)
+
+
+# ==============================================================================
+# Settings
+def _write_large_settings_ini(directory, nr_extra_lines=5000):
+    """
+    Writes system/settings.ini with the lines of the real settings.ini and nr_extra_lines general settings.
+    Returns the file path.
+    """
+    system_directory = os.path.join(directory, 'system')
+    os.makedirs(system_directory, exist_ok=True)
+    with open(os.path.join(ROOT_DIRECTORY, 'system', 'settings.ini'), encoding='utf8') as fid:
+        lines = fid.read().splitlines()
+    for i in range(nr_extra_lines):
+        lines.append('Benchmark setting {}\tgeneral\t{}'.format(i, i))
+    file_path = os.path.join(system_directory, 'settings.ini')
+    with open(file_path, 'w', encoding='utf8') as fid:
+        fid.write('\n'.join(lines) + '\n')
+    return file_path
+
+
+def _remove(file_path):
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+
+def get_settings_benchmarks(directory):
+    ini_file_path = _write_large_settings_ini(directory)
+    cache_file_path = os.path.splitext(ini_file_path)[0] + '.cache.json'
+    json_file_path = os.path.join(directory, 'system', 'settings.json')
+    pkl_file_path = os.path.join(directory, 'system', 'settings.pkl')
+
+    def load():
+        return core.Settings(default_settings_file_path=ini_file_path, root_directory=directory)
+
+    def setup_parse():
+        _remove(cache_file_path)
+        _remove(json_file_path)
+
+    def setup_cached():
+        _remove(json_file_path)
+        if not os.path.exists(cache_file_path):
+            load()
+
+    def setup_pkl():
+        _remove(json_file_path)
+        settings = load()
+        _remove(json_file_path)
+        data = {group: dict(values) for group, values in settings.items() if isinstance(values, dict)}
+        for i in range(0, 5000, 10):
+            data['general']['Benchmark setting {}'.format(i)] = -i
+        with open(pkl_file_path, 'wb') as fid:
+            pickle.dump(data, fid)
+
+    def run_pkl(args):
+        load()
+        _remove(pkl_file_path)
+
+    def setup_save():
+        settings = load()
+        settings.change_setting('general', 'Benchmark setting 1', random.randint(0, 10**9))
+        return settings
+
+    return [Benchmark('settings_parse_ini', lambda args: load(), setup=setup_parse,
+                      description='Settings with 5000 extra lines in settings.ini, no cache'),
+            Benchmark('settings_load_cached_ini', lambda args: load(), setup=setup_cached,
+                      description='Settings with 5000 extra lines in settings.ini, cache present'),
+            Benchmark('settings_migrate_pkl', run_pkl, setup=setup_pkl,
+                      description='Settings migrated from a legacy settings.pkl'),
+            Benchmark('settings_save', lambda settings: settings.save_settings(), setup=setup_save,
+                      description='save_settings after one change')]
+
+
+# ==============================================================================
+# User settings
+def get_user_settings_benchmarks(directory, nr_parameters=2000):
+    parameters = ['PAR_{}'.format(i) for i in range(nr_parameters)]
+    counter = [0]
+
+    def new_directory():
+        counter[0] += 1
+        return os.path.join(directory, 'user_settings_{}'.format(counter[0]))
+
+    def run_set(settings):
+        for par in parameters:
+            settings.set(par, 1.5)
+
+    def run_set_batch(settings):
+        with settings.batch():
+            for par in parameters:
+                settings.set(par, 1.5)
+
+    def run_parameter_set_batch(settings):
+        with settings.batch():
+            for par in parameters:
+                settings.set(par, 'cmap', 'jet')
+                settings.set(par, 'vmin', 0)
+                settings.set(par, 'vmax', 10)
+
+    def run_parameter_save(settings):
+        settings.save()
+
+    def setup_parameter_save():
+        settings = UserSettingsParameter(directory=new_directory(), name='parameter', user='bench')
+        run_parameter_set_batch(settings)
+        return settings
+
+    return [Benchmark('user_settings_set_{}_write_behind'.format(nr_parameters), run_set,
+                      setup=lambda: UserSettings(directory=new_directory(), name='options', user='bench',
+                                                 save_scheduler=lambda func: None),
+                      description='UserSettings.set with a save scheduler (no write)'),
+            Benchmark('user_settings_set_{}_batch'.format(nr_parameters), run_set_batch,
+                      setup=lambda: UserSettings(directory=new_directory(), name='options', user='bench'),
+                      description='UserSettings.set in one batch (one write)'),
+            Benchmark('user_settings_parameter_set_{}_batch'.format(nr_parameters), run_parameter_set_batch,
+                      setup=lambda: UserSettingsParameter(directory=new_directory(), name='parameter',
+                                                          user='bench'),
+                      description='UserSettingsParameter.set, 3 keys per parameter, in one batch'),
+            Benchmark('user_settings_parameter_save_{}'.format(nr_parameters), run_parameter_save,
+                      setup=setup_parameter_save,
+                      description='UserSettingsParameter.save with 3 keys per parameter')]
+
+
+# ==============================================================================
+# User manager
+def get_user_manager_benchmarks(directory, nr_users=1000):
+    users_directory = os.path.join(directory, 'users')
+    os.makedirs(users_directory)
+    for i in range(nr_users):
+        user_directory = os.path.join(users_directory, 'user_{}'.format(i))
+        os.makedirs(user_directory)
+        with open(os.path.join(user_directory, 'options.json'), 'w') as fid:
+            json.dump({'show_info_popups': False}, fid)
+    other_directory = os.path.join(directory, 'other_users')
+    os.makedirs(os.path.join(other_directory, 'default'))
+
+    def run_cold(args):
+        user_manager = core.UserManager(users_directory)
+        user_manager.set_users_directory(users_directory)
+        user_manager.add_user_settings(users_directory=users_directory, settings_type='basic',
+                                       settings_name='options')
+
+    def setup_cached():
+        user_manager = core.UserManager(users_directory)
+        user_manager.set_users_directory(users_directory)
+        user_manager.set_users_directory(other_directory)
+        return user_manager
+
+    def run_cached(user_manager):
+        for _ in range(100):
+            user_manager.set_users_directory(users_directory)
+            user_manager.set_users_directory(other_directory)
+
+    def run_add_user(user_manager):
+        user_manager.set_users_directory(users_directory)
+        user_manager.add_user('new_user_{}'.format(random.randint(0, 10**9)), 'user_0')
+
+    return [Benchmark('user_manager_set_users_directory_{}'.format(nr_users), run_cold, setup=lambda: None,
+                      description='New UserManager, set_users_directory and add_user_settings'),
+            Benchmark('user_manager_switch_cached_directories_x100', run_cached, setup=setup_cached,
+                      description='Switching between two cached users directories 200 times'),
+            Benchmark('user_manager_add_user_from_template', run_add_user, setup=setup_cached,
+                      description='add_user layered on another user')]
+
+
+# ==============================================================================
+# Priority list
+def get_priority_benchmarks(directory, nr_columns=5000, nr_priority_items=1000):
+    columns = ['COLUMN_{}'.format(i) for i in range(nr_columns)] + ['CPHL', 'TEMP']
+    other_columns = list(reversed(columns))
+
+    def setup():
+        priority = UserSettingsPriorityList(directory=os.path.join(directory, 'priority'), name='priority',
+                                            user='bench')
+        priority.set_priorities(['MISSING_{}'.format(i) for i in range(nr_priority_items)] + ['TEMP'])
+        return priority
+
+    def run_same_list(priority):
+        for _ in range(1000):
+            priority.get_priority(columns)
+
+    def run_new_lists(priority):
+        for i in range(20):
+            priority.get_priority(columns if i % 2 else other_columns)
+
+    return [Benchmark('priority_get_priority_same_list_x1000', run_same_list, setup=setup,
+                      description='get_priority on {} columns with {} priority items'.format(nr_columns,
+                                                                                              nr_priority_items)),
+            Benchmark('priority_get_priority_new_list_x20', run_new_lists, setup=setup,
+                      description='get_priority when the column list changes between calls')]
+
+
+# ==============================================================================
+# Colormaps
+def get_colormap_benchmarks(directory):
+    def run_lut(args):
+        colormaps = core.Colormaps()
+        colormaps.get_lut('jet')
+
+    return [Benchmark('colormaps_construction', lambda args: core.Colormaps(), setup=lambda: None, repeat=20,
+                      description='Colormaps()'),
+            Benchmark('colormaps_first_lut', run_lut, setup=lambda: None,
+                      description='Colormaps() and the first lookup table (imports matplotlib)')]
+
+
+BENCHMARK_GROUPS = [get_settings_benchmarks,
+                    get_user_settings_benchmarks,
+                    get_user_manager_benchmarks,
+                    get_priority_benchmarks,
+                    get_colormap_benchmarks]
+
+
+# ==============================================================================
+def run_benchmarks(only=None):
+    """
+    Runs all benchmarks (or the ones with only in the name). Returns a dict with the results per benchmark.
+    :param only:
+    :return:
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='gismo_benchmark_') as directory:
+        for nr, get_benchmarks in enumerate(BENCHMARK_GROUPS):
+            group_directory = os.path.join(directory, str(nr))
+            os.makedirs(group_directory)
+            try:
+                benchmarks = get_benchmarks(group_directory)
+            except ImportError as e:
+                print('Skipping {}: {}'.format(get_benchmarks.__name__, e))
+                continue
+            for benchmark in benchmarks:
+                if only and only not in benchmark.name:
+                    continue
+                try:
+                    result = benchmark.run()
+                except ImportError as e:
+                    print('Skipping {}: {}'.format(benchmark.name, e))
+                    continue
+                result['description'] = benchmark.description
+                results[benchmark.name] = result
+                print('{:<50} min {:>9.2f} ms   median {:>9.2f} ms'.format(benchmark.name,
+                                                                         result['min'] * 1000,
+                                                                         result['median'] * 1000))
+    return results
+
+
+def _get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIRECTORY,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def load_history(file_path):
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, encoding='utf8') as fid:
+        return json.load(fid)
+
+
+def save_history(file_path, history):
+    atomic_write_json(file_path, history, indent=2)
+
+
+def find_regressions(results, history, machine, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares the results with the median of the latest NR_BASELINE_RUNS runs on the same machine.
+    Returns a list of (name, median, baseline, ratio) for benchmarks slower than threshold times baseline.
+    """
+    runs = [run for run in history if run.get('machine') == machine][-NR_BASELINE_RUNS:]
+    regressions = []
+    for name, result in results.items():
+        baseline_values = [run['results'][name]['median'] for run in runs if name in run['results']]
+        if not baseline_values:
+            continue
+        baseline = statistics.median(baseline_values)
+        ratio = result['median'] / baseline if baseline else 0
+        if ratio > THRESHOLDS.get(name, threshold):
+            regressions.append((name, result['median'], baseline, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks for core settings, user and mapping code')
+    parser.add_argument('--only', help='Only run benchmarks with this in the name')
+    parser.add_argument('--history', default=DEFAULT_HISTORY_FILE_PATH, help='Json file with earlier results')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Max allowed ratio to the baseline median (default {})'.format(DEFAULT_THRESHOLD))
+    parser.add_argument('--no-save', action='store_true', help='Do not add the results to the history')
+    parser.add_argument('--no-fail', action='store_true', help='Exit code 0 also if there are regressions')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(only=args.only)
+
+    machine = '{} {} python {}'.format(socket.gethostname(), platform.machine(), platform.python_version())
+    history = load_history(args.history)
+    regressions = find_regressions(results, history, machine, threshold=args.threshold)
+    for name, median, baseline, ratio in regressions:
+        print('REGRESSION {}: {:.2f} ms, baseline {:.2f} ms ({:.2f} x)'.format(name, median * 1000,
+                                                                            baseline * 1000, ratio))
+    if not regressions:
+        print('No regressions')
+
+    if not args.no_save:
+        history.append(dict(time=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                            commit=_get_git_commit(),
+                            machine=machine,
+                            results=results))
+        save_history(args.history, history)
+
+    if regressions and not args.no_fail:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
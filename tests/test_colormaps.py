@@ -0,0 +1,45 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Tests for core.Colormaps.
+"""
+import sys
+
+import numpy as np
+
+from core.mappings import Colormaps
+
+
+def test_colormaps_are_resolved_when_requested(monkeypatch):
+    # cmocean can not be imported
+    monkeypatch.setitem(sys.modules, 'cmocean', None)
+    colormaps = Colormaps()
+    assert colormaps.get('viridis').name == 'viridis'
+    assert colormaps.get('no_such_colormap') == colormaps.default_cmap
+
+
+def test_lut_is_cached_and_read_only():
+    colormaps = Colormaps()
+    lut = colormaps.get_lut('viridis')
+    assert lut.shape == (256, 4)
+    assert colormaps.get_lut('viridis') is lut
+    assert not lut.flags.writeable
+
+
+def test_to_rgba_uses_lut_and_bad_color():
+    colormaps = Colormaps()
+    lut = colormaps.get_lut('viridis')
+    colors = colormaps.to_rgba([0., 10., np.nan], 'viridis')
+    assert np.array_equal(colors[0], lut[0])
+    assert np.array_equal(colors[1], lut[-1])
+    assert np.array_equal(colors[2], colormaps.get('viridis').get_bad())
+
+
+def test_registered_colormap_replaces_cached_lut():
+    colormaps = Colormaps()
+    colormaps.register('custom', colormaps.get('viridis'))
+    lut = colormaps.get_lut('custom')
+    colormaps.register('custom', colormaps.get('magma'))
+    assert colormaps.get('custom').name == 'magma'
+    assert not np.array_equal(colormaps.get_lut('custom'), lut)
+    assert 'custom' in colormaps.get_list()
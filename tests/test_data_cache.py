@@ -0,0 +1,113 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Tests for core.ParsedDataCache.
+"""
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from core.data_cache import ParsedDataCache
+
+
+def parse_file(file_path):
+    return pd.read_csv(file_path, sep='\t')
+
+
+def parse_file_other(file_path):
+    return pd.read_csv(file_path, sep='\t')
+
+
+def write_data_file(file_path, values):
+    with open(file_path, 'w') as fid:
+        fid.write('time\tvalue\tname\n')
+        for nr, value in enumerate(values):
+            fid.write('{}\t{}\tname_{}\n'.format(nr, value, nr))
+
+
+class CountingParser(object):
+    def __init__(self, function):
+        self.function = function
+        self.__module__ = function.__module__
+        self.__qualname__ = function.__qualname__
+        self.calls = 0
+
+    def __call__(self, file_path):
+        self.calls += 1
+        return self.function(file_path)
+
+
+def test_cached_data_is_equal_to_parsed(tmp_path):
+    cache = ParsedDataCache(str(tmp_path / 'cache'))
+    file_path = str(tmp_path / 'data.txt')
+    write_data_file(file_path, [1.5, np.nan, 3.5])
+    parser = CountingParser(parse_file)
+
+    df = cache.get(file_path, parser)
+    cached_df = cache.get(file_path, parser)
+    assert parser.calls == 1
+    assert df.equals(cached_df)
+    assert list(cached_df.columns) == ['time', 'value', 'name']
+
+
+def test_cache_key_is_file_content(tmp_path):
+    cache = ParsedDataCache(str(tmp_path / 'cache'))
+    file_path = str(tmp_path / 'data.txt')
+    write_data_file(file_path, [1.5, 2.5])
+    parser = CountingParser(parse_file)
+    cache.get(file_path, parser)
+
+    moved_file_path = str(tmp_path / 'moved.txt')
+    shutil.move(file_path, moved_file_path)
+    cache.get(moved_file_path, parser)
+    assert parser.calls == 1
+
+    write_data_file(moved_file_path, [1.5, 2.5, 3.5])
+    assert len(cache.get(moved_file_path, parser)) == 3
+    assert parser.calls == 2
+
+
+def test_cache_key_depends_on_settings_file_and_parser(tmp_path):
+    cache = ParsedDataCache(str(tmp_path / 'cache'))
+    file_path = str(tmp_path / 'data.txt')
+    settings_file_path = str(tmp_path / 'settings.json')
+    write_data_file(file_path, [1, 2])
+    with open(settings_file_path, 'w') as fid:
+        fid.write('{"a": 1}')
+
+    key = cache.get_key(file_path, settings_file_path, 'parser:1')
+    assert cache.get_key(file_path, settings_file_path, 'parser:1') == key
+    assert cache.get_key(file_path, settings_file_path, 'parser:2') != key
+    assert cache.get_key(file_path, None, 'parser:1') != key
+
+    with open(settings_file_path, 'w') as fid:
+        fid.write('{"a": 2}')
+    assert cache.get_key(file_path, settings_file_path, 'parser:1') != key
+
+
+def test_other_parser_gives_new_entry(tmp_path):
+    cache = ParsedDataCache(str(tmp_path / 'cache'))
+    file_path = str(tmp_path / 'data.txt')
+    write_data_file(file_path, [1.5, 2.5, 3.5])
+    parser = CountingParser(parse_file)
+    other_parser = CountingParser(parse_file_other)
+
+    cache.get(file_path, parser)
+    cache.get(file_path, parser, parser_version='2')
+    cache.get(file_path, other_parser)
+    cache.get(file_path, other_parser)
+    assert (parser.calls, other_parser.calls) == (2, 1)
+
+
+def test_cached_data_is_writable(tmp_path):
+    cache = ParsedDataCache(str(tmp_path / 'cache'))
+    file_path = str(tmp_path / 'data.txt')
+    write_data_file(file_path, [1.5, 2.5, 3.5])
+    cache.get(file_path, parse_file)
+
+    df = cache.get(file_path, parse_file)
+    df.loc[0, 'value'] = 10.
+    assert df.loc[0, 'value'] == 10.
+    # Changes are not written to the cache
+    assert np.allclose(cache.get(file_path, parse_file)['value'], [1.5, 2.5, 3.5])
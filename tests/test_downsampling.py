@@ -0,0 +1,97 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Tests for core.downsampling.
+"""
+import numpy as np
+import pytest
+
+from core.downsampling import downsample_figure, downsample_indices, get_keep_mask
+
+
+NR_POINTS = 10000
+MAX_POINTS = 500
+
+
+def get_figure(**trace):
+    x = np.arange(NR_POINTS, dtype=float)
+    trace = dict(dict(name='data', x=x, y=np.sin(x / 100.)), **trace)
+    return dict(data=[trace], layout={})
+
+
+def get_flagged_positions():
+    return np.random.RandomState(1).choice(NR_POINTS, 50, replace=False)
+
+
+def test_downsample_reduces_points():
+    figure = get_figure(text=['point {}'.format(nr) for nr in range(NR_POINTS)])
+    result = downsample_figure(figure, MAX_POINTS)
+    trace = figure['data'][0]
+    assert result == [('data', NR_POINTS, len(trace['y']))]
+    assert len(trace['x']) <= MAX_POINTS
+    assert len(trace['x']) == len(trace['y']) == len(trace['text'])
+    assert trace['text'][-1] == 'point {}'.format(int(trace['x'][-1]))
+
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+def test_downsample_keeps_extremes(method):
+    x = np.arange(NR_POINTS, dtype=float)
+    y = np.zeros(NR_POINTS)
+    y[1234] = 10.
+    y[5678] = -10.
+    index = downsample_indices(x, y, MAX_POINTS, method=method)
+    assert 1234 in index and 5678 in index
+    assert index[0] == 0 and index[-1] == NR_POINTS - 1
+    assert np.all(np.diff(index) > 0)
+
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+def test_downsample_keeps_gaps(method):
+    x = np.arange(NR_POINTS, dtype=float)
+    y = np.sin(x / 100.)
+    y[:10] = np.nan
+    y[2000:3000] = np.nan
+    y[7000] = np.inf
+    y[-10:] = np.nan
+    index = downsample_indices(x, y, MAX_POINTS, method=method)
+    assert [i for i in index if not np.isfinite(y[i])] == [2000, 7000]
+    assert index[0] == 10 and index[-1] == NR_POINTS - 11
+
+
+def test_gaps_are_kept_without_downsampling():
+    y = np.array([1., np.nan, np.nan, 2., 3., np.nan])
+    assert list(downsample_indices(np.arange(6), y, MAX_POINTS)) == [0, 1, 3, 4]
+
+
+def test_keep_traces_are_not_downsampled():
+    figure = get_figure()
+    assert downsample_figure(figure, MAX_POINTS, keep_traces=['data']) == []
+    assert len(figure['data'][0]['x']) == NR_POINTS
+
+
+def test_points_with_other_marker_are_kept():
+    colors = np.array(['blue'] * NR_POINTS, dtype=object)
+    flagged = get_flagged_positions()
+    colors[flagged] = 'red'
+    figure = get_figure(marker=dict(color=colors))
+
+    downsample_figure(figure, MAX_POINTS)
+    trace = figure['data'][0]
+    assert set(trace['x'][trace['marker']['color'] == 'red']) == set(flagged.astype(float))
+
+
+def test_points_with_keep_flags_are_kept():
+    flags = np.zeros(NR_POINTS, dtype=int)
+    flagged = get_flagged_positions()
+    flags[flagged] = 4
+    figure = get_figure(customdata=np.column_stack([flags, np.arange(NR_POINTS)]))
+
+    downsample_figure(figure, MAX_POINTS, keep_flags=[4])
+    trace = figure['data'][0]
+    assert set(trace['x'][trace['customdata'][:, 0] == 4]) == set(flagged.astype(float))
+    assert (trace['customdata'][:, 1] == trace['x']).all()
+
+
+def test_keep_mask_without_flags():
+    assert get_keep_mask(dict(y=[1, 2, 3], marker=dict(color='red'))) is None
+    assert get_keep_mask(dict(y=np.arange(100), marker=dict(color=np.arange(100)))) is None
@@ -0,0 +1,65 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Tests for the cache keys of core.HTMLExportJob.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.html_export import HTMLExportJob
+
+
+def create_figure(**kwargs):
+    return dict(data=[], layout={})
+
+
+def get_job(**kwargs):
+    kwargs = dict(dict(file_path='a.html', figure_function=create_figure, dataset_key='data_1', parameter='TEMP',
+                       flag_state='all'), **kwargs)
+    return HTMLExportJob(**kwargs)
+
+
+def test_cache_key_depends_on_content():
+    key = get_job().get_cache_key()
+    assert get_job(file_path='b.html', title='Other title').get_cache_key() == key
+    assert get_job(dataset_key='data_2').get_cache_key() != key
+    assert get_job(parameter='PSAL').get_cache_key() != key
+    assert get_job(flag_state='good').get_cache_key() != key
+
+
+def test_cache_key_depends_on_downsampling():
+    job = get_job()
+    assert job.get_cache_key(downsample=dict(max_points=1000, method='lttb')) != job.get_cache_key()
+
+
+def test_cache_key_depends_on_kwargs():
+    key = get_job(color='red').get_cache_key()
+    assert get_job(color='red').get_cache_key() == key
+    assert get_job(color='blue').get_cache_key() != key
+
+
+def test_cache_key_depends_on_array_content():
+    values = np.arange(5000, dtype=float)
+    key = get_job(values=values).get_cache_key()
+    assert get_job(values=values.copy()).get_cache_key() == key
+    changed = values.copy()
+    changed[2500] = -1
+    assert get_job(values=changed).get_cache_key() != key
+    assert get_job(values=values.astype(np.float32)).get_cache_key() != key
+
+
+def test_cache_key_depends_on_dataframe_content():
+    df = pd.DataFrame({'TEMP': np.arange(5000, dtype=float), 'PSAL': np.ones(5000)})
+    key = get_job(data=df).get_cache_key()
+    assert get_job(data=df.copy()).get_cache_key() == key
+    changed = df.copy()
+    changed.loc[2500, 'TEMP'] = -1
+    assert get_job(data=changed).get_cache_key() != key
+    assert get_job(data=df.rename(columns={'PSAL': 'SALT'})).get_cache_key() != key
+    assert get_job(data=df['TEMP']).get_cache_key() != get_job(data=df['PSAL']).get_cache_key()
+
+
+def test_cache_key_refuses_unknown_objects():
+    with pytest.raises(TypeError):
+        get_job(data=object()).get_cache_key()
@@ -0,0 +1,211 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Tests for the saved settings (json overrides of settings.ini), the settings.ini cache and the
+catalogue of settings files.
+"""
+import os
+import json
+import pickle
+import datetime
+
+import core.settings
+from core.settings import Settings, SettingsFiles, read_settings_file_metadata
+
+
+SETTINGS_INI = """# Test settings
+Settings file path\tdirectory\troot/system/settings.json
+Main window indent x\tgeneral\t200
+Log level\tgeneral\tDEBUG
+Startup user\tuser\tdefault
+"""
+
+
+def write_settings_ini(root_directory, content=SETTINGS_INI):
+    system_directory = os.path.join(str(root_directory), 'system')
+    if not os.path.exists(system_directory):
+        os.makedirs(system_directory)
+    file_path = os.path.join(system_directory, 'settings.ini')
+    with open(file_path, 'w', encoding='cp1252') as fid:
+        fid.write(content)
+    return file_path
+
+
+def get_settings(root_directory):
+    file_path = os.path.join(str(root_directory), 'system', 'settings.ini')
+    if not os.path.exists(file_path):
+        write_settings_ini(root_directory)
+    return Settings(default_settings_file_path=file_path, root_directory=str(root_directory))
+
+
+def read_json(file_path):
+    with open(file_path, encoding='utf8') as fid:
+        return json.load(fid)
+
+
+def test_only_changed_settings_are_saved(tmp_path):
+    settings = get_settings(tmp_path)
+    settings.change_setting('general', 'Main window indent x', '300')
+    settings.save_settings()
+    assert read_json(settings.file_path) == {'schema_version': 1,
+                                             'settings': {'general': {'Main window indent x': 300}}}
+    settings = get_settings(tmp_path)
+    assert settings['general']['Main window indent x'] == 300
+    assert settings['general']['Log level'] == 'DEBUG'
+
+
+def test_unchanged_settings_are_not_written_again(tmp_path, monkeypatch):
+    settings = get_settings(tmp_path)
+    settings.change_setting('general', 'Log level', 'INFO')
+    settings.save_settings()
+
+    def write(*args, **kwargs):
+        raise AssertionError('Settings written without changes')
+
+    monkeypatch.setattr(core.settings, 'atomic_write_json', write)
+    settings.save_settings()
+
+
+def test_corrupt_settings_file_is_moved_aside(tmp_path):
+    write_settings_ini(tmp_path)
+    settings_file_path = os.path.join(str(tmp_path), 'system', 'settings.json')
+    with open(settings_file_path, 'w') as fid:
+        fid.write('{not json')
+    settings = get_settings(tmp_path)
+    assert settings['general']['Main window indent x'] == 200
+    assert os.path.exists(settings_file_path + '.corrupt')
+
+
+def test_legacy_pkl_settings_are_migrated(tmp_path):
+    write_settings_ini(tmp_path)
+    with open(os.path.join(str(tmp_path), 'system', 'settings.pkl'), 'wb') as fid:
+        pickle.dump({'general': {'Main window indent x': 250, 'Log level': 'DEBUG'}}, fid)
+    settings = get_settings(tmp_path)
+    assert settings['general']['Main window indent x'] == 250
+    assert read_json(settings.file_path)['settings'] == {'general': {'Main window indent x': 250}}
+
+
+def test_legacy_pkl_with_objects_is_not_loaded(tmp_path):
+    write_settings_ini(tmp_path)
+    with open(os.path.join(str(tmp_path), 'system', 'settings.pkl'), 'wb') as fid:
+        pickle.dump({'general': {'Main window indent x': datetime.date(2020, 1, 1)}}, fid)
+    settings = get_settings(tmp_path)
+    assert settings['general']['Main window indent x'] == 200
+
+
+def fail(*args, **kwargs):
+    raise AssertionError('settings.ini parsed')
+
+
+def test_parsed_settings_ini_is_cached(tmp_path, monkeypatch):
+    get_settings(tmp_path)
+    assert os.path.exists(os.path.join(str(tmp_path), 'system', 'settings.cache.json'))
+    monkeypatch.setattr(Settings, '_parse_default_settings', fail)
+    settings = get_settings(tmp_path)
+    assert settings['general']['Main window indent x'] == 200
+    assert settings['directory']['Settings file path'] == str(tmp_path) + '/system/settings.json'
+
+
+def test_cache_is_not_used_when_settings_ini_changes(tmp_path):
+    get_settings(tmp_path)
+    write_settings_ini(tmp_path, SETTINGS_INI.replace('\t200', '\t2500'))
+    assert get_settings(tmp_path)['general']['Main window indent x'] == 2500
+
+
+def test_cache_is_used_when_settings_ini_is_touched(tmp_path, monkeypatch):
+    file_path = write_settings_ini(tmp_path)
+    get_settings(tmp_path)
+    stat = os.stat(file_path)
+    os.utime(file_path, (stat.st_atime + 10, stat.st_mtime + 10))
+    monkeypatch.setattr(Settings, '_parse_default_settings', fail)
+    assert get_settings(tmp_path)['general']['Main window indent x'] == 200
+
+
+def test_cache_depends_on_root_directory(tmp_path):
+    get_settings(tmp_path)
+    other_root_directory = str(tmp_path / 'other')
+    settings = Settings(default_settings_file_path=os.path.join(str(tmp_path), 'system', 'settings.ini'),
+                        root_directory=other_root_directory)
+    assert settings['directory']['Settings file path'] == other_root_directory + '/system/settings.json'
+
+
+def test_value_lists_are_lists_with_and_without_cache(tmp_path, monkeypatch):
+    write_settings_ini(tmp_path, SETTINGS_INI +
+                       "Plot color\tpage plot\tred\tstr;{'red', 'blue'}\n"
+                       "Plot size\tpage plot\t2\tint;(1, (2, 3))\n")
+    parsed = get_settings(tmp_path)
+    monkeypatch.setattr(Settings, '_parse_default_settings', fail)
+    cached = get_settings(tmp_path)
+    for settings in [parsed, cached]:
+        assert settings['page plot']['Plot color']['value_list'] == ['blue', 'red']
+        assert settings['page plot']['Plot size']['value_list'] == [1, [2, 3]]
+
+
+def test_settings_ini_with_non_json_values_is_not_cached(tmp_path):
+    write_settings_ini(tmp_path, SETTINGS_INI + "Plot marker\tpage plot\to\tstr;[b'o', b'x']\n")
+    settings = get_settings(tmp_path)
+    assert settings['page plot']['Plot marker']['value_list'] == [b'o', b'x']
+    assert not os.path.exists(os.path.join(str(tmp_path), 'system', 'settings.cache.json'))
+    assert get_settings(tmp_path)['page plot']['Plot marker']['value_list'] == [b'o', b'x']
+
+
+def write_json(file_path, data):
+    with open(file_path, 'w', encoding='utf8') as fid:
+        json.dump(data, fid)
+
+
+def get_settings_files(directory, read_files=None, cache_file_path=None):
+    def reader(file_path):
+        if read_files is not None:
+            read_files.append(os.path.basename(file_path))
+        return read_settings_file_metadata(file_path)
+    return SettingsFiles(str(directory), metadata_reader=reader, cache_file_path=cache_file_path)
+
+
+def test_settings_files_refresh_only_reads_changed_files(tmp_path):
+    directory = tmp_path / 'settings_files'
+    directory.mkdir()
+    write_json(str(directory / 'a.json'), dict(sampling_type='ferrybox', parameters=['TEMP']))
+    write_json(str(directory / 'b.json'), dict(sampling_type='ctd', parameter_mapping={'CHL': 'CPHL'}))
+    read_files = []
+    settings_files = get_settings_files(directory, read_files)
+    assert sorted(read_files) == ['a.json', 'b.json']
+    assert settings_files.get_list() == ['a', 'b']
+    assert settings_files.get_metadata('b') == dict(sampling_type='ctd', parameters=['CHL', 'CPHL'])
+
+    read_files.clear()
+    assert not settings_files.refresh()
+    assert read_files == []
+
+    write_json(str(directory / 'a.json'), dict(sampling_type='ferrybox', parameters=['TEMP', 'PSAL']))
+    write_json(str(directory / 'c.json'), dict(sampling_type='ctd'))
+    os.remove(str(directory / 'b.json'))
+    assert settings_files.refresh()
+    assert sorted(read_files) == ['a.json', 'c.json']
+    assert settings_files.get_list() == ['a', 'c']
+    assert settings_files.get_path('c') == str(directory / 'c.json')
+    assert settings_files.get_path('b') == ''
+
+
+def test_find_settings_file(tmp_path):
+    write_json(str(tmp_path / 'ferrybox_1.json'), dict(sampling_type='ferrybox', parameters=['TEMP']))
+    write_json(str(tmp_path / 'ferrybox_2.json'), dict(sampling_type='ferrybox', parameters=['TEMP', 'CPHL']))
+    write_json(str(tmp_path / 'ctd.json'), dict(sampling_type='ctd', parameters=['TEMP', 'CPHL', 'PSAL']))
+    settings_files = get_settings_files(tmp_path)
+    assert settings_files.find_settings_file('Ferrybox', ['temp', 'cphl']) == 'ferrybox_2'
+    assert settings_files.find_settings_file(None, ['PSAL']) == 'ctd'
+    assert settings_files.find_settings_file('ferrybox') == 'ferrybox_1'
+    assert settings_files.find_settings_file('glider', ['TEMP']) is None
+
+
+def test_settings_files_catalogue_is_saved(tmp_path):
+    directory = tmp_path / 'settings_files'
+    directory.mkdir()
+    write_json(str(directory / 'a.json'), dict(sampling_type='ferrybox', parameters=['TEMP']))
+    cache_file_path = str(tmp_path / 'catalogue.json')
+    get_settings_files(directory, cache_file_path=cache_file_path)
+
+    read_files = []
+    settings_files = get_settings_files(directory, read_files, cache_file_path=cache_file_path)
+    assert read_files == []
+    assert settings_files.get_metadata('a') == dict(sampling_type='ferrybox', parameters=['TEMP'])
@@ -0,0 +1,124 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Tests for core.TaskExecutor. No after function is given, so the tests call poll themselves.
+"""
+import time
+import threading
+
+import pytest
+
+from core.tasks import TaskExecutor
+
+
+def wait_for_tasks(executor, timeout=5):
+    end_time = time.time() + timeout
+    while executor.is_running_any():
+        if time.time() > end_time:
+            raise TimeoutError('Tasks not finished')
+        executor.poll()
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def executor():
+    executor = TaskExecutor(max_workers=1)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def test_callback_gets_result(executor):
+    results = []
+    executor.submit(sum, [1, 2, 3], callback=results.append)
+    wait_for_tasks(executor)
+    assert results == [6]
+
+
+def test_error_callback_gets_exception(executor):
+    errors = []
+    executor.submit(int, 'x', error_callback=errors.append)
+    wait_for_tasks(executor)
+    assert isinstance(errors[0], ValueError)
+
+
+def test_same_key_is_not_submitted_twice(executor):
+    release = threading.Event()
+    first = executor.submit(release.wait, 5, key='key')
+    assert executor.submit(release.wait, 5, key='key') is first
+    release.set()
+    wait_for_tasks(executor)
+
+
+def test_progress_is_not_reported_after_cancel(executor):
+    started = threading.Event()
+    progress = []
+
+    def work(task=None):
+        started.set()
+        while True:
+            task.set_progress(0.5, 'working')
+            task.check_cancelled()
+            time.sleep(0.01)
+
+    executor.submit(work, key='work', pass_task=True, progress_callback=lambda *args: progress.append(args))
+    assert started.wait(5)
+    executor.cancel('work')
+    nr_reported = len(progress)
+    wait_for_tasks(executor)
+    assert len(progress) == nr_reported
+
+
+def test_cancel_running_task(executor):
+    started = threading.Event()
+    events = []
+
+    def work(task=None):
+        started.set()
+        while True:
+            task.check_cancelled()
+            time.sleep(0.01)
+
+    executor.submit(work, key='work', pass_task=True, callback=lambda result: events.append('done'),
+                    error_callback=lambda e: events.append('error'),
+                    cancel_callback=lambda: events.append('cancelled'))
+    assert started.wait(5)
+    executor.cancel('work')
+    wait_for_tasks(executor)
+    assert events == ['cancelled']
+
+
+def test_cancel_task_not_started(executor):
+    release = threading.Event()
+    events = []
+    executor.submit(release.wait, 5, key='blocking')
+    executor.submit(lambda: events.append('run'), key='waiting',
+                    cancel_callback=lambda: events.append('cancelled'))
+    executor.cancel('waiting')
+    release.set()
+    wait_for_tasks(executor)
+    assert events == ['cancelled']
+
+
+def test_cancelled_task_that_finishes_gets_cancel_callback(executor):
+    release = threading.Event()
+    events = []
+    executor.submit(release.wait, 5, key='work', callback=lambda result: events.append('done'),
+                    cancel_callback=lambda: events.append('cancelled'))
+    time.sleep(0.05)
+    executor.cancel('work')
+    release.set()
+    wait_for_tasks(executor)
+    assert events == ['cancelled']
+
+
+def test_key_is_released_on_cancel(executor):
+    release = threading.Event()
+    results = []
+    first = executor.submit(release.wait, 5, key='key', callback=results.append)
+    executor.cancel('key')
+    assert not executor.is_running('key')
+    second = executor.submit(sum, [1, 2], key='key', callback=results.append)
+    assert second is not first
+    release.set()
+    wait_for_tasks(executor)
+    assert results == [3]
@@ -0,0 +1,64 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Tests for core.TimeIndex.
+"""
+import datetime
+
+import numpy as np
+
+from core.time_index import TimeIndex, get_time_index, clear_time_index
+
+
+TIMES = ['2020-01-01T00:00', '2020-01-01T02:00', '2020-01-01T01:00', None, '2020-01-01T03:00']
+
+
+def hour(value):
+    return datetime.datetime(2020, 1, 1, value)
+
+
+def test_rows_are_in_time_order():
+    index = TimeIndex(TIMES)
+    assert len(index) == 4
+    assert (index.start, index.end) == (hour(0), hour(3))
+    assert list(index.get_rows('2020-01-01T00:30', '2020-01-01T02:00')) == [2, 1]
+    assert index.count(hour(1), hour(3)) == 3
+    assert index.count('2021-01-01') == 0
+
+
+def test_get_counts():
+    index = TimeIndex(TIMES)
+    counts = index.get_counts([hour(0), hour(2), datetime.datetime(2020, 1, 2)])
+    assert list(counts) == [2, 2]
+
+
+def test_snap():
+    index = TimeIndex(TIMES)
+    assert index.snap(datetime.datetime(2020, 1, 1, 1, 20)) == hour(1)
+    assert index.snap(datetime.datetime(2020, 1, 1, 1, 40)) == hour(2)
+    assert index.snap(datetime.datetime(2020, 1, 1, 1, 20), direction='after') == hour(2)
+    assert index.snap(datetime.datetime(2020, 1, 1, 1, 40), direction='before') == hour(1)
+    assert index.snap(hour(2), direction='before') == hour(2)
+    assert index.snap('2019-12-31', direction='before') is None
+    assert index.snap('2021-01-01', direction='after') is None
+    assert index.snap('2021-01-01') == hour(3)
+
+
+def test_clamp():
+    index = TimeIndex(TIMES)
+    assert index.clamp('2019-01-01', '2021-01-01') == (hour(0), hour(3))
+    assert index.clamp() == (hour(0), hour(3))
+    assert index.clamp(datetime.datetime(2020, 1, 1, 0, 30), datetime.datetime(2020, 1, 1, 2, 30)) == \
+        (datetime.datetime(2020, 1, 1, 0, 30), datetime.datetime(2020, 1, 1, 2, 30))
+    assert index.clamp(datetime.datetime(2020, 1, 1, 0, 30), datetime.datetime(2020, 1, 1, 2, 30), snap=True) == \
+        (hour(1), hour(2))
+    assert TimeIndex([]).clamp(hour(0), hour(1)) == (None, None)
+
+
+def test_time_index_per_dataset():
+    clear_time_index()
+    assert get_time_index('data') is None
+    index = get_time_index('data', np.array(TIMES[:2], dtype='datetime64[ns]'))
+    assert get_time_index('data') is index
+    clear_time_index('data')
+    assert get_time_index('data') is None
@@ -0,0 +1,302 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Tests for user settings, the users directory cache, layered user profiles and the mirror of a shared
+users directory.
+"""
+import os
+import json
+import shutil
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import core.user
+from core.user import UserManager, UserSettings, UserSettingsPriorityList
+
+
+def read_json(file_path):
+    with open(file_path) as fid:
+        return json.load(fid)
+
+
+def test_changes_are_written_by_the_save_scheduler(tmp_path):
+    scheduled = []
+    settings = UserSettings(directory=str(tmp_path), name='options', user='user', save_scheduler=scheduled.append)
+    settings.set('a', 1)
+    settings.set('b', 2)
+    assert read_json(settings.file_path) == {}
+    assert len(scheduled) == 1
+
+    scheduled[0]()
+    assert read_json(settings.file_path) == {'a': 1, 'b': 2}
+
+
+def test_batch_writes_once(tmp_path, monkeypatch):
+    settings = UserSettings(directory=str(tmp_path), name='options', user='user')
+    writes = []
+    write = core.user.atomic_write_json
+    monkeypatch.setattr(core.user, 'atomic_write_json', lambda *args, **kwargs: (writes.append(args[0]),
+                                                                                  write(*args, **kwargs)))
+    with settings.batch():
+        settings.set('a', 1)
+        settings.set('b', 2)
+        settings.remove('a')
+    assert writes == [settings.file_path]
+    assert read_json(settings.file_path) == {'b': 2}
+
+
+def test_time_values_are_saved_as_strings(tmp_path):
+    settings = UserSettings(directory=str(tmp_path), name='options', user='user')
+    time_start = datetime.datetime(2020, 5, 1, 12, 30)
+    settings.set('time_start', time_start)
+    assert read_json(settings.file_path) == {'time_start': '2020-05-01 12:30:00'}
+    assert settings.get('time_start') == time_start
+    assert UserSettings(directory=str(tmp_path), name='options', user='user').get('time_start') == time_start
+
+
+def get_user_manager(users_directory):
+    user_manager = UserManager(users_directory)
+    user_manager.set_users_directory(users_directory)
+    user_manager.add_user_settings(users_directory=users_directory, settings_type='basic', settings_name='options')
+    return user_manager
+
+
+def test_users_are_cached_per_directory(tmp_path, monkeypatch):
+    first_directory = str(tmp_path / 'first')
+    second_directory = str(tmp_path / 'second')
+    user_manager = get_user_manager(first_directory)
+    user_manager.add_user('user')
+    user = user_manager.users['user']
+    user_manager.set_users_directory(second_directory)
+    assert user_manager.get_user_list() == []
+
+    def listdir(path):
+        raise AssertionError('Cached directory listed again')
+
+    monkeypatch.setattr(os, 'listdir', listdir)
+    user_manager.set_users_directory(first_directory)
+    assert user_manager.users['user'] is user
+
+
+def test_new_user_directory_is_found_when_checking_modified(tmp_path):
+    users_directory = str(tmp_path)
+    user_manager = get_user_manager(users_directory)
+    user_manager.add_user('user')
+    os.mkdir(os.path.join(users_directory, 'other'))
+
+    user_manager.set_users_directory(users_directory)
+    assert user_manager.get_user_list() == ['user']
+    user_manager.set_users_directory(users_directory, check_modified=True)
+    assert user_manager.get_user_list() == ['other', 'user']
+
+
+def test_priority_is_found_by_alias_and_case(tmp_path):
+    priority = UserSettingsPriorityList(directory=str(tmp_path), name='priority', user='user')
+    priority.set_priority('TEMP')
+    assert priority.get_priority(['PSAL', 'temp']) == 'temp'
+    assert priority.get_priority(['PSAL', 'SEA_WATER_TEMPERATURE']) == 'SEA_WATER_TEMPERATURE'
+
+
+def test_priority_uses_default_prefix(tmp_path):
+    priority = UserSettingsPriorityList(directory=str(tmp_path), name='priority', user='user')
+    assert priority.get_priority(['TEMP', 'CHL_A']) == 'CHL_A'
+    assert priority.get('priority_list') == ['CHL_A']
+    assert priority.get_priority(['TEMP', 'PSAL']) == 'TEMP'
+
+
+def test_layered_user_reads_from_parent(tmp_path):
+    user_manager = get_user_manager(str(tmp_path))
+    user_manager.add_user('template')
+    user_manager.users['template'].options.set('color', 'red')
+    user_manager.users['template'].options.set('limits', [0, 10])
+    user_manager.add_user('layer', 'template')
+    layer = user_manager.users['layer']
+
+    assert layer.options.get('color') == 'red'
+    assert layer.options.get_settings() == {'color': 'red', 'limits': [0, 10]}
+
+    user_manager.users['template'].options.set('color', 'blue')
+    assert layer.options.get('color') == 'blue'
+
+
+def test_layered_user_only_stores_changes(tmp_path):
+    user_manager = get_user_manager(str(tmp_path))
+    user_manager.add_user('template')
+    user_manager.users['template'].options.set('color', 'red')
+    user_manager.add_user('layer', 'template')
+    layer = user_manager.users['layer']
+
+    layer.options.set('color', 'red')
+    layer.options.set('width', 2)
+    user_manager.flush()
+    assert read_json(layer.options.file_path) == {'width': 2}
+
+    layer.options.remove('width')
+    layer.options.set('color', 'green')
+    user_manager.flush()
+    assert read_json(layer.options.file_path) == {'color': 'green'}
+    assert user_manager.users['template'].options.get('color') == 'red'
+
+
+def test_layered_user_gets_copies(tmp_path):
+    user_manager = get_user_manager(str(tmp_path))
+    user_manager.add_user('template')
+    user_manager.users['template'].options.set('limits', [0, 10])
+    user_manager.add_user('layer', 'template')
+
+    user_manager.users['layer'].options.get('limits').append(20)
+    user_manager.users['layer'].options.get_settings()['limits'].append(30)
+    assert user_manager.users['template'].options.get('limits') == [0, 10]
+
+
+def test_plain_user_get_settings_is_live(tmp_path):
+    user_manager = get_user_manager(str(tmp_path))
+    user_manager.add_user('user')
+    options = user_manager.users['user'].options
+    options.set('limits', [0, 10])
+
+    options.get_settings()['color'] = 'red'
+    options.get('limits').append(20)
+    assert options.get('color') == 'red'
+    assert options.get('limits') == [0, 10, 20]
+
+
+def test_layered_user_set_array_value(tmp_path):
+    user_manager = get_user_manager(str(tmp_path))
+    user_manager.add_user('template')
+    user_manager.users['template'].options.set('limits', [0, 10])
+    user_manager.add_user('layer', 'template')
+    layer = user_manager.users['layer']
+
+    layer.options.set('limits', np.array([0, 10]), save=False)
+    assert isinstance(layer.options.data['limits'], np.ndarray)
+    layer.options.set('other', pd.Series([1, 2]), save=False)
+    assert 'other' in layer.options.data
+
+
+def get_mirrored_user_manager(share_directory, local_directory):
+    user_manager = UserManager(share_directory)
+    user_manager.add_mirror(share_directory, local_directory, background_pull=False)
+    user_manager.set_users_directory(share_directory)
+    user_manager.add_user_settings(users_directory=share_directory, settings_type='basic', settings_name='options')
+    return user_manager
+
+
+def test_mirror_merges_changes_from_two_workstations(tmp_path):
+    share_directory = str(tmp_path / 'share')
+    first = get_mirrored_user_manager(share_directory, str(tmp_path / 'first'))
+    first.add_user('user')
+    first.users['user'].options.set('a', 1)
+    first.flush()
+
+    second = get_mirrored_user_manager(share_directory, str(tmp_path / 'second'))
+    assert second.users['user'].options.get('a') == 1
+
+    second.users['user'].options.set('b', 2)
+    second.flush()
+    first.users['user'].options.set('c', 3)
+    first.flush()
+
+    remote_file_path = os.path.join(share_directory, 'user', 'options.json')
+    assert read_json(remote_file_path) == {'a': 1, 'b': 2, 'c': 3}
+    # The merged file is also written to the local copy of the first workstation
+    first.process_mirror_changes()
+    assert first.users['user'].options.get_settings() == {'a': 1, 'b': 2, 'c': 3}
+
+
+def test_mirror_keeps_changes_from_other_workstation_on_full_save(tmp_path):
+    share_directory = str(tmp_path / 'share')
+    first = get_mirrored_user_manager(share_directory, str(tmp_path / 'first'))
+    first.add_user('user')
+    first.users['user'].options.set('a', 1)
+    first.flush()
+    second = get_mirrored_user_manager(share_directory, str(tmp_path / 'second'))
+    second.users['user'].options.set('b', 2)
+    second.flush()
+
+    remote_file_path = os.path.join(share_directory, 'user', 'options.json')
+    first.users['user'].options.save()
+    first.flush()
+    assert read_json(remote_file_path) == {'a': 1, 'b': 2}
+    # Reset removes the keys known by the first workstation
+    second.users['user'].options.set('c', 3)
+    second.flush()
+    first.users['user'].options.reset()
+    first.flush()
+    assert read_json(remote_file_path) == {'c': 3}
+
+
+def test_active_user_removed_on_share_is_replaced(tmp_path):
+    share_directory = str(tmp_path / 'share')
+    user_manager = get_mirrored_user_manager(share_directory, str(tmp_path / 'local'))
+    user_manager.add_user('user')
+    user_manager.set_user('user')
+    user_manager.flush()
+
+    shutil.rmtree(os.path.join(share_directory, 'user'))
+    user_manager.mirrors[share_directory].pull()
+    assert user_manager.process_mirror_changes()
+    assert 'user' not in user_manager.get_user_list()
+    assert user_manager.user.name == 'default'
+
+
+def test_layered_user_priority_list(tmp_path):
+    user_manager = get_user_manager(str(tmp_path))
+    user_manager.add_user_settings(users_directory=str(tmp_path), settings_type='prioritylist',
+                                   settings_name='priority')
+    user_manager.add_user('template')
+    template = user_manager.users['template']
+    template.priority.set_priority('TEMP')
+    user_manager.add_user('layer', 'template')
+    layer = user_manager.users['layer']
+
+    assert layer.priority.data['priority_list'] == []
+    assert layer.priority.get('priority_list') == ['TEMP']
+    assert layer.priority.get_priority(['CPHL', 'TEMP']) == 'TEMP'
+
+    layer.priority.set_priority('CPHL')
+    user_manager.flush()
+    assert read_json(layer.priority.file_path) == {'priority_list': ['CPHL', 'TEMP']}
+    assert template.priority.get('priority_list') == ['TEMP']
+
+
+def test_priority_catalogue_is_reused_for_same_content(tmp_path):
+    priority = UserSettingsPriorityList(directory=str(tmp_path), name='priority', user='user')
+    columns = ['TEMP', 'CHL_A']
+
+    assert priority.get_priority(columns) == 'CHL_A'
+    catalogue = priority.get_catalogue(columns)
+    assert priority.get_catalogue(list(columns)) is catalogue
+
+    # A list changed in place gives a new catalogue and priority
+    columns[1] = 'PSAL'
+    assert priority.get_catalogue(columns) is not catalogue
+    assert priority.get_priority(columns) == 'TEMP'
+    priority.set_priority('PSAL')
+    assert priority.get_priority(columns) == 'PSAL'
+
+
+@pytest.mark.parametrize('refresh', [True, False])
+def test_removed_user_is_not_written(tmp_path, refresh):
+    users_directory = str(tmp_path)
+    user_manager = get_user_manager(users_directory)
+    scheduled = []
+    user_manager.set_save_scheduler(scheduled.append)
+    user_manager.add_user('user')
+    user = user_manager.users['user']
+    user.options.set('a', 1)
+
+    shutil.rmtree(os.path.join(users_directory, 'user'))
+    if refresh:
+        user_manager.refresh_users_directory(users_directory)
+    else:
+        user_manager.set_users_directory(users_directory, check_modified=True)
+    assert 'user' not in user_manager.get_user_list()
+    for flush in scheduled:
+        flush()
+    user.options.set('b', 2)
+    user_manager.flush()
+    assert not os.path.exists(os.path.join(users_directory, 'user'))
@@ -0,0 +1,38 @@
+# Copyright (c) 2018 SMHI, Swedish Meteorological and Hydrological Institute
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+"""
+Tests for core.utils.
+"""
+import pytest
+
+from core.utils import get_sorted_list_changes
+
+
+def apply_changes(items, delete_indexes, insert_items):
+    """
+    Applies the changes the way a tk menu does, one entry at a time.
+    """
+    items = list(items)
+    for i in delete_indexes:
+        del items[i]
+    for i, item in insert_items:
+        items.insert(i, item)
+    return items
+
+
+@pytest.mark.parametrize('old_items, new_items', [
+    ([], ['a', 'b']),
+    (['a', 'b'], []),
+    (['a', 'c', 'e'], ['b', 'c', 'd', 'f']),
+    (['a', 'b', 'c'], ['a', 'c']),
+    (['b'], ['a', 'b', 'c']),
+])
+def test_sorted_list_changes_give_new_list(old_items, new_items):
+    delete_indexes, insert_items = get_sorted_list_changes(old_items, new_items)
+    assert apply_changes(old_items, delete_indexes, insert_items) == new_items
+
+
+def test_unchanged_items_are_not_touched():
+    delete_indexes, insert_items = get_sorted_list_changes(['a', 'b', 'd'], ['a', 'c', 'd'])
+    assert delete_indexes == [1]
+    assert insert_items == [(1, 'c')]